@@ -0,0 +1,267 @@
+# app/autosave.py - BACKGROUND AUTOSAVE AND CRASH RECOVERY
+
+import glob
+import itertools
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
+
+from app.project_io import PROJECT_EXTENSION, ProjectFile, save_project
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# Where recovery snapshots live - outside the temp dir, so they survive a reboot
+RECOVERY_DIR = os.environ.get(
+    "IMAGEFORGE_RECOVERY_DIR",
+    os.path.join(os.path.expanduser("~"), ".imageforge", "recovery")
+)
+
+# Seconds between autosave passes
+AUTOSAVE_INTERVAL = 60
+
+# **NEW: Every session holds an exclusive lock on ``<session>.lock`` while it
+# runs; its recovery files are ``<session>-<n>.ifp``. A file is only left
+# over from a crash once its session's lock can be taken - the OS drops the
+# lock when the process dies, however it dies**
+LOCK_EXTENSION = ".lock"
+
+
+class StaleSnapshot(Exception):
+    """The document was edited while its autosave was reading it"""
+
+
+class _LayerSnapshot:
+    """What a save reads from a layer, frozen on the UI thread
+
+    Pixel buffers are shared, not copied - a save that overlaps an edit is
+    detected through the history version and abandoned.
+    """
+
+    def __init__(self, layer):
+        self.size = layer.size
+        self.fill = layer.fill
+        self.materialized = layer.materialized
+        self.pixels = layer.pixels if layer.materialized else None
+        self.source = layer.source
+        # Dirty rows as of now; what the save records goes to the real layer
+        self.row_edits = layer.row_edits.copy()
+        self.saved_tiles = layer.saved_tiles
+        self._properties = layer.get_properties()
+
+    def get_properties(self):
+        return dict(self._properties)
+
+
+class _DocumentSnapshot:
+    def __init__(self, doc, project):
+        self.layers = [_LayerSnapshot(layer) for layer in doc.layers]
+        self.size = doc.size
+        self.active_layer_index = doc.active_layer_index
+        self.project = project
+        self.version = doc.history_manager.version
+
+
+class Autosaver:
+    """**NEW: Periodic crash-recovery snapshots of every edited document**
+
+    Each document gets its own recovery project in ``directory``. Call
+    ``tick()`` from the UI thread: it freezes the layer stack of one
+    document that changed since its last snapshot (no pixels are copied)
+    and saves it on a background thread. Saves are incremental - only
+    tiles whose content is not in the recovery file yet are appended - and
+    a save that overlaps an edit is thrown away before it is committed, to
+    be retried on the next tick.
+    """
+
+    def __init__(self, directory: str = RECOVERY_DIR):
+        self.directory = directory
+        self._entries: Dict[Any, Dict[str, Any]] = {}
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="imageforge-autosave")
+        self._pending = None
+        self.session = f"{int(time.time())}-{os.getpid()}"
+        self._serial = itertools.count()
+        self._locks: Dict[str, Any] = {}  # session -> open, locked lock file
+        self.saves = 0
+        self.stale = 0
+
+    @property
+    def busy(self) -> bool:
+        return self._pending is not None and not self._pending.done()
+
+    def tick(self, documents) -> bool:
+        """Start a background save of the next changed document; False if nothing to do"""
+        if self.busy:
+            return False
+        self._pending = None
+
+        for doc in [doc for doc in self._entries if doc not in documents]:
+            self.discard(doc)
+
+        for doc in documents:
+            if doc.loading:
+                continue
+            entry = self._entries.get(doc)
+            if entry is None:
+                entry = self._entries[doc] = self._new_entry()
+            if entry['version'] == doc.history_manager.version:
+                continue
+            snapshot = _DocumentSnapshot(doc, entry['project'])
+            self._pending = self._executor.submit(self._save, doc, entry, snapshot)
+            return True
+        return False
+
+    def adopt(self, doc, path: str):
+        """Keep autosaving a recovered document into the file it came from"""
+        self._hold(_session_of(path))  # Its file now belongs to this session too
+        self._entries[doc] = {'path': path, 'project': ProjectFile(path), 'version': doc.history_manager.version}
+
+    def discard(self, doc):
+        """Forget a document (closed normally) and delete its recovery file"""
+        entry = self._entries.pop(doc, None)
+        if entry is None:
+            return
+        if entry['project'] is not None:
+            entry['project'].close()
+        _remove(entry['path'])
+
+    def shutdown(self):
+        """Clean exit: wait for a save in flight, then delete every recovery file and lock"""
+        self._executor.shutdown(wait=True)
+        for doc in list(self._entries):
+            self.discard(doc)
+        for session, lock in self._locks.items():
+            lock.close()
+            _remove(_lock_path(self.directory, session))
+        self._locks.clear()
+
+    def _hold(self, session: str):
+        if session in self._locks:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        lock = _try_lock(_lock_path(self.directory, session))
+        if lock is None:
+            raise RuntimeError(f"Recovery session {session} is in use by another ImageForge")
+        self._locks[session] = lock
+
+    def _new_entry(self) -> Dict[str, Any]:
+        name = f"{self.session}-{next(self._serial)}{PROJECT_EXTENSION}"
+        # Version 0 is a document as opened or created - never edited, never snapshotted
+        return {'path': os.path.join(self.directory, name), 'project': None, 'version': 0}
+
+    def _save(self, doc, entry, snapshot):
+        def check(done, total):
+            if doc.history_manager.version != snapshot.version:
+                raise StaleSnapshot()
+
+        start = time.perf_counter()
+        try:
+            self._hold(self.session)
+            entry['project'] = save_project(snapshot, entry['path'], check, metadata={
+                'filename': doc.filename,
+                'saved_at': time.time(),
+            })
+            entry['version'] = snapshot.version
+            self.saves += 1
+            if self._entries.get(doc) is not entry:
+                _remove(entry['path'])  # Closed while this save was running
+                return
+            print(f"💾 Autosaved {os.path.basename(doc.filename)} in {(time.perf_counter() - start) * 1000:.0f}ms")
+        except StaleSnapshot:
+            self.stale += 1  # Edited mid-save - the next tick tries again
+        except Exception as e:
+            print(f"❌ Autosave error: {e}")
+
+
+def find_recovered(directory: str = RECOVERY_DIR) -> List[Dict[str, Any]]:
+    """Recovery snapshots left behind by sessions that are no longer running"""
+    alive = {}  # session -> still locked by a running ImageForge
+    for lock_path in glob.glob(os.path.join(directory, "*" + LOCK_EXTENSION)):
+        session = os.path.basename(lock_path)[:-len(LOCK_EXTENSION)]
+        lock = _try_lock(lock_path)
+        alive[session] = lock is None
+        if lock is not None:
+            lock.close()  # Its owner is gone
+
+    def orphaned(path):
+        return not alive.get(_session_of(path), False)
+
+    recovered = []
+    for path in sorted(glob.glob(os.path.join(directory, "*" + PROJECT_EXTENSION))):
+        if not orphaned(path):
+            continue  # Another running ImageForge owns it
+        try:
+            project = ProjectFile(path)
+        except Exception as e:
+            print(f"❌ Unreadable recovery file {path}: {e}")
+            continue
+        metadata = project.manifest.get('metadata', {})
+        project.close()
+        recovered.append({
+            'path': path,
+            'filename': metadata.get('filename', os.path.basename(path)),
+            'saved_at': metadata.get('saved_at'),
+        })
+    # Saves interrupted by the crash
+    for temp_path in glob.glob(os.path.join(directory, "*" + PROJECT_EXTENSION + ".saving")):
+        if orphaned(temp_path):
+            _remove(temp_path)
+    for session, locked in alive.items():
+        if not locked:
+            _remove(_lock_path(directory, session))
+    return recovered
+
+
+def restore(recovered: Dict[str, Any]):
+    """Document from a recovery snapshot, under its original name
+
+    It has no project file of its own - saving asks where to put it.
+    """
+    from app.core import Document
+
+    doc = Document.open_project(recovered['path'])
+    doc.filename = recovered['filename']
+    doc.project = None
+    return doc
+
+
+def discard_recovered(recovered: List[Dict[str, Any]]):
+    for item in recovered:
+        _remove(item['path'])
+
+
+def _session_of(path: str) -> str:
+    """Session a recovery file belongs to, from its ``<session>-<n>.ifp`` name"""
+    return os.path.basename(path).rsplit("-", 1)[0]
+
+
+def _lock_path(directory: str, session: str) -> str:
+    return os.path.join(directory, session + LOCK_EXTENSION)
+
+
+def _try_lock(path: str):
+    """``path`` opened and exclusively locked, or None if another process holds it"""
+    f = open(path, 'a+b')
+    try:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        f.close()
+        return None
+    return f
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        print(f"❌ Could not remove {path}: {e}")
@@ -0,0 +1,341 @@
+# app/batch.py - HEADLESS BATCH PROCESSING
+"""Apply a pipeline of operations to a folder of images, without the GUI.
+
+    python -m app.batch photos/ -o out/ --max-side 2048 --adjust contrast=1.1 \\
+        --filter sharpen --format jpg --quality 85
+
+Operations run in the order they are given on the command line. Each file
+is opened as a ``Document``, processed layer by layer, flattened by the
+compositor and encoded in a worker process. Nothing here imports tkinter.
+"""
+
+import argparse
+import glob
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from multiprocessing import get_context
+from typing import Any, Dict, List, Optional, Tuple
+from PIL import Image, ImageEnhance, ImageFilter
+
+from app.core import Document
+from app.export import EXPORT_FORMATS, flatten, write_image
+from app.project_io import PROJECT_EXTENSION
+
+INPUT_EXTENSIONS = (".jpg", ".jpeg", ".png", ".gif", ".bmp", ".tif", ".tiff", ".webp", PROJECT_EXTENSION)
+
+# Bytes of decoded pixels the files in flight may add up to
+DEFAULT_MEMORY_BUDGET = 1024 * 1024 * 1024
+
+# A file in flight holds its layer, the flattened copy and encoder buffers
+MEMORY_PER_PIXEL = 4 * 3
+
+ADJUSTMENTS = {
+    'brightness': ImageEnhance.Brightness,
+    'contrast': ImageEnhance.Contrast,
+    'saturation': ImageEnhance.Color,
+    'sharpness': ImageEnhance.Sharpness,
+}
+
+FILTERS = {
+    'blur': lambda radius=2.0: ImageFilter.GaussianBlur(float(radius)),
+    'sharpen': lambda radius=2.0, percent=150: ImageFilter.UnsharpMask(float(radius), int(percent)),
+    'median': lambda size=3: ImageFilter.MedianFilter(int(size)),
+    'edges': lambda: ImageFilter.EDGE_ENHANCE,
+    'smooth': lambda: ImageFilter.SMOOTH,
+}
+
+
+# Operations - each takes a document and the argument given on the command line
+
+def op_resize(doc, spec: str):
+    """``WxH``, ``W`` or ``xH`` (the other side keeps the aspect ratio), or ``N%``"""
+    width, height = doc.size
+    if spec.endswith("%"):
+        scale = float(spec[:-1]) / 100
+        size = (round(width * scale), round(height * scale))
+    else:
+        w, _, h = spec.lower().partition("x")
+        if w and h:
+            size = (int(w), int(h))
+        elif w:
+            size = (int(w), round(height * int(w) / width))
+        else:
+            size = (round(width * int(h) / height), int(h))
+    _resize_layers(doc, (max(1, size[0]), max(1, size[1])))
+
+
+def op_max_side(doc, spec: str):
+    """Shrink so the longest side is at most ``N`` pixels (never enlarges)"""
+    limit = int(spec)
+    width, height = doc.size
+    if max(width, height) > limit:
+        scale = limit / max(width, height)
+        _resize_layers(doc, (max(1, round(width * scale)), max(1, round(height * scale))))
+
+
+def op_adjust(doc, spec: str):
+    """``name=factor[,name=factor...]`` - brightness, contrast, saturation, sharpness (1.0 = unchanged)"""
+    for item in spec.split(","):
+        name, _, factor = item.partition("=")
+        enhancer = ADJUSTMENTS.get(name.strip().lower())
+        if enhancer is None:
+            raise ValueError(f"Unknown adjustment: {name} (choose from {', '.join(ADJUSTMENTS)})")
+        _map_color(doc, lambda rgb: enhancer(rgb).enhance(float(factor)))
+
+
+def op_filter(doc, spec: str):
+    """``name[:arg[:arg]]`` - blur, sharpen, median, edges, smooth"""
+    name, *args = spec.split(":")
+    make = FILTERS.get(name.strip().lower())
+    if make is None:
+        raise ValueError(f"Unknown filter: {name} (choose from {', '.join(FILTERS)})")
+    image_filter = make(*args)
+    for layer in doc.layers:
+        if not layer.flat:  # A flat color filters to itself
+            layer.image = layer.image.filter(image_filter)
+
+
+def op_grayscale(doc, spec: Optional[str] = None):
+    _map_color(doc, lambda rgb: rgb.convert("L").convert("RGB"))
+
+
+OPERATIONS = {
+    'resize': op_resize,
+    'max_side': op_max_side,
+    'adjust': op_adjust,
+    'filter': op_filter,
+    'grayscale': op_grayscale,
+}
+
+
+def _resize_layers(doc, size: Tuple[int, int]):
+    for layer in doc.layers:
+        if layer.flat:
+            layer.size = size  # Still just a fill - nothing to resample
+        else:
+            # Premultiplied, so transparent pixels don't bleed into edges
+            resized = layer.image.convert("RGBa").resize(size, Image.Resampling.LANCZOS)
+            layer.image = resized.convert("RGBA")
+
+
+def _map_color(doc, adjust):
+    """Apply an RGB -> RGB function to every layer, leaving alpha alone"""
+    for layer in doc.layers:
+        if layer.flat:
+            pixel = adjust(Image.new("RGB", (1, 1), layer.fill[:3])).getpixel((0, 0))
+            layer.fill = tuple(pixel) + (layer.fill[3],)
+            continue
+        image = layer.image
+        result = adjust(image.convert("RGB"))
+        result.putalpha(image.getchannel("A"))
+        layer.image = result
+
+
+# Worker process
+
+def _init_worker():
+    # Document and history chatter from many processes would drown the report
+    sys.stdout = open(os.devnull, "w")
+
+
+def process_file(path: str, pipeline: List[Tuple[str, Optional[str]]], output: str,
+                 options: Dict[str, Any]) -> Dict[str, Any]:
+    """Open, run the pipeline, flatten and encode one file (runs in a worker process)"""
+    start = time.perf_counter()
+    doc = Document.load(path)
+    source_size = doc.size
+    for name, arg in pipeline:
+        OPERATIONS[name](doc, arg)
+    image = flatten(doc.layers)
+    write_image(image, output, options)
+    doc.history_manager.clear()
+    return {
+        'input': path,
+        'output': output,
+        'source_size': source_size,
+        'size': image.size,
+        'seconds': time.perf_counter() - start,
+    }
+
+
+# Driver
+
+def collect_inputs(inputs: List[str], recursive: bool = False) -> List[str]:
+    files = []
+    for item in inputs:
+        if os.path.isdir(item):
+            pattern = os.path.join(item, "**", "*") if recursive else os.path.join(item, "*")
+            files.extend(p for p in sorted(glob.glob(pattern, recursive=recursive))
+                         if os.path.isfile(p) and p.lower().endswith(INPUT_EXTENSIONS))
+        else:
+            files.append(item)
+    return files
+
+
+def output_path(path: str, output_dir: str, extension: Optional[str]) -> str:
+    name, ext = os.path.splitext(os.path.basename(path))
+    if extension is None:
+        extension = ext.lower() if ext.lower() in EXPORT_FORMATS else ".png"
+    return os.path.join(output_dir, name + extension)
+
+
+def output_paths(files: List[str], output_dir: str, extension: Optional[str]) -> List[str]:
+    """Output path of each input - later inputs that would overwrite an earlier
+    one's result (``photo.jpg`` and ``photo.png``, or the same name in two
+    folders) get a ``-2``, ``-3``... suffix instead"""
+    outputs = []
+    taken = set()
+    for path in files:
+        output = output_path(path, output_dir, extension)
+        stem, ext = os.path.splitext(output)
+        suffix = 1
+        while output.lower() in taken:  # Case-insensitive filesystems clash too
+            suffix += 1
+            output = f"{stem}-{suffix}{ext}"
+        taken.add(output.lower())
+        outputs.append(output)
+    return outputs
+
+
+def estimate_bytes(path: str) -> int:
+    """Memory a file will need in flight, from its header alone"""
+    try:
+        if path.lower().endswith(PROJECT_EXTENSION):
+            from app.project_io import ProjectFile
+            project = ProjectFile(path)
+            width, height = project.manifest['size']
+            layers = len(project.manifest['layers'])
+            project.close()
+            return width * height * 4 * (layers + 2)
+        with Image.open(path) as image:
+            width, height = image.size
+        return width * height * MEMORY_PER_PIXEL
+    except Exception:
+        return 0  # Unreadable - the worker will report why
+
+
+def run_batch(files: List[str], pipeline, output_dir: str, extension: Optional[str] = None,
+              options: Optional[Dict[str, Any]] = None, workers: Optional[int] = None,
+              memory_budget: int = DEFAULT_MEMORY_BUDGET, report=print) -> Dict[str, Any]:
+    """Process ``files`` on a process pool and report each one as it completes
+
+    Files are submitted in order while the estimated memory of those in
+    flight stays within ``memory_budget`` (one file is always allowed, however
+    large) and no more than two per worker are queued. Returns a summary.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    workers = workers or os.cpu_count() or 1
+    options = options or {}
+    outputs = output_paths(files, output_dir, extension)
+    for path, output in zip(files, outputs):
+        if output != output_path(path, output_dir, extension):
+            report(f"⚠️ {path}: output name already taken, writing {os.path.basename(output)}")
+    queue = list(reversed(list(zip(files, outputs))))
+    in_flight = {}
+    in_flight_bytes = 0
+    done = failed = 0
+    megapixels = 0.0
+    start = time.perf_counter()
+
+    # Spawned, not forked: a fork of a process whose worker threads hold
+    # locks (the shared thread pool, the layer store) can deadlock the child
+    with ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn"),
+                             initializer=_init_worker) as pool:
+        while queue or in_flight:
+            while queue and len(in_flight) < workers * 2:
+                cost = estimate_bytes(queue[-1][0])
+                if in_flight and in_flight_bytes + cost > memory_budget:
+                    break
+                path, output = queue.pop()
+                future = pool.submit(process_file, path, pipeline, output, options)
+                in_flight[future] = (path, cost)
+                in_flight_bytes += cost
+
+            finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                path, cost = in_flight.pop(future)
+                in_flight_bytes -= cost
+                try:
+                    result = future.result()
+                except Exception as e:
+                    failed += 1
+                    report(f"❌ {path}: {e}")
+                    continue
+                done += 1
+                megapixels += result['source_size'][0] * result['source_size'][1] / 1e6
+                w, h = result['size']
+                report(f"✅ {os.path.basename(path)} → {result['output']} {w}x{h} ({result['seconds'] * 1000:.0f}ms)")
+
+    elapsed = time.perf_counter() - start
+    summary = {
+        'files': done,
+        'failed': failed,
+        'seconds': elapsed,
+        'files_per_second': done / elapsed if elapsed else 0.0,
+        'megapixels_per_second': megapixels / elapsed if elapsed else 0.0,
+    }
+    report(f"📊 {done} done, {failed} failed in {elapsed:.1f}s - "
+           f"{summary['files_per_second']:.2f} files/s, {summary['megapixels_per_second']:.1f} MP/s "
+           f"({workers} workers)")
+    return summary
+
+
+class _PipelineStep(argparse.Action):
+    """Collects every operation flag into one list, in command-line order"""
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        steps = getattr(namespace, 'pipeline', None) or []
+        steps.append((self.dest, values))
+        namespace.pipeline = steps
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="python -m app.batch",
+        description="Run a pipeline of operations over images, headless.",
+    )
+    parser.add_argument("inputs", nargs="+", help="image files or folders")
+    parser.add_argument("-o", "--output", required=True, help="folder for the results")
+    parser.add_argument("-r", "--recursive", action="store_true", help="descend into subfolders")
+
+    ops = parser.add_argument_group("operations (applied in the order given)")
+    ops.add_argument("--resize", action=_PipelineStep, metavar="WxH|W|xH|N%", help=op_resize.__doc__)
+    ops.add_argument("--max-side", dest="max_side", action=_PipelineStep, metavar="N", help=op_max_side.__doc__)
+    ops.add_argument("--adjust", action=_PipelineStep, metavar="NAME=F", help=op_adjust.__doc__)
+    ops.add_argument("--filter", action=_PipelineStep, metavar="NAME[:ARG]", help=op_filter.__doc__)
+    ops.add_argument("--grayscale", action=_PipelineStep, nargs=0, help="drop color")
+
+    out = parser.add_argument_group("export")
+    out.add_argument("--format", choices=sorted({ext[1:] for ext in EXPORT_FORMATS}),
+                     help="output format (default: same as the input, PNG if unsupported)")
+    out.add_argument("--quality", type=int, help="JPEG/WebP quality (1-100)")
+
+    run = parser.add_argument_group("execution")
+    run.add_argument("-j", "--jobs", type=int, help="worker processes (default: CPU count)")
+    run.add_argument("--max-memory", type=int, default=DEFAULT_MEMORY_BUDGET // (1024 * 1024), metavar="MB",
+                     help="memory budget for the files in flight (default: %(default)s)")
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    pipeline = [(name, None if values == [] else values) for name, values in (getattr(args, 'pipeline', None) or [])]
+    files = collect_inputs(args.inputs, args.recursive)
+    if not files:
+        print("❌ No input images found")
+        return 1
+
+    extension = f".{args.format}" if args.format else None
+    options = {} if args.quality is None else {'quality': args.quality}
+    steps = " → ".join(name if arg is None else f"{name}({arg})" for name, arg in pipeline) or "no operations"
+    print(f"📁 {len(files)} files: {steps} → {args.format or 'same format'}")
+
+    summary = run_batch(files, pipeline, args.output, extension, options, args.jobs,
+                        args.max_memory * 1024 * 1024)
+    return 1 if summary['failed'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,94 @@
+# app/compositor.py - LAYER COMPOSITOR
+
+from typing import List, Optional
+from PIL import Image
+import numpy as np
+
+from app.layer_store import BAND_ROWS, get_layer_store
+from app.tiles import TILE_SIZE
+from app.utils import image_view, opacity_table
+
+
+def composite_layers(layers: List) -> Optional[Image.Image]:
+    """Blend visible layers bottom to top into a new image
+
+    The result owns one buffer that every layer is composited into. Work
+    goes band by band (``BAND_ROWS`` rows across all layers), so out-of-core
+    layers are only paged in a band at a time. Layers that are still
+    symbolic fills are never allocated (layers still in a project file are
+    decoded here, once), and only the ``TILE_SIZE`` tiles of
+    a band that hold any non-transparent pixels are blended.
+    """
+    visible = [layer for layer in layers if layer.visible]
+    if not visible:
+        return None
+
+    store = get_layer_store()
+    bottom = visible[0]
+    width, height = bottom.size
+    pixels = store.allocate(width, height, bottom.fill if bottom.flat else (0, 0, 0, 0))
+    composite = image_view(pixels)
+
+    overlays = [
+        layer for layer in visible[1:]
+        if layer.opacity > 0 and not layer.is_empty and layer.size == bottom.size
+    ]
+    flat_overlays = {}
+
+    for y1 in range(0, height, BAND_ROWS):
+        y2 = min(height, y1 + BAND_ROWS)
+        store.touch(pixels, y1, y2)
+        if not bottom.flat:
+            store.touch(bottom.pixels, y1, y2)
+            pixels[y1:y2] = bottom.pixels[y1:y2]
+
+        for layer in overlays:
+            if layer.flat:
+                # Constant-color layer: one flat overlay, reused for every band
+                overlay = flat_overlays.get(layer)
+                if overlay is None or overlay.height != y2 - y1:
+                    fill = layer.fill[:3] + (int(layer.fill[3] * layer.opacity),)
+                    overlay = flat_overlays[layer] = Image.new("RGBA", (width, y2 - y1), fill)
+                composite.alpha_composite(overlay, (0, y1))
+                continue
+
+            store.touch(layer.pixels, y1, y2)
+            _blend_band(composite, layer, y1, y2)
+
+    return composite
+
+
+def _blend_band(composite: Image.Image, layer, y1: int, y2: int):
+    """Alpha-composite the occupied tiles of one band of ``layer``"""
+    band = layer.pixels[y1:y2]
+    occupied = tile_occupancy(band).any(axis=0)
+    if not occupied.any():
+        return
+
+    table = opacity_table(layer.opacity) if layer.opacity < 1.0 else None
+    if occupied.all():
+        # Whole rows are contiguous - blend the band straight from the layer buffer
+        spans = [(0, composite.width)]
+    else:
+        spans = [
+            (int(tx) * TILE_SIZE, min(composite.width, (int(tx) + 1) * TILE_SIZE))
+            for tx in np.nonzero(occupied)[0]
+        ]
+
+    for x1, x2 in spans:
+        if table is not None:
+            source = band[:, x1:x2].copy()
+            source[..., 3] = table[source[..., 3]]
+        else:
+            source = np.ascontiguousarray(band[:, x1:x2])
+        composite.alpha_composite(image_view(source), (x1, y1))
+
+
+def tile_occupancy(pixels: np.ndarray) -> np.ndarray:
+    """Grid of ``TILE_SIZE`` tiles holding any pixel with non-zero alpha"""
+    height, width = pixels.shape[:2]
+    if not height or not width:
+        return np.zeros((0, 0), dtype=bool)
+    alpha = pixels[..., 3]
+    rows = np.maximum.reduceat(alpha, np.arange(0, height, TILE_SIZE), axis=0)
+    return np.maximum.reduceat(rows, np.arange(0, width, TILE_SIZE), axis=1) > 0
@@ -1,10 +1,17 @@
 # app/core.py - COMPLETE VERSION WITH MULTI-DOCUMENT SUPPORT
 import os
 import threading
+from contextlib import contextmanager
 from typing import Dict, Optional, Callable, TYPE_CHECKING, List
-from PIL import Image, ImageTk
+from PIL import Image
 import numpy as np
 from app.history import HistoryManager
+from app.utils import image_view, opacity_table
+from app.layer_store import get_layer_store, BAND_ROWS
+from app.image_io import read_image, read_preview
+from app.project_io import ProjectFile, is_project, save_project
+from app.tiles import TILE_SIZE
+from app.workers import get_thread_pool
 
 if TYPE_CHECKING:
     from tools.base_tool import BaseTool
@@ -20,15 +27,218 @@ class Document:
         self.offset_y = 0
         self.history_manager = HistoryManager()
         
+        # **NEW: Lazy open - while the full image decodes in the background the
+        # document shows a reduced preview and refuses edits**
+        self.loading = False
+        self.preview = None
+        self._load_future = None
+        self._load_layer = None
+        
+        # **NEW: Project file this document was opened from or last saved to**
+        self.project = None
+        self.export_path = None  # Last export target, reused by File > Export
+        
         # Initialize with a background layer
         if image:
-            bg_layer = Layer("Background")
-            bg_layer.image = image
-            self.layers.append(bg_layer)
+            self.layers.append(Layer.from_image("Background", image))
         else:
-            bg_layer = Layer("Background", width, height)
-            bg_layer.image = Image.new("RGBA", (width, height), (255, 255, 255, 255))
-            self.layers.append(bg_layer)
+            self.layers.append(Layer("Background", width, height, fill=(255, 255, 255, 255)))
+
+    @classmethod
+    def load(cls, filename):
+        """Document with the file fully decoded (safe to call on a worker thread)"""
+        if is_project(filename):
+            return cls.open_project(filename)
+        return cls(filename=filename, image=read_image(filename, mode=None))
+
+    @classmethod
+    def open_lazy(cls, filename):
+        """Document sized from the file header, with its pixels decoded on a worker thread"""
+        if is_project(filename):
+            return cls.open_project(filename)  # Projects decode per layer on first use anyway
+        preview, (width, height) = read_preview(filename)
+        doc = cls(filename=filename, width=width, height=height)
+        doc.layers[0].fill = (0, 0, 0, 0)
+        doc.loading = True
+        doc._load_layer = doc.layers[0]
+        doc.preview = preview
+        doc._load_future = get_thread_pool().submit(read_image, filename, None)
+        return doc
+
+    @classmethod
+    def open_project(cls, filename):
+        """**NEW: Document from a project file** - only the manifest is read,
+        each layer's tiles are decoded the first time its pixels are used"""
+        project = ProjectFile(filename)
+        manifest = project.manifest
+        doc = cls(filename=filename, width=manifest['size'][0], height=manifest['size'][1])
+        doc.layers = []
+        for entry, source in zip(manifest['layers'], project.layer_sources()):
+            layer = Layer(entry['name'], *entry['size'], fill=tuple(entry['fill']))
+            layer.set_properties({name: entry[name] for name in Layer.HISTORY_PROPERTIES})
+            layer.source = source
+            doc.layers.append(layer)
+        doc.active_layer_index = max(0, min(manifest.get('active_layer', 0), len(doc.layers) - 1))
+        doc.project = project
+        return doc
+
+    def save(self, filename, progress=None):
+        """**NEW: Save as a project** - back to the same file only new tiles are written"""
+        self.project = save_project(self, filename, progress)
+        self.filename = filename
+
+    def finish_loading(self):
+        """Swap in the full-resolution image once it is decoded
+
+        Returns True once the document is fully loaded; re-raises any decode
+        error. Call from the UI thread.
+        """
+        if not self.loading:
+            return True
+        if not self._load_future.done():
+            return False
+        
+        image = self._load_future.result()
+        self._load_future = None
+        self._load_layer.image = image
+        self._load_layer = None
+        self.loading = False
+        self.preview = None
+        return True
+
+    @property
+    def size(self):
+        return self.layers[0].size if self.layers else (0, 0)
+
+    @property
+    def active_layer(self):
+        if not self.layers:
+            return None
+        return self.layers[max(0, min(self.active_layer_index, len(self.layers) - 1))]
+
+    # **NEW: Layer operations are history transactions. Only the layer order
+    # and the properties that changed are recorded - layer objects (and their
+    # pixels) are shared by reference, so undoing them copies nothing.**
+
+    def capture_layer_state(self):
+        """Cheap description of the layer stack: object order plus per-layer properties"""
+        return {
+            'order': tuple(self.layers),
+            'props': {layer: layer.get_properties() for layer in self.layers},
+            'active': self.active_layer_index
+        }
+
+    @contextmanager
+    def layer_transaction(self, action_name, coalesce=False):
+        """Record the layer changes made inside the block as one history entry"""
+        before = self.capture_layer_state()
+        yield
+        after = self.capture_layer_state()
+        self.history_manager.push_layers(before, after, action_name, coalesce=coalesce)
+
+    def apply_layer_state(self, order, props, active):
+        """Restore a layer stack recorded by a transaction"""
+        if order is not None:
+            self.layers = list(order)
+        for layer, values in props.items():
+            layer.set_properties(values)
+        self.active_layer_index = max(0, min(active, len(self.layers) - 1))
+
+    def add_layer(self, name=None, index=None):
+        width, height = self.layers[0].size if self.layers else (800, 600)
+        layer = Layer(name or f"Layer {len(self.layers)}", width, height)
+        index = len(self.layers) if index is None else index
+        with self.layer_transaction("New Layer"):
+            self.layers.insert(index, layer)
+            self.active_layer_index = index
+        return layer
+
+    def delete_layer(self, index):
+        if len(self.layers) <= 1 or not 0 <= index < len(self.layers):
+            return False
+        with self.layer_transaction("Delete Layer"):
+            self.layers.pop(index)
+            self.active_layer_index = min(self.active_layer_index, len(self.layers) - 1)
+        return True
+
+    def duplicate_layer(self, index):
+        source = self.layers[index]
+        layer = source.copy()
+        with self.layer_transaction("Duplicate Layer"):
+            self.layers.insert(index + 1, layer)
+            self.active_layer_index = index + 1
+        return layer
+
+    def move_layer(self, index, new_index):
+        new_index = max(0, min(new_index, len(self.layers) - 1))
+        if index == new_index:
+            return False
+        with self.layer_transaction("Move Layer"):
+            layer = self.layers.pop(index)
+            self.layers.insert(new_index, layer)
+            self.active_layer_index = new_index
+        return True
+
+    def merge_down(self, index):
+        """Merge a layer into the one below it as a new layer (the originals stay in history)"""
+        if not 0 < index < len(self.layers):
+            return False
+        upper, lower = self.layers[index], self.layers[index - 1]
+        merged = lower.copy(name=lower.name)
+        if upper.visible and upper.opacity > 0 and not upper.is_empty:
+            merged.image.alpha_composite(upper.get_composited_image())
+        with self.layer_transaction("Merge Down"):
+            self.layers[index - 1:index + 1] = [merged]
+            self.active_layer_index = index - 1
+        return True
+
+    def set_layer_property(self, index, name, value, action_name=None):
+        """Change one layer property; repeated changes (slider drags) merge into one entry"""
+        layer = self.layers[index]
+        if getattr(layer, name) == value:
+            return False
+        with self.layer_transaction(action_name or f"Layer {name.replace('_', ' ').title()}", coalesce=True):
+            setattr(layer, name, value)
+        return True
+
+    def undo(self):
+        """**NEW: Document-level undo - routes each entry to the layer it belongs to**
+
+        Returns (success, bbox).
+        """
+        state = self.history_manager.peek_undo()
+        if state is None:
+            return False, None
+        
+        if state['type'] == 'layers':
+            self.apply_layer_state(*self.history_manager.undo_layers())
+            return True, None
+        
+        layer = self._history_target(state)
+        new_image, success, bbox = self.history_manager.undo(layer.image)
+        if success:
+            layer.replace(new_image, bbox)
+        return success, bbox
+
+    def redo(self):
+        """**NEW: Document-level redo** - returns (success, bbox)"""
+        state = self.history_manager.peek_redo()
+        if state is None:
+            return False, None
+        
+        if state['type'] == 'layers':
+            self.apply_layer_state(*self.history_manager.redo_layers())
+            return True, None
+        
+        layer = self._history_target(state)
+        new_image, success, bbox = self.history_manager.redo(layer.image)
+        if success:
+            layer.replace(new_image, bbox)
+        return success, bbox
+
+    def _history_target(self, state):
+        # Entries from before layer tracking (or image-only callers) belong to the bottom layer
+        return state.get('layer') or self.layers[0]
 
 class AppState:
     def __init__(self, root):
@@ -80,6 +290,19 @@ class AppState:
     
     # In app/core.py - FIXED open_document method
 
+    def add_document(self, doc):
+        """Append an already loaded document and make it active"""
+        self.documents.append(doc)
+        self.active_document_index = len(self.documents) - 1
+        return doc
+
+    def open_document_lazy(self, filename):
+        """**NEW: Open a document without waiting for the full decode**"""
+        doc = self.add_document(Document.open_lazy(filename))
+        print(f"✅ Document opened lazily: {doc.filename} {doc.size}"
+              f"{' with preview' if doc.preview is not None else ''}")
+        return doc
+
     def open_document(self, filename, image):
         """Open document - FIXED VERSION"""
         try:
@@ -93,8 +316,8 @@ class AppState:
             print(f"✅ Document created: {doc.filename}, Layers: {len(doc.layers)}")
             
             # **FIXED: Ensure the layer has a valid image**
-            if doc.layers and doc.layers[0].image:
-                print(f"✅ Layer image size: {doc.layers[0].image.size}")
+            if doc.layers:
+                print(f"✅ Layer image size: {doc.layers[0].size}")
             else:
                 print("❌ No valid layer image")
                 
@@ -136,14 +359,180 @@ class ToolManager:
         return self.app.set_active_tool(tool_name)
 
 class Layer:
-    def __init__(self, name, width=800, height=600):
+    def __init__(self, name, width=800, height=600, fill=(0, 0, 0, 0)):
         self.name = name
-        self.image = Image.new("RGBA", (width, height), (0, 0, 0, 0))
+        # **NEW: Pixels are owned by a contiguous NumPy buffer; ``image`` is a
+        # zero-copy PIL view of it that keeps its identity for the layer's life**
+        # **NEW: Allocate-on-write - until its pixels are first used a layer is
+        # just a size and a fill color. Transparent buffers come from calloc, so
+        # even then pages nothing was painted on are never made resident.**
+        self.size = (width, height)
+        self.fill = tuple(fill)
+        self._pixels = None
+        self._image = None
+        # **NEW: Pixels still in a project file, decoded on first use**
+        self.source = None
+        # **NEW: Dirty tracking for incremental saves** - the edit count at
+        # which each row of tiles last changed, and per project path the
+        # counts and tile digests the layer was last saved there with
+        self.edits = 0
+        self.row_edits = np.zeros((height + TILE_SIZE - 1) // TILE_SIZE, np.int64)
+        self.saved_tiles = {}
         self.visible = True
         self.opacity = 1.0
         self.blend_mode = "normal"
         self.locked = False
         self.mask = None
+
+    @classmethod
+    def from_image(cls, name, image):
+        layer = cls(name, *image.size)
+        layer.image = image
+        return layer
+
+    @property
+    def materialized(self):
+        """False while the layer is still a symbolic single-color fill"""
+        return self._pixels is not None
+
+    @property
+    def flat(self):
+        """True while the layer is nothing but its fill color (no buffer, nothing to decode)"""
+        return self._pixels is None and self.source is None
+
+    @property
+    def is_empty(self):
+        return self.flat and self.fill[3] == 0
+
+    @property
+    def pixels(self):
+        self._materialize()
+        return self._pixels
+
+    @property
+    def image(self):
+        self._materialize()
+        return self._image
+
+    @image.setter
+    def image(self, image):
+        """Copy ``image`` into the layer buffer (reallocated only if the size changes)"""
+        self.replace(image)
+
+    def replace(self, image, bbox=None):
+        """Copy ``image`` into the layer buffer, recording the pixels in ``bbox`` as changed
+
+        Without ``bbox`` the whole layer counts as changed. Pass one only
+        when ``image`` is known to differ from the layer inside it alone
+        (history undo/redo of a region).
+        """
+        if image is self._image:
+            self.mark_dirty(bbox)  # Edited in place - it is already in the buffer
+            return
+        self.source = None  # Every pixel is about to be replaced
+        if image.size != self.size:
+            self.size = image.size
+            self.fill = (0, 0, 0, 0)
+            self._pixels = self._image = None
+            self.row_edits = np.zeros((self.size[1] + TILE_SIZE - 1) // TILE_SIZE, np.int64)
+            self.saved_tiles = {}
+            bbox = None
+        self.mark_dirty(bbox)
+        store = get_layer_store()
+        if not store.is_mapped(self.pixels):
+            self._image.paste(image if image.mode == "RGBA" else image.convert("RGBA"))
+            return
+        # **NEW: Out-of-core layers are written (and converted to RGBA) a band
+        # at a time, so neither the resident set nor a full-size RGBA copy
+        # of the source grows with the layer**
+        width, height = self.size
+        for y in range(0, height, BAND_ROWS):
+            band = image.crop((0, y, width, min(height, y + BAND_ROWS)))
+            store.touch(self._pixels, y, y + BAND_ROWS)
+            self._image.paste(band if band.mode == "RGBA" else band.convert("RGBA"), (0, y))
+
+    def update_region(self, bbox, update):
+        """**NEW: Replace the pixels in ``bbox`` by ``update(region, box)``, a band of rows at a time**
+
+        ``region`` is a copy of the current pixels in ``box`` (a band-high
+        slice of ``bbox``); ``update`` returns the new pixels for it. Only
+        the rows being written are touched, so painting on an out-of-core
+        layer pages in no more than the edited area.
+        """
+        store = get_layer_store()
+        pixels, image = self.pixels, self.image
+        self.mark_dirty(bbox)
+        x1, y1, x2, y2 = bbox
+        while y1 < y2:
+            band_end = min(y2, (y1 // BAND_ROWS + 1) * BAND_ROWS)
+            box = (x1, y1, x2, band_end)
+            store.touch(pixels, y1, band_end)
+            image.paste(update(image.crop(box), box), box[:2])
+            y1 = band_end
+
+    def mark_dirty(self, bbox=None):
+        """**NEW: Record that the pixels in ``bbox`` (default: all of them) changed**
+
+        The image setter, ``update_region`` and history undo/redo record
+        their writes. Call this after writing through ``pixels`` or
+        ``image`` directly - the next save to a project this layer was
+        saved to before only re-reads the rows of tiles recorded here.
+        """
+        y1, y2 = (0, self.size[1]) if bbox is None else (max(0, bbox[1]), min(self.size[1], bbox[3]))
+        if y2 <= y1:
+            return
+        self.edits += 1
+        self.row_edits[y1 // TILE_SIZE:(y2 - 1) // TILE_SIZE + 1] = self.edits
+
+    def _materialize(self):
+        if self._pixels is None:
+            # **NEW: Large layers get a file-backed buffer from the layer store**
+            if self.source is not None:
+                pixels = get_layer_store().allocate(*self.size)
+                self.source.decode_into(pixels)
+                self.source = None
+            else:
+                pixels = get_layer_store().allocate(*self.size, self.fill)
+            self._pixels = pixels
+            self._image = image_view(pixels)
+
+    # Properties tracked by layer history transactions
+    HISTORY_PROPERTIES = ('name', 'visible', 'opacity', 'blend_mode', 'locked')
+
+    def get_properties(self):
+        return {name: getattr(self, name) for name in self.HISTORY_PROPERTIES}
+
+    def set_properties(self, values):
+        for name, value in values.items():
+            setattr(self, name, value)
+
+    def copy(self, name=None):
+        layer = Layer(name or f"{self.name} copy", *self.size, fill=self.fill)
+        if self.materialized:
+            store = get_layer_store()
+            for y in range(0, self.size[1], BAND_ROWS):
+                store.touch(self._pixels, y, y + BAND_ROWS)
+                store.touch(layer.pixels, y, y + BAND_ROWS)
+                layer.pixels[y:y + BAND_ROWS] = self._pixels[y:y + BAND_ROWS]
+        else:
+            layer.source = self.source  # Sources are immutable - share it
+        layer.visible = self.visible
+        layer.opacity = self.opacity
+        layer.blend_mode = self.blend_mode
+        layer.locked = self.locked
+        return layer
+
+    def get_composited_image(self):
+        """Layer pixels with its opacity applied to the alpha channel"""
+        if self.opacity >= 1.0:
+            return self.image
+        if self.flat:
+            return Image.new("RGBA", self.size, self.fill[:3] + (int(self.fill[3] * self.opacity),))
+        pixels = self.pixels.copy()
+        pixels[..., 3] = opacity_table(self.opacity)[self.pixels[..., 3]]
+        return image_view(pixels)
         
     def get_thumbnail(self, size=(64, 64)):
+        if self.flat:
+            return Image.new("RGBA", size, self.fill)
         return self.image.resize(size, Image.Resampling.LANCZOS)
\ No newline at end of file
@@ -0,0 +1,304 @@
+# app/export.py - FLATTEN AND ENCODE FOR EXPORT
+
+import os
+import struct
+import threading
+import zlib
+from collections import deque
+from typing import Any, Dict, Optional, Tuple
+from PIL import Image
+import numpy as np
+
+from app.compositor import composite_layers
+from app.layer_store import get_layer_store
+from app.utils import as_pixels
+from app.workers import get_thread_pool
+
+# File extension -> Pillow format name
+EXPORT_FORMATS = {
+    ".png": "PNG",
+    ".jpg": "JPEG",
+    ".jpeg": "JPEG",
+    ".webp": "WEBP",
+}
+
+# Encoder settings used unless the caller overrides them
+EXPORT_DEFAULTS = {
+    "PNG": {"compress_level": 6},
+    "JPEG": {"quality": 90},
+    "WEBP": {"quality": 90, "method": 4},
+}
+
+# **NEW: PNG is encoded in independent strips of rows, compressed in parallel
+# and written in order - the encoder never holds more than a window of
+# strips, however large the image**
+STRIP_ROWS = 256
+
+# JPEG has no alpha - transparent areas are flattened onto white
+JPEG_BACKGROUND = (255, 255, 255)
+
+
+class ExportCancelled(Exception):
+    """Raised inside an export job once ``cancel()`` has been called"""
+
+
+def export_format(path: str) -> str:
+    """Pillow format name for an export path, from its extension"""
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in EXPORT_FORMATS:
+        raise ValueError(f"Unsupported export format: {ext or path}")
+    return EXPORT_FORMATS[ext]
+
+
+def flatten(layers) -> Image.Image:
+    image = composite_layers(layers)
+    if image is None:
+        raise ValueError("Nothing to export - no visible layers")
+    return image
+
+
+class BackgroundJob:
+    """Work running on its own background thread, polled from the UI thread
+
+    ``progress`` is ``(done, total)`` work units, ``done`` turns True once
+    the job has finished, failed or was cancelled, and ``result()`` returns
+    what ``run()`` returned or re-raises its error. Subclasses call
+    ``check_cancelled()`` between steps.
+    """
+
+    label = "Export"
+
+    def __init__(self):
+        self.progress: Tuple[int, int] = (0, 1)
+        self.error: Optional[BaseException] = None
+        self._result = None
+        self._cancel = threading.Event()
+        self._finished = threading.Event()
+        # Its own thread rather than the shared pool - jobs wait on tasks
+        # they submit to that pool
+        self._thread = threading.Thread(target=self._run, name="imageforge-export", daemon=True)
+
+    def start(self) -> 'BackgroundJob':
+        self._thread.start()
+        return self
+
+    @property
+    def done(self) -> bool:
+        return self._finished.is_set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    def cancel(self):
+        self._cancel.set()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self._finished.wait(timeout)
+
+    def result(self):
+        if self.error is not None:
+            raise self.error
+        return self._result
+
+    def check_cancelled(self):
+        if self._cancel.is_set():
+            raise ExportCancelled(f"{self.label} cancelled")
+
+    def run(self):
+        raise NotImplementedError
+
+    def _run(self):
+        try:
+            self._result = self.run()
+        except BaseException as e:
+            self.error = e
+        finally:
+            self._finished.set()
+
+
+class ExportJob(BackgroundJob):
+    """One image being encoded to a file in the background
+
+    The file is written under a temporary name and only moved into place
+    once complete, so a cancelled or failed export never leaves a partial
+    file. ``result()`` returns the path.
+    """
+
+    def __init__(self, image: Image.Image, path: str, options: Optional[Dict[str, Any]] = None):
+        super().__init__()
+        self.path = path
+        self.format = export_format(path)
+        self.options = options
+        self.label = f"Export of {os.path.basename(path)}"
+        self._image = image
+        self.start()
+
+    def run(self) -> str:
+        try:
+            return write_image(self._image, self.path, self.options, self)
+        finally:
+            self._image = None
+
+
+def write_image(image: Image.Image, path: str, options: Optional[Dict[str, Any]] = None,
+                job: Optional[BackgroundJob] = None) -> str:
+    """Encode ``image`` to ``path`` in the format its extension names
+
+    Written under a temporary name and moved into place once complete. With
+    a ``job``, progress is reported to it and its cancellation aborts the
+    encode.
+    """
+    format = export_format(path)
+    options = dict(EXPORT_DEFAULTS[format], **(options or {}))
+    temp_path = path + ".part"
+    try:
+        with open(temp_path, 'wb') as f:
+            if format == "PNG":
+                write_png(image, f, options.get("compress_level", 6), job)
+            else:
+                if format == "JPEG":
+                    image = flatten_rgb(image)
+                if job is not None:
+                    job.check_cancelled()
+                    f = _CancellableFile(f, job)
+                # Pillow's JPEG and WebP encoders take the whole image at once -
+                # progress jumps to done, but the writes still poll for cancellation
+                image.save(f, format, **options)
+                if job is not None:
+                    job.progress = (1, 1)
+        if job is not None:
+            job.check_cancelled()
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return path
+
+
+def flatten_rgb(image: Image.Image, background=JPEG_BACKGROUND) -> Image.Image:
+    """RGB copy of an RGBA image composited onto a solid background"""
+    flat = Image.new("RGB", image.size, background)
+    flat.paste(image, mask=image.getchannel("A"))
+    return flat
+
+
+class _CancellableFile:
+    """File wrapper that aborts an encoder from inside its next write"""
+
+    def __init__(self, f, job: BackgroundJob):
+        self._f = f
+        self._job = job
+
+    def write(self, data):
+        self._job.check_cancelled()
+        return self._f.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self._f, name)
+
+
+def export_document(doc, path: str, options: Optional[Dict[str, Any]] = None) -> ExportJob:
+    """Flatten ``doc`` on the calling thread and encode it in the background
+
+    Flattening here gives the job a consistent snapshot even if editing
+    continues while it encodes.
+    """
+    export_format(path)  # Fail before flattening
+    return ExportJob(flatten(doc.layers), path, options)
+
+
+# PNG streaming writer
+
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+_ZLIB_HEADER = b"\x78\x01"
+_ADLER_BASE = 65521
+
+
+def write_png(image: Image.Image, f, level: int = 6, job: Optional[BackgroundJob] = None):
+    """Encode an RGBA (or RGB) image as PNG, compressing strips of rows in parallel
+
+    Each strip is filtered and deflated on its own, ending in a sync flush
+    so the pieces concatenate into one valid zlib stream; the checksums of
+    the strips are combined at the end.
+    """
+    pixels = as_pixels(image) if image.mode == "RGBA" else np.asarray(image.convert("RGB"))
+    height, width, channels = pixels.shape
+    color_type = 6 if channels == 4 else 2
+    strips = list(range(0, height, STRIP_ROWS))
+    pool = get_thread_pool()
+    store = get_layer_store()
+
+    f.write(_PNG_SIGNATURE)
+    _png_chunk(f, b"IHDR", struct.pack(">IIBBBBB", width, height, 8, color_type, 0, 0, 0))
+
+    # A bounded window of strips in flight keeps memory flat
+    window = deque()
+    window_size = max(2, (os.cpu_count() or 4) * 2)
+    written = 0
+    checksum = 1
+
+    def write_next():
+        nonlocal written, checksum
+        data, adler, length = window.popleft().result()
+        if job is not None:
+            job.check_cancelled()
+        checksum = _adler32_combine(checksum, adler, length)
+        if written == 0:
+            data = _ZLIB_HEADER + data  # The first strip opens the zlib stream
+        written += 1
+        if written == len(strips):
+            data += struct.pack(">I", checksum)  # ...and the last one closes it
+        _png_chunk(f, b"IDAT", data)
+        if job is not None:
+            job.progress = (written, len(strips))
+
+    for i, y1 in enumerate(strips):
+        last = i == len(strips) - 1
+        store.touch(pixels, y1, y1 + STRIP_ROWS)  # Out-of-core composites page in a strip at a time
+        window.append(pool.submit(_deflate_strip, pixels, y1, min(height, y1 + STRIP_ROWS), level, last))
+        if len(window) >= window_size:
+            write_next()
+    while window:
+        write_next()
+    _png_chunk(f, b"IEND", b"")
+
+
+def _deflate_strip(pixels: np.ndarray, y1: int, y2: int, level: int, last: bool):
+    """Sub-filtered, raw-deflated rows ``y1:y2`` plus their Adler-32 and length"""
+    rows = pixels[y1:y2].reshape(y2 - y1, -1)
+    bpp = pixels.shape[2]
+    filtered = np.empty((y2 - y1, rows.shape[1] + 1), dtype=np.uint8)
+    filtered[:, 0] = 1  # Sub filter: each byte minus the same channel of the pixel to its left
+    filtered[:, 1:bpp + 1] = rows[:, :bpp]
+    np.subtract(rows[:, bpp:], rows[:, :-bpp], out=filtered[:, bpp + 1:])
+    raw = filtered.data
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    data = compressor.compress(raw) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+    return data, zlib.adler32(raw), filtered.nbytes
+
+
+def _adler32_combine(adler1: int, adler2: int, length2: int) -> int:
+    """Adler-32 of two concatenated buffers from the checksums of each (zlib's adler32_combine)"""
+    rem = length2 % _ADLER_BASE
+    sum1 = adler1 & 0xffff
+    sum2 = (rem * sum1) % _ADLER_BASE
+    sum1 += (adler2 & 0xffff) + _ADLER_BASE - 1
+    sum2 += ((adler1 >> 16) & 0xffff) + ((adler2 >> 16) & 0xffff) + _ADLER_BASE - rem
+    if sum1 >= _ADLER_BASE:
+        sum1 -= _ADLER_BASE
+    if sum1 >= _ADLER_BASE:
+        sum1 -= _ADLER_BASE
+    if sum2 >= _ADLER_BASE << 1:
+        sum2 -= _ADLER_BASE << 1
+    if sum2 >= _ADLER_BASE:
+        sum2 -= _ADLER_BASE
+    return sum1 | (sum2 << 16)
+
+
+def _png_chunk(f, kind: bytes, data: bytes):
+    f.write(struct.pack(">I", len(data)))
+    f.write(kind)
+    f.write(data)
+    f.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(kind))))
@@ -1,55 +1,81 @@
 # app/history.py - COMPLETE SMOOTH UNDO/REDO VERSION
 
-import os
 import tempfile
+import itertools
+from collections import deque
 from PIL import Image
 import numpy as np
 from typing import Tuple, Dict, Any, Optional, List
+from app.tiles import TileSnapshot, dedup_stats, unique_tiles
+from app.tile_store import HistoryJournal, get_tile_memory
+from app.workers import get_thread_pool
+
+
+def _mark_dirty(layer, bbox):
+    """A pixel entry is pushed right before its layer is edited - the next
+    project save must re-read the rows it covers (all of them without a bbox)"""
+    if hasattr(layer, 'mark_dirty'):
+        layer.mark_dirty(bbox)
+
 
 class HistoryManager:
     def __init__(self, max_history: int = 30):
-        self.history_stack = []
+        # **NEW: Oldest entries are evicted from the left - O(1) with a deque**
+        self.history_stack = deque()
         self.redo_stack = []
         self.max_history = max_history
         self.temp_dir = tempfile.mkdtemp(prefix="imageforge_")
         
-        # **NEW: Performance optimizations for smooth undo/redo**
-        self.memory_cache = {}
-        self.max_memory_cache = 8  # Increased for better performance
-        self.compression_quality = 4  # Faster compression
+        # **NEW: Snapshots keyed by a unique id, with an explicit count of the
+        # entries that reference them - released as soon as it drops to zero**
+        self.memory_cache: Dict[int, TileSnapshot] = {}
+        self.snapshot_refs: Dict[int, int] = {}
+        self._snapshot_ids = itertools.count()
+        
+        # **NEW: Tile payloads share one byte budget across all documents -
+        # least recently used ones spill to this document's journal from a
+        # background writer, so pushes never wait on disk**
+        self.spill = HistoryJournal(self.temp_dir)
         
         # **NEW: Region-based undo tracking**
         self.region_states = []
         self.enable_partial_undo = True
         
         # **NEW: Smart caching for frequent operations**
-        self.last_full_state = None
-        self.last_full_key = None
+        # Most recent full snapshot per layer - new snapshots share unchanged tiles with it
+        self.last_full_states = {}
+        
+        # **NEW: Command history - strokes are replayed from the nearest pixel checkpoint.
+        # A new checkpoint is stored once replaying back to it would cost more than this.**
+        self.max_replay_cost = 0.25  # seconds
+        
+        # **NEW: Bumped by every push, undo and redo - lets autosave tell whether
+        # the document changed since it last looked**
+        self.version = 0
         
         print(f"✅ Smooth HistoryManager initialized (max: {max_history})")
 
-    def push(self, image: Image.Image, action_name: str = "Action", bbox: Optional[Tuple] = None) -> bool:
-        """Save state to history - OPTIMIZED FOR SMOOTH OPERATION"""
+    def push(self, image: Image.Image, action_name: str = "Action", bbox: Optional[Tuple] = None,
+             layer=None) -> bool:
+        """Save state to history - OPTIMIZED FOR SMOOTH OPERATION
+
+        ``layer`` is the layer ``image`` belongs to; ``Document.undo`` uses it
+        to route the entry back to the right layer.
+        """
+        self.version += 1
+        _mark_dirty(layer, bbox)
         try:
-            # **NEW: Smart state management**
-            cache_key = f"state_{len(self.history_stack)}_{action_name}"
-            
-            # Store in memory cache for instant access
-            self.memory_cache[cache_key] = image.copy()
-            
-            # **NEW: Only save to disk if necessary (lazy saving)**
-            if len(self.history_stack) < self.max_memory_cache:
-                temp_path = os.path.join(self.temp_dir, f"{cache_key}.png")
-                image.save(temp_path, "PNG", optimize=True, compress_level=self.compression_quality)
-            else:
-                temp_path = None
+            # **NEW: Copy-on-write tile snapshot - only tiles changed since the
+            # previous snapshot take new memory, the rest are shared**
+            snapshot = TileSnapshot.capture(image, [self.last_full_states.get(layer)], spill=self.spill)
+            self.last_full_states[layer] = snapshot
             
             # Add to history stack
             history_entry = {
-                'path': temp_path,
                 'action': action_name,
-                'cache_key': cache_key,
-                'type': 'full'
+                'snapshot_id': self._store_snapshot(snapshot),
+                'type': 'full',
+                'layer': layer
             }
             
             # **NEW: Store bounding box for partial rendering if provided**
@@ -72,34 +98,28 @@ class HistoryManager:
             print(f"❌ History push error: {e}")
             return False
 
-    def push_region(self, image: Image.Image, bbox: Tuple[int, int, int, int], action_name: str = "Brush Stroke") -> bool:
+    def push_region(self, image: Image.Image, bbox: Tuple[int, int, int, int], action_name: str = "Brush Stroke",
+                    layer=None) -> bool:
         """**NEW: Optimized region-based history for brush strokes**"""
+        self.version += 1
+        _mark_dirty(layer, bbox)
         try:
             if not self._is_region_worth_saving(bbox, image.size):
                 # Region too large, save full image instead
-                return self.push(image, action_name, bbox)
+                return self.push(image, action_name, bbox, layer=layer)
                 
             x1, y1, x2, y2 = bbox
-            region = image.crop(bbox)
             
-            # Store region in memory cache
-            cache_key = f"region_{len(self.history_stack)}"
-            self.memory_cache[cache_key] = region.copy()
-            
-            # Save region to disk only if necessary
-            if len(self.history_stack) < self.max_memory_cache:
-                temp_path = os.path.join(self.temp_dir, f"{cache_key}.png")
-                region.save(temp_path, "PNG", optimize=True, compress_level=self.compression_quality)
-            else:
-                temp_path = None
+            # Store only the tiles overlapping the region
+            snapshot = TileSnapshot.capture(image, [self.last_full_states.get(layer)], bbox, spill=self.spill)
             
             # Add region state to history
             self.history_stack.append({
-                'path': temp_path,
                 'action': action_name,
-                'cache_key': cache_key,
+                'snapshot_id': self._store_snapshot(snapshot),
                 'type': 'region',
-                'bbox': bbox
+                'bbox': bbox,
+                'layer': layer
             })
             
             # Clear redo stack
@@ -114,7 +134,152 @@ class HistoryManager:
         except Exception as e:
             print(f"❌ Region push error: {e}")
             # Fallback to full image save
-            return self.push(image, action_name, bbox)
+            return self.push(image, action_name, bbox, layer=layer)
+
+    def push_command(self, command, image: Image.Image, layer=None) -> bool:
+        """**NEW: Record a replayable command (e.g. a brush stroke) instead of pixels**
+
+        ``image`` is the state before the command runs. It is only kept when a
+        pixel checkpoint is needed: when the previous entry can't be replayed
+        (not a command, or a command on another layer), or when replaying from
+        the last checkpoint would exceed ``max_replay_cost``.
+        """
+        self.version += 1
+        _mark_dirty(layer, command.bbox)
+        try:
+            previous = self.history_stack[-1] if self.history_stack else None
+            
+            if previous is None or previous['type'] != 'command' or previous['layer'] is not layer:
+                replay_cost = None
+            else:
+                replay_cost = previous['replay_cost'] + previous['command'].replay_cost
+            
+            if replay_cost is None or replay_cost > self.max_replay_cost:
+                checkpoint = TileSnapshot.capture(image, [self.last_full_states.get(layer)], spill=self.spill)
+                self.last_full_states[layer] = checkpoint
+                replay_cost = 0.0
+            else:
+                checkpoint = None
+            
+            self.history_stack.append({
+                'action': command.action_name,
+                'snapshot_id': None,
+                'type': 'command',
+                'command': command,
+                'checkpoint': checkpoint,
+                'replay_cost': replay_cost,
+                'bbox': command.bbox,
+                'layer': layer
+            })
+            
+            self._smart_clear_redo()
+            self._smart_enforce_limits()
+            
+            print(f"✅ Command history: {command.action_name} ({'checkpoint' if checkpoint else 'replay'})")
+            return True
+            
+        except Exception as e:
+            print(f"❌ Command push error: {e}")
+            return False
+
+    def push_layers(self, before: Dict[str, Any], after: Dict[str, Any], action_name: str = "Layer Change",
+                    coalesce: bool = False) -> bool:
+        """**NEW: Record a layer-stack transaction (add/delete/duplicate/reorder/merge/properties)**
+
+        ``before`` and ``after`` come from ``Document.capture_layer_state``.
+        Only the order (if it changed) and the properties that changed are
+        kept; layers are held by reference, never copied. With ``coalesce``,
+        a run of property changes to the same layers (a slider drag) becomes
+        one entry.
+        """
+        self.version += 1
+        try:
+            order_changed = before['order'] != after['order']
+            
+            props_before, props_after = {}, {}
+            for layer, values in after['props'].items():
+                old_values = before['props'].get(layer)
+                if old_values is None:
+                    continue  # New layer - its properties come with it
+                changed = {name: value for name, value in values.items() if old_values[name] != value}
+                if changed:
+                    props_before[layer] = {name: old_values[name] for name in changed}
+                    props_after[layer] = changed
+            
+            if not order_changed and not props_after:
+                return False
+            
+            previous = self.history_stack[-1] if self.history_stack else None
+            if (coalesce and not order_changed and not self.redo_stack and previous is not None
+                    and previous['type'] == 'layers' and previous['coalesce']
+                    and previous['action'] == action_name and previous['order_after'] is None
+                    and previous['props_after'].keys() == props_after.keys()):
+                for layer, values in props_after.items():
+                    for name, value in values.items():
+                        previous['props_before'][layer].setdefault(name, props_before[layer][name])
+                        previous['props_after'][layer][name] = value
+                previous['active_after'] = after['active']
+                return True
+            
+            self.history_stack.append({
+                'action': action_name,
+                'snapshot_id': None,
+                'type': 'layers',
+                'layer': None,
+                'bbox': None,
+                'order_before': before['order'] if order_changed else None,
+                'order_after': after['order'] if order_changed else None,
+                'props_before': props_before,
+                'props_after': props_after,
+                'active_before': before['active'],
+                'active_after': after['active'],
+                'coalesce': coalesce
+            })
+            
+            self._smart_clear_redo()
+            self._smart_enforce_limits()
+            
+            print(f"✅ Layer history: {action_name}")
+            return True
+            
+        except Exception as e:
+            print(f"❌ Layer push error: {e}")
+            return False
+
+    def peek_undo(self) -> Optional[Dict[str, Any]]:
+        """Entry the next undo will consume (None if nothing to undo)"""
+        return self.history_stack[-1] if self.history_stack else None
+
+    def peek_redo(self) -> Optional[Dict[str, Any]]:
+        """Entry the next redo will consume (None if nothing to redo)"""
+        return self.redo_stack[-1] if self.redo_stack else None
+
+    def undo_layers(self):
+        """**NEW: Undo a layer transaction** - returns (order, props, active) to restore"""
+        state = self.history_stack.pop()
+        self.redo_stack.append(state)
+        self.version += 1
+        print(f"✅ Smooth Undo: {state['action']}")
+        return state['order_before'], state['props_before'], state['active_before']
+
+    def redo_layers(self):
+        """**NEW: Redo a layer transaction** - returns (order, props, active) to restore"""
+        state = self.redo_stack.pop()
+        self.history_stack.append(state)
+        self.version += 1
+        print(f"✅ Smooth Redo: {state['action']}")
+        return state['order_after'], state['props_after'], state['active_after']
+
+    def _replay_state_before(self, index: int) -> Image.Image:
+        """Rebuild the image state before command entry ``index`` from its nearest checkpoint"""
+        start = index
+        while self.history_stack[start]['checkpoint'] is None:
+            start -= 1
+        
+        image = self.history_stack[start]['checkpoint'].to_image()
+        for i in range(start, index):
+            image = self.history_stack[i]['command'].apply(image)
+        return image
 
     def _is_region_worth_saving(self, bbox: Tuple[int, int, int, int], image_size: Tuple[int, int]) -> bool:
         """Check if region save is more efficient than full save"""
@@ -131,50 +296,26 @@ class HistoryManager:
             return current_image, False, None
             
         try:
-            # **NEW: Fast current state capture**
-            redo_cache_key = f"redo_{len(self.redo_stack)}"
-            self.memory_cache[redo_cache_key] = current_image.copy()
-            
-            # Save current state to redo stack (lazy disk saving)
-            if len(self.redo_stack) < self.max_memory_cache:
-                redo_path = os.path.join(self.temp_dir, f"{redo_cache_key}.png")
-                current_image.save(redo_path, "PNG", optimize=True, compress_level=self.compression_quality)
-            else:
-                redo_path = None
-            
-            self.redo_stack.append({
-                'path': redo_path,
-                'action': 'Redo State',
-                'cache_key': redo_cache_key,
-                'type': 'full'
-            })
+            if self.history_stack[-1]['type'] == 'layers':
+                print("❌ Layer changes are undone through Document.undo")
+                return current_image, False, None
+            
+            # **NEW: Commands need no redo snapshot - redo just replays them**
+            if self.history_stack[-1]['type'] == 'command':
+                previous_image = self._replay_state_before(len(self.history_stack) - 1)
+                command_state = self.history_stack.pop()
+                self.redo_stack.append(command_state)
+                self.version += 1
+                self._prefetch_undo()
+                print(f"✅ Smooth Undo: {command_state['action']} (replayed)")
+                return previous_image, True, command_state['bbox']
             
-            # **NEW: Fast state restoration from memory cache**
             previous_state = self.history_stack.pop()
+            result_image, redo_state, bbox = self._swap_snapshot(previous_state, current_image, 'Redo State')
+            self.redo_stack.append(redo_state)
+            self.version += 1
             
-            # Get the previous image from memory cache
-            if previous_state['cache_key'] in self.memory_cache:
-                previous_image = self.memory_cache[previous_state['cache_key']].copy()
-            else:
-                # Fallback to disk load (should be rare)
-                previous_image = Image.open(previous_state['path'])
-                self.memory_cache[previous_state['cache_key']] = previous_image.copy()
-            
-            # **NEW: Handle different state types for optimal rendering**
-            bbox = None
-            result_image = previous_image
-            
-            if previous_state['type'] == 'region' and 'bbox' in previous_state:
-                # Region-based undo: paste region back onto current image
-                x1, y1, x2, y2 = previous_state['bbox']
-                current_image.paste(previous_image, (x1, y1))
-                result_image = current_image
-                bbox = previous_state['bbox']
-                
-            elif previous_state['type'] == 'region_aware' and 'bbox' in previous_state:
-                # Full image but with bbox info for partial rendering
-                bbox = previous_state['bbox']
-            
+            self._prefetch_undo()
             print(f"✅ Smooth Undo: {previous_state['action']}")
             return result_image, True, bbox
             
@@ -188,41 +329,25 @@ class HistoryManager:
             return current_image, False, None
             
         try:
-            # **NEW: Fast current state capture**
-            history_cache_key = f"state_{len(self.history_stack)}"
-            self.memory_cache[history_cache_key] = current_image.copy()
-            
-            # Save current state to history stack (lazy disk saving)
-            if len(self.history_stack) < self.max_memory_cache:
-                history_path = os.path.join(self.temp_dir, f"{history_cache_key}.png")
-                current_image.save(history_path, "PNG", optimize=True, compress_level=self.compression_quality)
-            else:
-                history_path = None
-            
-            self.history_stack.append({
-                'path': history_path,
-                'action': 'History State',
-                'cache_key': history_cache_key,
-                'type': 'full'
-            })
+            if self.redo_stack[-1]['type'] == 'layers':
+                print("❌ Layer changes are redone through Document.redo")
+                return current_image, False, None
+            
+            if self.redo_stack[-1]['type'] == 'command':
+                command_state = self.redo_stack.pop()
+                next_image = command_state['command'].apply(current_image)
+                self.history_stack.append(command_state)
+                self.version += 1
+                self._prefetch_undo()
+                print(f"✅ Smooth Redo: {command_state['action']} (replayed)")
+                return next_image, True, command_state['bbox']
             
-            # **NEW: Fast state restoration from memory cache**
             next_state = self.redo_stack.pop()
+            next_image, history_state, bbox = self._swap_snapshot(next_state, current_image, 'History State')
+            self.history_stack.append(history_state)
+            self.version += 1
             
-            if next_state['cache_key'] in self.memory_cache:
-                next_image = self.memory_cache[next_state['cache_key']].copy()
-            else:
-                # Fallback to disk load
-                next_image = Image.open(next_state['path'])
-                self.memory_cache[next_state['cache_key']] = next_image.copy()
-            
-            # **NEW: Handle bbox for partial rendering**
-            bbox = None
-            if next_state['type'] == 'region' and 'bbox' in next_state:
-                bbox = next_state['bbox']
-            elif next_state['type'] == 'region_aware' and 'bbox' in next_state:
-                bbox = next_state['bbox']
-            
+            self._prefetch_undo()
             print(f"✅ Smooth Redo")
             return next_image, True, bbox
             
@@ -230,80 +355,132 @@ class HistoryManager:
             print(f"❌ Redo error: {e}")
             return current_image, False, None
 
-    def _smart_clear_redo(self):
-        """**NEW: Smart redo stack clearing with memory management**"""
-        # Clear disk files for redo stack
-        for state in self.redo_stack:
-            self._cleanup_state(state)
+    def _swap_snapshot(self, state: Dict[str, Any], current_image: Image.Image, action_name: str):
+        """**NEW: Exchange a stored state with the current image (shared by undo and redo)**
+
+        The current image is captured over the same extent as the stored
+        state - only the region's tiles for region entries - so redo costs the
+        same as undo and memory stays proportional to the edited area. The
+        consumed entry is released. Returns (image, counterpart entry, bbox).
+        """
+        snapshot = self.memory_cache[state['snapshot_id']]
+        is_region = state['type'] == 'region' and 'bbox' in state
         
-        # Clear memory cache entries for redo
-        redo_keys = [state['cache_key'] for state in self.redo_stack]
-        for key in redo_keys:
-            if key in self.memory_cache and not self._is_key_in_history(key):
-                del self.memory_cache[key]
+        # The counterpart shares every tile the action didn't touch with the stored state
+        current_snapshot = TileSnapshot.capture(
+            current_image, [snapshot, self.last_full_states.get(state['layer'])],
+            state['bbox'] if is_region else None, spill=self.spill
+        )
+        counterpart = {
+            'action': action_name,
+            'snapshot_id': self._store_snapshot(current_snapshot),
+            'type': state['type'],
+            'layer': state['layer']
+        }
+        if 'bbox' in state:
+            counterpart['bbox'] = state['bbox']
         
-        self.redo_stack.clear()
-
-    def _is_key_in_history(self, key: str) -> bool:
-        """Check if a cache key is in history stack"""
-        for state in self.history_stack:
-            if state['cache_key'] == key:
-                return True
-        return False
-
-    def _smart_enforce_limits(self):
-        """**NEW: Smart history limiting with memory optimization**"""
-        while len(self.history_stack) > self.max_history:
-            old_state = self.history_stack.pop(0)
-            self._cleanup_state(old_state)
+        if is_region:
+            # Region-based: paste region tiles back onto current image
+            snapshot.restore_into(current_image, current=current_snapshot)
+            result_image = current_image
+        else:
+            self.last_full_states[state['layer']] = current_snapshot
+            result_image = self._restore_snapshot(snapshot, current_image, current_snapshot)
         
-        # **NEW: Smart memory cache cleanup**
-        self._optimize_memory_cache()
+        # The consumed entry is gone for good - its tiles live on only where shared
+        self._drop_entry(state)
+        
+        # **NEW: Handle bbox for partial rendering**
+        bbox = state.get('bbox') if state['type'] in ('region', 'region_aware') else None
+        return result_image, counterpart, bbox
 
-    def _optimize_memory_cache(self):
-        """**NEW: Optimize memory cache while keeping recent states**"""
-        if len(self.memory_cache) <= self.max_memory_cache * 1.5:
+    def _prefetch_undo(self):
+        """**NEW: Reload the next undo step's spilled tiles in the background**"""
+        if not self.history_stack:
             return
-            
-        # Get all keys from memory cache
-        all_keys = list(self.memory_cache.keys())
-        
-        # Keep recent history and redo states
-        history_keys = [state['cache_key'] for state in self.history_stack[-self.max_memory_cache:]]
-        redo_keys = [state['cache_key'] for state in self.redo_stack[-self.max_memory_cache//2:]]
         
-        protected_keys = set(history_keys + redo_keys)
+        index = len(self.history_stack) - 1
+        if self.history_stack[index]['type'] == 'command':
+            while self.history_stack[index]['checkpoint'] is None:
+                index -= 1
+            snapshot = self.history_stack[index]['checkpoint']
+        else:
+            snapshot = self.memory_cache.get(self.history_stack[index]['snapshot_id'])
         
-        # Remove old entries
-        for key in all_keys:
-            if key not in protected_keys:
-                del self.memory_cache[key]
-                
-        print(f"🔄 Memory cache optimized: {len(self.memory_cache)} entries")
+        if snapshot is not None:
+            get_thread_pool().submit(snapshot.prefetch)
+
+    def _restore_snapshot(self, snapshot: TileSnapshot, current_image: Image.Image,
+                          current_snapshot: TileSnapshot) -> Image.Image:
+        """Bring ``current_image`` to a full snapshot's state
+
+        Only tiles whose references differ from ``current_snapshot`` are
+        written, in place. A new image is built if the size or mode changed.
+        """
+        if snapshot.size == current_image.size and snapshot.mode == current_image.mode:
+            snapshot.restore_into(current_image, current=current_snapshot)
+            return current_image
+        return snapshot.to_image()
 
-    def _cleanup_state(self, state: Dict[str, Any]):
-        """Cleanup individual history state"""
+    def _store_snapshot(self, snapshot: TileSnapshot) -> int:
+        """**NEW: Register a snapshot under a fresh id, referenced once by its entry**"""
+        snapshot_id = next(self._snapshot_ids)
+        self.memory_cache[snapshot_id] = snapshot
+        self.snapshot_refs[snapshot_id] = 1
+        return snapshot_id
+
+    def _ref_snapshot(self, snapshot_id: int) -> int:
+        """Add a reference to a stored snapshot (for entries that share it)"""
+        self.snapshot_refs[snapshot_id] += 1
+        return snapshot_id
+
+    def _unref_snapshot(self, snapshot_id: int):
+        """Drop a reference; the snapshot's tiles are released with the last one"""
+        self.snapshot_refs[snapshot_id] -= 1
+        if self.snapshot_refs[snapshot_id] <= 0:
+            del self.snapshot_refs[snapshot_id]
+            self.memory_cache.pop(snapshot_id).release()
+
+    def _drop_entry(self, state: Dict[str, Any]):
+        """Release everything a history entry that left both stacks was holding"""
         try:
-            # Only remove from memory cache if not in active use
-            if (state['cache_key'] in self.memory_cache and 
-                not self._is_key_active(state['cache_key'])):
-                del self.memory_cache[state['cache_key']]
-            
-            # Remove disk file if it exists
-            if state['path'] and os.path.exists(state['path']):
-                os.remove(state['path'])
+            if state.get('snapshot_id') is not None:
+                self._unref_snapshot(state['snapshot_id'])
+            
+            if state['type'] == 'command' and state['checkpoint'] is not None:
+                state['checkpoint'].release()
         except Exception as e:
             print(f"⚠️ Cleanup warning: {e}")
 
-    def _is_key_active(self, key: str) -> bool:
-        """Check if cache key is in active history or redo stacks"""
-        for state in self.history_stack[-5:]:  # Check recent history
-            if state['cache_key'] == key:
-                return True
-        for state in self.redo_stack[-3:]:  # Check recent redo
-            if state['cache_key'] == key:
-                return True
-        return False
+    def _smart_clear_redo(self):
+        """**NEW: Smart redo stack clearing with memory management**"""
+        for state in self.redo_stack:
+            self._drop_entry(state)
+        self.redo_stack.clear()
+
+    def _smart_enforce_limits(self):
+        """**NEW: Smart history limiting with memory optimization**"""
+        while len(self.history_stack) > self.max_history:
+            old_state = self.history_stack.popleft()
+            self._promote_checkpoint(old_state)
+            self._drop_entry(old_state)
+
+    def _promote_checkpoint(self, old_state: Dict[str, Any]):
+        """Keep the replay chain intact when its oldest checkpoint is evicted"""
+        if old_state['type'] != 'command' or not self.history_stack:
+            return
+        
+        next_state = self.history_stack[0]
+        if next_state['type'] == 'command' and next_state['checkpoint'] is None:
+            next_image = old_state['command'].apply(old_state['checkpoint'].to_image())
+            next_state['checkpoint'] = TileSnapshot.capture(next_image, [old_state['checkpoint']], spill=self.spill)
+            # Replay costs below the new checkpoint shift down accordingly
+            offset = old_state['command'].replay_cost
+            for state in self.history_stack:
+                if state['type'] != 'command' or (state is not next_state and state['checkpoint'] is not None):
+                    break
+                state['replay_cost'] = max(0.0, state['replay_cost'] - offset)
 
     def get_history_info(self) -> Dict[str, Any]:
         """**NEW: Enhanced history information for UI**"""
@@ -313,25 +490,25 @@ class HistoryManager:
             'can_redo': len(self.redo_stack) > 0,
             'memory_usage': len(self.memory_cache),
             'last_action': self.history_stack[-1]['action'] if self.history_stack else None,
-            'memory_efficiency': f"{len(self.memory_cache)}/{self.max_memory_cache}"
+            'memory_efficiency': f"{get_tile_memory().resident_bytes}/{get_tile_memory().budget_bytes} bytes"
         }
 
     def clear(self):
         """Clear all history - OPTIMIZED"""
-        # Clear memory cache
+        # Release snapshots and checkpoints
+        for snapshot in self.memory_cache.values():
+            snapshot.release()
         self.memory_cache.clear()
+        self.snapshot_refs.clear()
         
-        # Clear disk files
-        for state in self.history_stack + self.redo_stack:
-            try:
-                if state['path'] and os.path.exists(state['path']):
-                    os.remove(state['path'])
-            except:
-                pass
+        for state in itertools.chain(self.history_stack, self.redo_stack):
+            if state['type'] == 'command' and state['checkpoint'] is not None:
+                state['checkpoint'].release()
         
         # Clear stacks
         self.history_stack.clear()
         self.redo_stack.clear()
+        self.last_full_states.clear()
         
         print("✅ History cleared completely")
 
@@ -340,33 +517,66 @@ class HistoryManager:
         self.enable_partial_undo = enable
         print(f"🔄 Region-based undo: {'enabled' if enable else 'disabled'}")
 
-    def set_memory_cache_size(self, size: int):
-        """**NEW: Adjust memory cache size dynamically**"""
-        self.max_memory_cache = max(3, min(size, 20))  # Limit between 3-20
-        self._optimize_memory_cache()
-        print(f"🔄 Memory cache size set to: {self.max_memory_cache}")
+    def set_memory_budget(self, budget_mb: float):
+        """**NEW: Adjust the history memory budget (shared by all documents)**"""
+        get_tile_memory().set_budget(int(max(16, budget_mb) * 1024 * 1024))
+        print(f"🔄 History memory budget set to: {get_tile_memory().budget_bytes // (1024 * 1024)} MB")
 
     def get_performance_stats(self) -> Dict[str, Any]:
         """**NEW: Get performance statistics**"""
-        memory_usage = sum(
-            img.size[0] * img.size[1] * 4  # Approximate memory (RGBA)
-            for img in self.memory_cache.values()
-        ) / (1024 * 1024)  # Convert to MB
+        checkpoints = [
+            state['checkpoint'] for state in itertools.chain(self.history_stack, self.redo_stack)
+            if state['type'] == 'command' and state['checkpoint'] is not None
+        ]
+        snapshots = list(self.memory_cache.values()) + checkpoints
+        
+        # Shared tiles are counted once - this is the real memory held.
+        # A reloaded tile is both resident and still on disk.
+        tiles = unique_tiles(snapshots)
+        memory_bytes = sum(tile.nbytes for tile in tiles.values() if tile.resident)
+        disk_bytes = sum(tile.nbytes for tile in tiles.values() if tile.handle is not None)
+        logical_bytes = sum(snapshot.logical_bytes for snapshot in snapshots)
+        memory = get_tile_memory()
+        dedup = dedup_stats()
         
         return {
             'history_states': len(self.history_stack),
             'redo_states': len(self.redo_stack),
             'memory_cache_entries': len(self.memory_cache),
-            'estimated_memory_mb': round(memory_usage, 2),
+            'command_states': sum(1 for state in itertools.chain(self.history_stack, self.redo_stack)
+                                  if state['type'] == 'command'),
+            'layer_states': sum(1 for state in itertools.chain(self.history_stack, self.redo_stack)
+                                if state['type'] == 'layers'),
+            'replay_checkpoints': len(checkpoints),
+            'unique_tiles': len(tiles),
+            'shared_tiles': sum(1 for tile in tiles.values() if tile.refs > 1),
+            'delta_tiles': sum(1 for tile in tiles.values() if tile.base is not None),
+            'memory_bytes': memory_bytes,
+            'disk_bytes': disk_bytes,
+            'logical_bytes': logical_bytes,
+            'estimated_memory_mb': round(memory_bytes / (1024 * 1024), 2),
+            'shared_memory_bytes': memory.resident_bytes,
+            'shared_disk_bytes': memory.disk_bytes,
+            'pending_write_bytes': memory.pending_bytes,
+            'journal_bytes': self.spill.size,
+            'journal_live_bytes': self.spill.live_bytes,
+            'journal_compactions': self.spill.compactions,
+            'memory_budget_bytes': memory.budget_bytes,
+            'spills': memory.spills,
+            'reloads': memory.reloads,
+            'dedup_lookups': dedup['dedup_lookups'],
+            'dedup_hits': dedup['dedup_hits'],
+            'dedup_hit_rate': dedup['dedup_hit_rate'],
             'region_undo_enabled': self.enable_partial_undo,
-            'cache_efficiency': f"{len(self.memory_cache)}/{self.max_memory_cache}"
+            'cache_efficiency': f"{memory.resident_bytes}/{memory.budget_bytes} bytes"
         }
 
     def __del__(self):
         """Cleanup temp directory on destruction"""
         try:
-            import shutil
-            if os.path.exists(self.temp_dir):
-                shutil.rmtree(self.temp_dir)
+            # Release tiles first so the shared budget never spills into a deleted dir
+            self.clear()
+            # Tiles shared with other documents keep the journal open until released
+            self.spill.close(remove_dir=True)
         except:
             pass
\ No newline at end of file
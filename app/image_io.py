@@ -0,0 +1,92 @@
+# app/image_io.py - IMAGE FILE LOADING
+
+from typing import Any, Callable, List, Optional, Tuple
+from PIL import Image
+
+from app.workers import get_thread_pool
+
+# Longest side the quick preview aims for while the full image decodes -
+# the actual preview is within 2x of it, since JPEG can only scale by 1/2^n
+PREVIEW_SIDE = 1024
+
+
+def read_image(path: str, mode: Optional[str] = "RGBA") -> Image.Image:
+    """Decode an image file at full resolution (safe to call off the UI thread)
+
+    With ``mode=None`` the image keeps the mode it was decoded in - a layer
+    converts it to RGBA band by band as it copies it in, which saves a
+    full-size RGBA copy of a large file.
+    """
+    with Image.open(path) as image:
+        image.load()
+        return image.convert(mode) if mode and image.mode != mode else image
+
+
+def read_preview(path: str, side: int = PREVIEW_SIDE) -> Tuple[Optional[Image.Image], Tuple[int, int]]:
+    """Fast reduced-size decode plus the full image size
+
+    Only the header is parsed to get the size. Formats that support a
+    reduced decode (JPEG's DCT scaling via ``draft``) also return a preview
+    whose longest side is close to ``side``; for the others the preview is None
+    and the caller shows a placeholder until the full decode is done.
+    """
+    with Image.open(path) as image:
+        size = image.size
+        if image.format != "JPEG":
+            return None, size
+
+        # Let libjpeg decode at 1/2, 1/4 or 1/8 scale - far less work than a full decode
+        factor = max(1, max(size) // side)
+        image.draft("RGB", (size[0] // factor, size[1] // factor))
+        preview = image.convert("RGBA")
+
+    return preview, size
+
+
+class OpenBatch:
+    """Several files loading concurrently on the shared worker pool
+
+    ``loader`` runs on a worker thread for each path. Poll from the UI
+    thread: every call returns the loads that finished since the previous
+    one, in completion order, as ``(path, result, error)``.
+    """
+
+    def __init__(self, paths: List[str], loader: Callable[[str], Any] = read_image):
+        pool = get_thread_pool()
+        self.total = len(paths)
+        self.completed = 0
+        self.cancelled = 0
+        self._pending = [(path, pool.submit(loader, path)) for path in paths]
+
+    def cancel(self) -> int:
+        """**NEW: Drop the loads that have not started yet** - returns how many
+
+        Loads already decoding cannot be interrupted; they still finish and
+        are returned by ``poll`` as usual.
+        """
+        pending = []
+        for path, future in self._pending:
+            if future.cancel():
+                self.cancelled += 1
+            else:
+                pending.append((path, future))
+        dropped = len(self._pending) - len(pending)
+        self._pending = pending
+        return dropped
+
+    @property
+    def done(self) -> bool:
+        return not self._pending
+
+    def poll(self) -> List[Tuple[str, Any, Optional[BaseException]]]:
+        finished = []
+        pending = []
+        for path, future in self._pending:
+            if not future.done():
+                pending.append((path, future))
+                continue
+            error = future.exception()
+            finished.append((path, None if error else future.result(), error))
+        self._pending = pending
+        self.completed += len(finished)
+        return finished
@@ -0,0 +1,190 @@
+# app/layer_store.py - OUT-OF-CORE LAYER BUFFERS
+
+import mmap
+import tempfile
+import threading
+import weakref
+from collections import OrderedDict
+from typing import Any, Dict, Tuple
+
+import numpy as np
+
+from app.utils import new_pixels
+
+# Layer buffers at least this big are backed by a scratch file instead of RAM
+OUT_OF_CORE_BYTES = 256 * 1024 * 1024
+
+# Bytes of file-backed layer pixels kept paged in across all documents
+DEFAULT_RESIDENT_BUDGET = 1024 * 1024 * 1024
+
+# Residency is tracked in bands of whole rows - a band of a row-major buffer
+# is one contiguous byte range the kernel can page in or out in one call
+BAND_ROWS = 256
+
+# Reclaim pages outright where the kernel supports it, otherwise just unmap
+# them - shared file pages keep their data either way
+_PAGE_OUT = getattr(mmap, 'MADV_PAGEOUT', getattr(mmap, 'MADV_DONTNEED', None))
+_WILL_NEED = getattr(mmap, 'MADV_WILLNEED', None)
+
+
+class MappedPixels:
+    """Pixel buffer living in an anonymous scratch file, mapped into memory
+
+    The file is created sparse, so a transparent layer costs neither RAM
+    nor disk until it is painted on, and the kernel pages rows in only when
+    they are touched.
+    """
+
+    def __init__(self, width: int, height: int):
+        self.shape = (height, width, 4)
+        self.row_bytes = width * 4
+        self.nbytes = height * self.row_bytes
+        # Deleted on close (or immediately, where the OS allows it)
+        self._file = tempfile.TemporaryFile(prefix="imageforge_layer_")
+        self._file.truncate(self.nbytes)
+        self._map = mmap.mmap(self._file.fileno(), self.nbytes)
+
+    def close(self):
+        """Unmap and drop the scratch file - once no array uses the map any more"""
+        try:
+            self._map.close()
+        except BufferError:
+            pass  # Still exported - the map goes when its last user does
+        self._file.close()
+
+    def as_array(self) -> np.ndarray:
+        # The array keeps the map alive; this object must not keep the array alive
+        return np.ndarray(self.shape, dtype=np.uint8, buffer=self._map)
+
+    def band_range(self, band: int) -> Tuple[int, int]:
+        """Page-aligned byte range covering one band of rows"""
+        start = band * BAND_ROWS * self.row_bytes
+        end = min(self.nbytes, start + BAND_ROWS * self.row_bytes)
+        start -= start % mmap.PAGESIZE
+        return start, end - start
+
+    def advise(self, option, band: int):
+        if option is None:
+            return
+        start, length = self.band_range(band)
+        try:
+            self._map.madvise(option, start, length)
+        except (AttributeError, OSError, ValueError):
+            pass  # Advice only - unsupported platforms just rely on the kernel
+
+
+class LayerStore:
+    """Process-wide allocator for layer pixel buffers
+
+    Small layers get ordinary arrays. Large ones are file-backed and count
+    against a resident-set budget: bands touched by display or editing are
+    kept in an LRU, and once it holds more than the budget the least
+    recently used bands are paged out.
+    """
+
+    def __init__(self, budget_bytes: int = DEFAULT_RESIDENT_BUDGET):
+        self.budget_bytes = budget_bytes
+        self.lock = threading.Lock()
+        self._mapped: Dict[int, MappedPixels] = {}
+        self._bands = OrderedDict()  # (buffer id, band) -> bytes
+        self.resident_bytes = 0
+        self.mapped_bytes = 0
+        self.page_outs = 0
+
+    def allocate(self, width: int, height: int, fill=(0, 0, 0, 0)) -> np.ndarray:
+        """New pixel buffer, file-backed if it is at least ``OUT_OF_CORE_BYTES``"""
+        if width * height * 4 < OUT_OF_CORE_BYTES:
+            return new_pixels(width, height, fill)
+
+        mapped = MappedPixels(width, height)
+        pixels = mapped.as_array()
+        key = id(pixels)
+        with self.lock:
+            self._mapped[key] = mapped
+            self.mapped_bytes += mapped.nbytes
+        weakref.finalize(pixels, self._release, key)
+
+        if any(fill):
+            # Written band by band so the fill never needs the whole layer resident
+            value = np.frombuffer(bytes(fill), np.uint32)[0]
+            for y in range(0, height, BAND_ROWS):
+                self.touch(pixels, y, y + BAND_ROWS)
+                pixels[y:y + BAND_ROWS].view(np.uint32)[...] = value
+        return pixels
+
+    def is_mapped(self, pixels: np.ndarray) -> bool:
+        return id(pixels) in self._mapped
+
+    def touch(self, pixels: np.ndarray, y1: int, y2: int):
+        """Record that rows ``y1:y2`` of a buffer are in use, paging out cold bands if needed"""
+        mapped = self._mapped.get(id(pixels))
+        if mapped is None or y2 <= y1:
+            return
+
+        with self.lock:
+            touched = set()
+            for band in range(y1 // BAND_ROWS, (y2 - 1) // BAND_ROWS + 1):
+                key = (id(pixels), band)
+                touched.add(key)
+                if key in self._bands:
+                    self._bands.move_to_end(key)
+                    continue
+                start, length = mapped.band_range(band)
+                self._bands[key] = length
+                self.resident_bytes += length
+                mapped.advise(_WILL_NEED, band)
+            self._trim(keep=touched)
+
+    def set_budget(self, budget_bytes: int):
+        with self.lock:
+            self.budget_bytes = budget_bytes
+            self._trim()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'mapped_layers': len(self._mapped),
+            'mapped_bytes': self.mapped_bytes,
+            'resident_bytes': self.resident_bytes,
+            'resident_budget_bytes': self.budget_bytes,
+            'page_outs': self.page_outs,
+        }
+
+    def _trim(self, keep=()):
+        # Never page out the bands being touched right now
+        skipped = []
+        while self.resident_bytes > self.budget_bytes and self._bands:
+            key, length = self._bands.popitem(last=False)
+            if key in keep:
+                skipped.append((key, length))
+                continue
+            self.resident_bytes -= length
+            mapped = self._mapped.get(key[0])
+            if mapped is not None:
+                mapped.advise(_PAGE_OUT, key[1])
+                self.page_outs += 1
+        for key, length in skipped:
+            self._bands[key] = length
+
+    def _release(self, key: int):
+        with self.lock:
+            mapped = self._mapped.pop(key, None)
+            if mapped is None:
+                return
+            self.mapped_bytes -= mapped.nbytes
+            for band_key in [k for k in self._bands if k[0] == key]:
+                self.resident_bytes -= self._bands.pop(band_key)
+        mapped.close()
+
+
+_layer_store = None
+_store_lock = threading.Lock()
+
+
+def get_layer_store() -> LayerStore:
+    """Allocator shared by the layers of every open document"""
+    global _layer_store
+    if _layer_store is None:
+        with _store_lock:
+            if _layer_store is None:
+                _layer_store = LayerStore()
+    return _layer_store
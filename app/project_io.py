@@ -0,0 +1,350 @@
+# app/project_io.py - NATIVE TILED PROJECT FORMAT
+
+import json
+import mmap
+import os
+import struct
+import threading
+import zlib
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.compositor import tile_occupancy
+from app.layer_store import get_layer_store
+from app.tiles import TILE_SIZE, tile_box, tile_digest
+from app.workers import get_thread_pool
+
+# **NEW: ImageForge project (.ifp) - one chunked container per document**
+#
+#   header    magic, offset and length of the current manifest (fixed size)
+#   chunks    zlib-compressed RGBA tiles, one per distinct tile content
+#   manifest  JSON: document and layer properties, each layer's tile digests
+#             and the offset of every live chunk
+#
+# Chunks are content-addressed, so identical tiles (within a layer, across
+# layers or across saves) are stored once. Saving back to the same file only
+# appends the chunks that are new plus a new manifest, then repoints the
+# header - an interrupted save leaves the previous version intact.
+
+PROJECT_EXTENSION = ".ifp"
+PROJECT_MAGIC = b"IFPROJ\x00\x01"
+FORMAT_VERSION = 1
+_HEADER = struct.Struct("<8sQQ")
+
+# Tiles are written with the same fast zlib level as history tiles
+COMPRESSION_LEVEL = 1
+
+# Files are compacted once dead chunks outweigh both this and the live ones
+COMPACT_MIN_DEAD_BYTES = 64 * 1024 * 1024
+
+ProgressCallback = Optional[Callable[[int, int], None]]
+
+
+def is_project(path: str) -> bool:
+    return os.path.splitext(path)[1].lower() == PROJECT_EXTENSION
+
+
+class ProjectFile:
+    """An open project file: its manifest plus a read-only map of its chunks"""
+
+    def __init__(self, path: str):
+        self.path = os.path.abspath(path)
+        self._file = open(self.path, 'rb')
+        self._lock = threading.Lock()
+        self._map = None
+        self.manifest = {}
+        self.chunks = {}  # digest -> (offset, length)
+        self.size = 0
+        self.reload()
+
+    def reload(self):
+        """Re-read the header and manifest (after this file was appended to)"""
+        with self._lock:
+            self._file.seek(0, os.SEEK_END)
+            self.size = self._file.tell()
+            self._file.seek(0)
+            magic, offset, length = _HEADER.unpack(self._file.read(_HEADER.size))
+            if magic != PROJECT_MAGIC:
+                raise ValueError(f"Not an ImageForge project: {self.path}")
+            self._file.seek(offset)
+            manifest = json.loads(self._file.read(length).decode('utf-8'))
+            if manifest.get('version', 0) > FORMAT_VERSION:
+                raise ValueError(f"Project was saved by a newer version (format {manifest['version']})")
+
+            self.manifest = manifest
+            self.manifest_bytes = length
+            self.chunks = {bytes.fromhex(d): tuple(entry) for d, entry in manifest['chunks'].items()}
+            self.live_bytes = sum(length for _, length in self.chunks.values())
+            self._close_map()
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if self.size else None
+
+    @property
+    def dead_bytes(self) -> int:
+        return self.size - _HEADER.size - self.manifest_bytes - self.live_bytes
+
+    def read(self, digest: bytes):
+        """Compressed chunk as a zero-copy slice of the file map"""
+        offset, length = self.chunks[digest]
+        return memoryview(self._map)[offset:offset + length]
+
+    def layer_sources(self) -> List['LayerSource']:
+        return [
+            LayerSource(self, tuple(entry['size']),
+                        {(tx, ty): bytes.fromhex(d) for tx, ty, d in entry['tiles']})
+            if entry['tiles'] is not None else None
+            for entry in self.manifest['layers']
+        ]
+
+    def reopen(self):
+        """Open ``path`` again after the file there was replaced by a new copy"""
+        self.close()
+        self._file = open(self.path, 'rb')
+        self.reload()
+
+    def close(self):
+        with self._lock:
+            self._close_map()
+            self._file.close()
+
+    def _close_map(self):
+        if self._map is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                pass  # A decode still holds a slice - the map goes with it
+            self._map = None
+
+
+class LayerSource:
+    """Pixels of a layer that are still in a project file
+
+    Decoded the first time the layer's pixels are used, so hidden or
+    untouched layers of a large project never cost RAM, and saving them
+    again copies their chunk digests without decoding anything.
+    """
+
+    def __init__(self, project: ProjectFile, size: Tuple[int, int], tiles: Dict[Tuple[int, int], bytes]):
+        self.project = project
+        self.size = size
+        self.tiles = tiles
+
+    def decode_into(self, pixels: np.ndarray):
+        """Write the stored tiles into a transparent buffer, one band of tiles at a time"""
+        store = get_layer_store()
+        pool = get_thread_pool()
+        rows = {}
+        for key in self.tiles:
+            rows.setdefault(key[1], []).append(key)
+
+        for ty, keys in sorted(rows.items()):
+            boxes = [tile_box(key, self.size) for key in keys]
+            # zlib releases the GIL - a row of tiles decompresses in parallel
+            raws = pool.map(lambda key: zlib.decompress(self.project.read(self.tiles[key])), keys)
+            store.touch(pixels, ty * TILE_SIZE, (ty + 1) * TILE_SIZE)
+            for (x1, y1, x2, y2), raw in zip(boxes, raws):
+                pixels[y1:y2, x1:x2] = np.frombuffer(raw, np.uint8).reshape(y2 - y1, x2 - x1, 4)
+
+
+def save_project(doc, path: str, progress: ProgressCallback = None,
+                 metadata: Optional[Dict[str, Any]] = None) -> ProjectFile:
+    """Write ``doc`` as a project at ``path`` and return the opened file
+
+    Saving to the file the document was loaded from (or last saved to)
+    appends only the tiles whose content is not in it yet. Anywhere else -
+    or once that file holds too much dead space - a complete file is
+    written next to the target and moved over it.
+
+    Only the first save of a layer to ``path`` reads all of its pixels:
+    after that, rows of tiles the layer has not marked dirty since keep
+    the digests they were saved with.
+
+    ``progress(done, total)`` is called after each row of tiles; raising
+    from it abandons the save before the file is switched to it.
+    ``metadata`` is stored in the manifest as is.
+    """
+    path = os.path.abspath(path)
+    target = doc.project if doc.project is not None and doc.project.path == path else None
+    sources = [doc.project] if doc.project is not None else []
+    sources += [layer.source.project for layer in doc.layers if layer.source is not None]
+    sources = list(dict.fromkeys(sources))
+    # Open copies of the file being replaced - re-opened in place afterwards
+    holders = [source for source in sources if source.path == path]
+
+    if target is not None and target.dead_bytes <= max(target.live_bytes, COMPACT_MIN_DEAD_BYTES):
+        with open(path, 'r+b') as f:
+            f.seek(0, os.SEEK_END)
+            saved = _write_project(f, path, doc, target.chunks, sources, progress, metadata)
+        target.reload()
+        project = target
+    else:
+        temp_path = path + ".saving"
+        try:
+            with open(temp_path, 'wb') as f:
+                f.write(_HEADER.pack(PROJECT_MAGIC, 0, 0))
+                saved = _write_project(f, path, doc, {}, sources, progress, metadata)
+            # A file that is still open or mapped can't be replaced on Windows
+            for holder in holders:
+                holder.close()
+            try:
+                os.replace(temp_path, path)
+            finally:
+                for holder in holders:
+                    holder.reopen()  # The new file - or still the old one if the move failed
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        project = holders[0] if holders else ProjectFile(path)
+
+    # Layers still waiting to be decoded now read from the file just written
+    for layer in doc.layers:
+        if layer.source is not None and layer.source.project is not project:
+            layer.source = LayerSource(project, layer.source.size, layer.source.tiles)
+    # Only a save that made it to disk is a base for the next one
+    for layer, row_edits, tiles in saved:
+        layer.saved_tiles[path] = (row_edits, tiles)
+    return project
+
+
+def _write_project(f, path: str, doc, existing: Dict[bytes, Tuple[int, int]], sources: List[ProjectFile],
+                   progress: ProgressCallback, metadata: Optional[Dict[str, Any]]):
+    """Append the chunks ``doc`` needs that are not in ``existing``, then the manifest
+
+    Materialized layers are hashed and written a tile row at a time, so a
+    save never holds more than one row of uncompressed tiles; rows that are
+    clean since the layer was last saved to ``path`` are not read at all.
+    Returns ``(layer, row_edits, tiles)`` for every materialized layer.
+    """
+    chunks = {}  # digest -> (offset, length) of every chunk the manifest references
+    pool = get_thread_pool()
+
+    def store(tiles):
+        new = {}
+        for digest, raw in tiles:
+            if digest in chunks or digest in new:
+                continue
+            if digest in existing:
+                chunks[digest] = existing[digest]
+            else:
+                new[digest] = raw
+        # zlib releases the GIL - new tiles compress in parallel
+        payloads = pool.map(lambda item: _payload(item[0], item[1], sources), new.items())
+        for digest, payload in zip(new, payloads):
+            chunks[digest] = (f.tell(), len(payload))
+            f.write(payload)
+
+    def available(digest):
+        return digest in existing or any(digest in source.chunks for source in sources)
+
+    total = sum(_tile_rows(layer) for layer in doc.layers if layer.materialized or layer.source is not None)
+    done = 0
+    layers = []
+    saved = []
+    for layer in doc.layers:
+        entry = dict(layer.get_properties(), size=list(layer.size), fill=list(layer.fill))
+        if layer.materialized:
+            row_edits = layer.row_edits.copy()  # Before any pixel is read
+            tiles = {}
+            for row in _hash_rows(layer, _clean_rows(layer, path, row_edits, available)):
+                store((digest, raw) for _, digest, raw in row)
+                tiles.update((key, digest) for key, digest, _ in row)
+                done += 1
+                if progress:
+                    progress(done, total)
+            saved.append((layer, row_edits, tiles))
+        elif layer.source is not None:
+            # Never decoded - its chunks are copied as they are
+            tiles = layer.source.tiles
+            store((digest, None) for digest in tiles.values())
+            done += _tile_rows(layer)
+            if progress:
+                progress(done, total)
+        else:
+            tiles = None  # Still a flat fill
+        entry['tiles'] = None if tiles is None else [[tx, ty, d.hex()] for (tx, ty), d in sorted(tiles.items())]
+        layers.append(entry)
+
+    manifest = {
+        'version': FORMAT_VERSION,
+        'size': list(doc.size),
+        'tile_size': TILE_SIZE,
+        'active_layer': doc.active_layer_index,
+        'layers': layers,
+        'metadata': metadata or {},
+        'chunks': {d.hex(): list(entry) for d, entry in chunks.items()},
+    }
+    data = json.dumps(manifest, separators=(',', ':')).encode('utf-8')
+    offset = f.tell()
+    f.write(data)
+    f.flush()
+    os.fsync(f.fileno())
+    # Only now point the header at the new manifest - until here the file
+    # still opens as the previous save
+    f.seek(0)
+    f.write(_HEADER.pack(PROJECT_MAGIC, offset, len(data)))
+    f.flush()
+    os.fsync(f.fileno())
+    return saved
+
+
+def _tile_rows(layer) -> int:
+    return (layer.size[1] + TILE_SIZE - 1) // TILE_SIZE
+
+
+def _clean_rows(layer, path: str, row_edits, available) -> Dict[int, List[Tuple[Tuple[int, int], bytes]]]:
+    """Tiles of the rows unchanged since ``layer`` was last saved to ``path``, by row
+
+    A row only counts if every one of its tiles is still available to copy.
+    """
+    previous = layer.saved_tiles.get(path)
+    if previous is None:
+        return {}  # First save here - every row is hashed
+    saved_edits, saved_tiles = previous
+    clean = {int(ty): [] for ty in np.nonzero(saved_edits == row_edits)[0]}
+    for key, digest in saved_tiles.items():
+        row = clean.get(key[1])
+        if row is None:
+            continue
+        if available(digest):
+            row.append((key, digest))
+        else:
+            del clean[key[1]]
+    return clean
+
+
+def _hash_rows(layer, clean=None):
+    """Per tile row: ``(key, digest, pixels)`` for every tile with visible pixels
+
+    Fully transparent tiles are not stored at all. Rows in ``clean`` are
+    taken from it as ``(key, digest, None)`` without reading the layer.
+    """
+    store = get_layer_store()
+    pool = get_thread_pool()
+    pixels = layer.pixels
+    width, height = layer.size
+    clean = clean or {}
+    for y1 in range(0, height, TILE_SIZE):
+        if y1 // TILE_SIZE in clean:
+            yield [(key, digest, None) for key, digest in clean[y1 // TILE_SIZE]]
+            continue
+        y2 = min(height, y1 + TILE_SIZE)
+        store.touch(pixels, y1, y2)
+        occupied = tile_occupancy(pixels[y1:y2])[0] if y2 > y1 else ()
+        keys = [(int(tx), y1 // TILE_SIZE) for tx in np.nonzero(occupied)[0]]
+        raws = [
+            np.ascontiguousarray(pixels[y1:y2, tx * TILE_SIZE:min(width, (tx + 1) * TILE_SIZE)])
+            for tx, _ in keys
+        ]
+        # blake2b releases the GIL for large buffers
+        digests = pool.map(tile_digest, raws)
+        yield list(zip(keys, digests, raws))
+
+
+def _payload(digest: bytes, raw, sources: List[ProjectFile]):
+    for source in sources:
+        if digest in source.chunks:
+            return source.read(digest)  # Already compressed in a project file
+    if raw is None:
+        raise ValueError(f"Tile {digest.hex()} is missing from the project")
+    return zlib.compress(raw, COMPRESSION_LEVEL)
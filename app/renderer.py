@@ -3,9 +3,12 @@
 import tkinter as tk
 from PIL import Image, ImageTk, ImageDraw
 import numpy as np
-from typing import List, Tuple, Optional
+from typing import Callable, List, Tuple, Optional
+import os
 import time
 
+from app.compositor import composite_layers
+
 class Renderer:
     def __init__(self, app_state, canvas):
         self.app = app_state
@@ -91,6 +94,17 @@ class Renderer:
         except Exception as e:
             print(f"❌ Placeholder error: {e}")
 
+    def _show_loading(self, doc):
+        """Placeholder for a document whose format has no quick preview"""
+        self.canvas.update_idletasks()
+        canvas_width = max(400, self.canvas.winfo_width())
+        canvas_height = max(300, self.canvas.winfo_height())
+        self.canvas.create_text(
+            canvas_width // 2, canvas_height // 2,
+            text=f"Loading {os.path.basename(doc.filename)}...\n{doc.size[0]} x {doc.size[1]}",
+            fill="#888888", font=("Arial", 14, "bold"), justify=tk.CENTER, anchor=tk.CENTER
+        )
+
     def composite_all_layers(self) -> Optional[Image.Image]:
         """Composite all visible layers - FIXED"""
         if not self.app.active_document or not self.app.active_document.layers:
@@ -102,24 +116,14 @@ class Renderer:
         if not visible_layers:
             return None
             
-        # **FIXED: Check if we have valid images**
-        for layer in visible_layers:
-            if not hasattr(layer, 'image') or layer.image is None:
-                return None
-        
         current_hash = self._get_layers_hash(visible_layers)
         if (not self.cache_dirty and self.composite_cache and 
             self.last_composite_hash == current_hash):
             return self.composite_cache
             
         try:
-            # Start with bottom layer
-            composite = visible_layers[0].image.copy()
-            
-            # Blend other layers on top
-            for layer in visible_layers[1:]:
-                if layer.opacity > 0 and hasattr(layer, 'image') and layer.image:
-                    composite = self._blend_layers(composite, layer)
+            # **UPDATED: Layers are blended into one buffer by the compositor**
+            composite = composite_layers(visible_layers)
             
             # Update cache
             self.composite_cache = composite
@@ -136,29 +140,10 @@ class Renderer:
         """Generate hash for layers state"""
         hash_parts = []
         for layer in layers:
-            if hasattr(layer, 'image') and layer.image:
-                hash_parts.append(f"{layer.name}_{layer.visible}_{layer.opacity}_{layer.image.size}")
-            else:
-                hash_parts.append(f"{layer.name}_{layer.visible}_{layer.opacity}_noimage")
+            # Sizes come from the layer itself - reading ``image`` would allocate empty layers
+            hash_parts.append(f"{layer.name}_{layer.visible}_{layer.opacity}_{layer.size}")
         return "_".join(hash_parts)
 
-    def _blend_layers(self, base: Image.Image, layer) -> Image.Image:
-        """Simple layer blending"""
-        if layer.opacity >= 1.0 and layer.blend_mode == "normal":
-            return Image.alpha_composite(base, layer.image)
-            
-        # Apply opacity
-        if layer.opacity < 1.0:
-            overlay = layer.image.copy()
-            # Simple opacity implementation
-            if overlay.mode == 'RGBA':
-                r, g, b, a = overlay.split()
-                a = a.point(lambda x: x * layer.opacity)
-                overlay.putalpha(a)
-            return Image.alpha_composite(base, overlay)
-        else:
-            return Image.alpha_composite(base, layer.image)
-
     def _fit_and_display_image(self):
         """Fit and display current active document's image - COMPLETELY FIXED"""
         print("🔄 _fit_and_display_image called")
@@ -177,12 +162,23 @@ class Renderer:
             self._show_placeholder()
             return
         
-        # **FIXED: Get composite image**
-        display_image = self.composite_all_layers()
-        if not display_image:
-            print("❌ No composite image")
-            self._show_placeholder()
-            return
+        # **NEW: While a lazy open is decoding, show its reduced preview.
+        # Zoom is still computed against the full document size so tool
+        # coordinates don't change when the full image is swapped in.**
+        if active_doc.loading:
+            display_image = active_doc.preview
+            if display_image is None:
+                self._show_loading(active_doc)
+                return
+            full_width, full_height = active_doc.size
+        else:
+            # **FIXED: Get composite image**
+            display_image = self.composite_all_layers()
+            if not display_image:
+                print("❌ No composite image")
+                self._show_placeholder()
+                return
+            full_width, full_height = display_image.size
             
         print(f"✅ Display image size: {display_image.size}")
         self.original_image = display_image
@@ -206,14 +202,14 @@ class Renderer:
         available_width = max(100, canvas_width - 2 * margin)
         available_height = max(100, canvas_height - 2 * margin)
         
-        scale_x = available_width / display_image.width
-        scale_y = available_height / display_image.height
+        scale_x = available_width / full_width
+        scale_y = available_height / full_height
         
         self.zoom_level = min(scale_x, scale_y, 1.0)
         
         # Calculate display size
-        display_width = int(display_image.width * self.zoom_level)
-        display_height = int(display_image.height * self.zoom_level)
+        display_width = int(full_width * self.zoom_level)
+        display_height = int(full_height * self.zoom_level)
         
         print(f"✅ Display size: {display_width}x{display_height}, Zoom: {self.zoom_level}")
         
@@ -428,20 +424,47 @@ class Renderer:
         except Exception as e:
             print(f"❌ Temporary display error: {e}")
 
+    def display_preview(self, display_image: Image.Image):
+        """**NEW: Show a preview that is already at display resolution**
+
+        Unlike ``temporary_display`` this does no resampling and keeps the
+        current layout - it only swaps the pixels of the canvas image item.
+        """
+        try:
+            photo = ImageTk.PhotoImage(display_image)
+            self.photo_references.append(photo)
+            
+            # Keep only last 3 references
+            if len(self.photo_references) > 3:
+                self.photo_references.pop(0)
+            
+            if self.canvas_image_id and self.canvas.find_withtag("current_image"):
+                self.canvas.itemconfig(self.canvas_image_id, image=photo)
+            else:
+                self.canvas_image_id = self.canvas.create_image(
+                    self.last_image_x, self.last_image_y,
+                    anchor=tk.NW,
+                    image=photo,
+                    tags=("current_image",)
+                )
+            
+            self.canvas.update_idletasks()
+            
+        except Exception as e:
+            print(f"❌ Preview display error: {e}")
+
     def load_image(self, image_path: str) -> bool:
         """**NEW: Direct image loading method**"""
         try:
             print(f"🖼️ Loading image: {image_path}")
             
-            # Load image using PIL
-            new_image = Image.open(image_path).convert("RGBA")
-            print(f"📏 Loaded image size: {new_image.size}")
-            
-            # Create new document
-            doc = self.app.open_document(image_path, new_image)
+            # **UPDATED: Show a preview now, swap in the full decode when it's ready**
+            doc = self.app.open_document_lazy(image_path)
+            print(f"📏 Image size: {doc.size}")
             
             # Force render
             self.render(force=True)
+            self.watch_loading(doc)
             
             print(f"✅ Image loaded and displayed: {image_path}")
             return True
@@ -450,6 +473,30 @@ class Renderer:
             print(f"❌ Image loading error: {e}")
             return False
 
+    def watch_loading(self, doc, on_error: Optional[Callable] = None):
+        """**NEW: Poll a lazily opened document from the UI thread until its full image is in**
+
+        A document that fails to decode is closed and ``on_error(doc, error)``
+        is called.
+        """
+        try:
+            if not doc.finish_loading():
+                self.canvas.after(50, self.watch_loading, doc, on_error)
+                return
+        except Exception as e:
+            print(f"❌ Image loading error: {e}")
+            if doc in self.app.documents:
+                self.app.close_document(self.app.documents.index(doc))
+            self.render(force=True)
+            if on_error:
+                on_error(doc, e)
+            return
+        
+        print(f"✅ Full resolution loaded: {doc.filename}")
+        if doc is self.app.active_document:
+            self.mark_cache_dirty()
+            self.render(force=True)
+
     # Zoom and pan methods
     def zoom_in(self, x: int, y: int):
         if self.app.active_document:
@@ -0,0 +1,314 @@
+# app/tile_store.py - BYTE-BUDGETED HISTORY TILE MEMORY
+
+import itertools
+import mmap
+import os
+import queue
+import shutil
+import threading
+from collections import OrderedDict
+
+# Compressed history tile bytes kept in RAM across all open documents
+DEFAULT_MEMORY_BUDGET = 256 * 1024 * 1024
+
+# Journals are compacted once dead space exceeds both this and the live data
+COMPACT_MIN_DEAD_BYTES = 16 * 1024 * 1024
+
+
+class HistoryJournal:
+    """Per-document append-only file of spilled tile payloads
+
+    Payloads are appended to a single file and located through an in-memory
+    offset index; reads are slices of a memory map. Discarded payloads leave
+    dead space that is reclaimed by compacting the file once it outweighs
+    the live data. Handles are index ids, so they survive compaction.
+
+    Deduplicated tiles can outlive the document that created them, so the
+    journal counts the tiles using it and a close only takes effect once
+    the last of them is released.
+    """
+
+    def __init__(self, directory: str, filename: str = "history.journal"):
+        self.path = os.path.join(directory, filename)
+        self._file = open(self.path, 'w+b')
+        self._index = {}  # handle -> (offset, length)
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._map = None
+        self.size = 0
+        self.live_bytes = 0
+        self.compactions = 0
+        self.users = 0  # Live tiles with this journal as their spill target
+        self._closing = False
+        self._remove_dir = None
+
+    def write(self, data: bytes):
+        with self._lock:
+            if self._needs_compaction():
+                self._compact()
+            self._file.seek(self.size)
+            self._file.write(data)
+            self._file.flush()
+
+            handle = next(self._ids)
+            self._index[handle] = (self.size, len(data))
+            self.size += len(data)
+            self.live_bytes += len(data)
+            return handle
+
+    def read(self, handle) -> bytes:
+        with self._lock:
+            offset, length = self._index[handle]
+            if self._map is None or len(self._map) < offset + length:
+                self._remap()
+            return self._map[offset:offset + length]
+
+    def discard(self, handle):
+        with self._lock:
+            entry = self._index.pop(handle, None)
+            if entry is not None:
+                self.live_bytes -= entry[1]
+
+    def attach(self):
+        with self._lock:
+            self.users += 1
+
+    def detach(self):
+        with self._lock:
+            self.users -= 1
+            if self._closing and self.users <= 0:
+                self._close()
+
+    def close(self, remove_dir: bool = False):
+        """Close the journal (and delete its directory) once no tile uses it"""
+        with self._lock:
+            self._closing = True
+            self._remove_dir = os.path.dirname(self.path) if remove_dir else None
+            if self.users <= 0:
+                self._close()
+
+    def _close(self):
+        if self._file.closed:
+            return
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+        if self._remove_dir and os.path.exists(self._remove_dir):
+            shutil.rmtree(self._remove_dir, ignore_errors=True)
+
+    def _remap(self):
+        if self._map is not None:
+            self._map.close()
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _needs_compaction(self) -> bool:
+        dead_bytes = self.size - self.live_bytes
+        return dead_bytes > COMPACT_MIN_DEAD_BYTES and dead_bytes > self.live_bytes
+
+    def _compact(self):
+        """Rewrite live payloads into a fresh file (runs on the writer thread)"""
+        if self._map is None or len(self._map) < self.size:
+            self._remap()
+
+        compact_path = self.path + ".compact"
+        index = {}
+        offset = 0
+        with open(compact_path, 'wb') as f:
+            for handle, (old_offset, length) in sorted(self._index.items(), key=lambda item: item[1][0]):
+                f.write(self._map[old_offset:old_offset + length])
+                index[handle] = (offset, length)
+                offset += length
+
+        self._map.close()
+        self._map = None
+        self._file.close()
+        os.replace(compact_path, self.path)
+        self._file = open(self.path, 'r+b')
+        self._index = index
+        self.size = offset
+        self.compactions += 1
+
+
+class SpillWriter:
+    """Background thread writing evicted payloads to their spill targets
+
+    The queue is bounded so a burst of evictions applies back-pressure
+    instead of piling up unwritten payloads.
+    """
+
+    def __init__(self, memory: 'TileMemory', max_pending: int = 64):
+        self.memory = memory
+        self.queue = queue.Queue(maxsize=max_pending)
+        self._thread = None
+        self._thread_lock = threading.Lock()
+
+    def submit(self, tile, data: bytes):
+        if self._thread is None:
+            with self._thread_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="imageforge-history-writer", daemon=True)
+                    self._thread.start()
+        self.queue.put((tile, data))
+
+    def flush(self):
+        """Block until every queued payload is written"""
+        self.queue.join()
+
+    def _run(self):
+        while True:
+            tile, data = self.queue.get()
+            try:
+                # Skip tiles released while they were queued
+                handle = tile.spill.write(data) if tile.refs > 0 else None
+            except Exception as e:
+                print(f"⚠️ History spill failed, keeping tile in memory: {e}")
+                handle = None
+            try:
+                self.memory.finish_write(tile, handle)
+            finally:
+                self.queue.task_done()
+
+
+class TileMemory:
+    """Process-wide LRU of resident tile payloads with a byte budget
+
+    When the budget is exceeded the least recently used payloads are handed
+    to the background writer and dropped from RAM once they are on disk;
+    until then memory stays authoritative, so queued tiles read instantly.
+    Spilled payloads are read back transparently the next time they're used.
+    """
+
+    def __init__(self, budget_bytes: int = DEFAULT_MEMORY_BUDGET):
+        self.budget_bytes = budget_bytes
+        self.lock = threading.RLock()
+        self.writer = SpillWriter(self)
+        self._resident = OrderedDict()
+        self.resident_bytes = 0
+        self.pending_bytes = 0
+        self.disk_bytes = 0
+        self.spills = 0
+        self.reloads = 0
+
+    def add(self, tile):
+        """Track a payload that just became resident and enforce the budget"""
+        with self.lock:
+            self._track(tile)
+            to_write = self._enforce(keep=tile)
+        self._write(to_write)
+
+    def touch(self, tile):
+        """Mark a resident payload as recently used"""
+        with self.lock:
+            if tile in self._resident:
+                self._resident.move_to_end(tile)
+                return
+            if tile._data is None or tile.refs <= 0:
+                return
+            # Used again while its write is still queued
+            self._track(tile)
+            to_write = self._enforce(keep=tile)
+        self._write(to_write)
+
+    def reload(self, tile):
+        """Payload of a tile that is not tracked as resident, read from disk if needed"""
+        with self.lock:
+            data = tile._data
+            if data is None:
+                if tile.handle is None:
+                    return None  # Released
+                data = tile._data = tile.spill.read(tile.handle)
+                self.reloads += 1
+            self._track(tile)
+            to_write = self._enforce(keep=tile)
+        self._write(to_write)
+        return data
+
+    def forget(self, tile):
+        """Drop a released tile's payload from memory and disk"""
+        with self.lock:
+            self._untrack(tile)
+            if tile.handle is not None:
+                tile.spill.discard(tile.handle)
+                self.disk_bytes -= tile.nbytes
+                tile.handle = None
+            tile._data = None
+
+    def finish_write(self, tile, handle):
+        """Called by the writer once a queued payload is on disk (``handle`` None if it failed)"""
+        with self.lock:
+            tile.pending = False
+            self.pending_bytes -= tile.nbytes
+            if tile.refs <= 0:
+                # Released while queued
+                if handle is not None:
+                    tile.spill.discard(handle)
+                return
+            if handle is None:
+                self._track(tile)
+                return
+
+            tile.handle = handle
+            self.disk_bytes += tile.nbytes
+            self.spills += 1
+            if tile not in self._resident:
+                tile._data = None
+
+    def set_budget(self, budget_bytes: int):
+        with self.lock:
+            self.budget_bytes = budget_bytes
+            to_write = self._enforce()
+        self._write(to_write)
+
+    def flush(self):
+        self.writer.flush()
+
+    def _track(self, tile):
+        if tile in self._resident:
+            self._resident.move_to_end(tile)
+        else:
+            self._resident[tile] = None
+            self.resident_bytes += tile.nbytes
+
+    def _untrack(self, tile):
+        if tile in self._resident:
+            del self._resident[tile]
+            self.resident_bytes -= tile.nbytes
+
+    def _enforce(self, keep=None):
+        """Evict least recently used payloads; returns the ones that must be written"""
+        to_write = []
+        while self.resident_bytes > self.budget_bytes and self._resident:
+            tile = next(iter(self._resident))
+            if tile is keep:
+                if len(self._resident) == 1:
+                    break
+                self._resident.move_to_end(tile)
+                continue
+            self._untrack(tile)
+            if tile.handle is not None:
+                tile._data = None  # Already on disk
+            elif not tile.pending:
+                tile.pending = True
+                self.pending_bytes += tile.nbytes
+                to_write.append((tile, tile._data))
+        return to_write
+
+    def _write(self, to_write):
+        # Outside the lock: a full queue blocks until the writer catches up
+        for tile, data in to_write:
+            self.writer.submit(tile, data)
+
+
+_tile_memory = None
+_memory_lock = threading.Lock()
+
+
+def get_tile_memory() -> TileMemory:
+    """Budget shared by the history of every open document"""
+    global _tile_memory
+    if _tile_memory is None:
+        with _memory_lock:
+            if _tile_memory is None:
+                _tile_memory = TileMemory()
+    return _tile_memory
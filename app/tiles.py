@@ -0,0 +1,324 @@
+# app/tiles.py - REFERENCE-COUNTED TILE SNAPSHOTS
+
+import hashlib
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Tuple
+from PIL import Image
+import numpy as np
+
+from app.tile_store import get_tile_memory
+from app.layer_store import get_layer_store
+from app.utils import PIXEL_MODE, image_view, new_pixels, pixel_buffer
+
+TILE_SIZE = 256
+
+# **NEW: Tiles are stored as zlib-compressed XOR deltas against the same tile
+# in the previous snapshot. Level 1 is several times faster than PNG with
+# optimize=True and mostly-zero deltas still shrink to a few KB.**
+COMPRESSION_LEVEL = 1
+MAX_DELTA_CHAIN = 8  # Decoding a tile never walks more than this many deltas
+
+# Recently decoded tiles, so capture/restore of consecutive states don't
+# decompress the same base tiles over and over
+DECODED_CACHE_BYTES = 64 * 1024 * 1024
+_decoded = OrderedDict()
+_decoded_bytes = 0
+
+# **NEW: Content-addressed tile store - every live tile is indexed by a hash
+# of its pixels, so identical tiles are stored once no matter which entry or
+# document captured them (undo/redo round trips, no-op strokes, documents
+# opened from the same file)**
+DIGEST_SIZE = 16
+_by_digest = {}
+_dedup_lookups = 0
+_dedup_hits = 0
+
+
+def tile_digest(raw: bytes) -> bytes:
+    """Fingerprint of a tile's decoded pixel bytes"""
+    return hashlib.blake2b(raw, digest_size=DIGEST_SIZE).digest()
+
+
+def dedup_stats() -> Dict[str, Any]:
+    """Process-wide hit rate of the content-addressed tile store"""
+    return {
+        'dedup_lookups': _dedup_lookups,
+        'dedup_hits': _dedup_hits,
+        'dedup_hit_rate': round(_dedup_hits / _dedup_lookups, 3) if _dedup_lookups else 0.0,
+        'dedup_tiles': len(_by_digest),
+    }
+
+
+def xor_bytes(a: bytes, b: bytes) -> bytes:
+    """Vectorized byte-wise XOR of two equal-length buffers"""
+    return np.bitwise_xor(np.frombuffer(a, np.uint8), np.frombuffer(b, np.uint8)).tobytes()
+
+
+class Tile:
+    """Immutable block of pixel bytes, shared between snapshots by reference
+
+    The pixels are kept compressed, either on their own or as a delta against
+    a ``base`` tile that this tile keeps alive. Tiles created with a ``spill``
+    target count against the shared history memory budget and may have their
+    payload moved to disk (in the background) while unused.
+    """
+
+    __slots__ = ('_data', 'nbytes', 'refs', 'base', 'depth', 'spill', 'handle', 'pending', 'digest')
+
+    def __init__(self, raw: bytes, base: Optional['Tile'] = None, spill=None, digest: Optional[bytes] = None):
+        if base is not None and base.depth < MAX_DELTA_CHAIN and not base.released:
+            base_raw = base.raw
+            if len(base_raw) != len(raw):
+                base = None
+        else:
+            base = None
+
+        if base is not None:
+            self._data = zlib.compress(xor_bytes(raw, base_raw), COMPRESSION_LEVEL)
+            self.base = base.acquire()
+            self.depth = base.depth + 1
+        else:
+            self._data = zlib.compress(raw, COMPRESSION_LEVEL)
+            self.base = None
+            self.depth = 0
+        self.nbytes = len(self._data)  # Compressed size, not counting the base
+        self.refs = 0
+        self.spill = spill
+        self.handle = None
+        self.pending = False  # Queued for the background writer
+        self.digest = digest or tile_digest(raw)
+        _by_digest.setdefault(self.digest, self)
+        _remember(self, raw)
+        if spill is not None:
+            spill.attach()
+            get_tile_memory().add(self)
+
+    @property
+    def released(self) -> bool:
+        return self._data is None and self.handle is None
+
+    @property
+    def resident(self) -> bool:
+        return self._data is not None
+
+    @property
+    def data(self) -> Optional[bytes]:
+        """Compressed payload, read back from the spill target if it was evicted"""
+        data = self._data
+        if self.spill is None:
+            return data
+        if data is not None:
+            get_tile_memory().touch(self)
+            return data
+        return get_tile_memory().reload(self)
+
+    @property
+    def raw(self) -> bytes:
+        """Decoded pixel bytes"""
+        raw = _decoded.get(self)
+        if raw is not None:
+            _decoded.move_to_end(self)
+            return raw
+
+        raw = zlib.decompress(self.data)
+        if self.base is not None:
+            raw = xor_bytes(raw, self.base.raw)
+        _remember(self, raw)
+        return raw
+
+    def prefetch(self):
+        """Make sure this tile and its delta bases are in memory"""
+        tile = self
+        while tile is not None:
+            tile.data
+            tile = tile.base
+
+    def acquire(self) -> 'Tile':
+        self.refs += 1
+        return self
+
+    def release(self):
+        self.refs -= 1
+        if self.refs > 0:
+            return
+
+        _forget(self)
+        if _by_digest.get(self.digest) is self:
+            del _by_digest[self.digest]
+        if self.spill is not None:
+            get_tile_memory().forget(self)
+            self.spill.detach()
+        else:
+            self._data = None
+
+        if self.base is not None:
+            self.base.release()
+            self.base = None
+
+
+def _remember(tile: Tile, raw: bytes):
+    global _decoded_bytes
+    if tile in _decoded:
+        return
+    _decoded[tile] = raw
+    _decoded_bytes += len(raw)
+    while _decoded_bytes > DECODED_CACHE_BYTES and _decoded:
+        _, old = _decoded.popitem(last=False)
+        _decoded_bytes -= len(old)
+
+
+def _forget(tile: Tile):
+    global _decoded_bytes
+    raw = _decoded.pop(tile, None)
+    if raw is not None:
+        _decoded_bytes -= len(raw)
+
+
+class TileSnapshot:
+    """Copy-on-write pixel snapshot made of ``TILE_SIZE`` tiles
+
+    Tiles that are byte-identical to any live tile (found by content hash)
+    are shared instead of copied, so consecutive history states only pay for
+    the tiles an action actually changed - and those are stored as
+    compressed deltas against the base tile. A snapshot can cover the whole image or just the
+    tiles overlapping a region.
+    """
+
+    def __init__(self, size: Tuple[int, int], mode: str, tiles: Dict[Tuple[int, int], Tile], bbox=None):
+        self.size = size
+        self.mode = mode
+        self.tiles = tiles
+        self.bbox = bbox  # None for full-image snapshots
+
+    @property
+    def is_full(self) -> bool:
+        return self.bbox is None
+
+    @classmethod
+    def capture(cls, image: Image.Image, bases: Iterable[Optional['TileSnapshot']] = (), bbox=None,
+                spill=None) -> 'TileSnapshot':
+        """Snapshot ``image`` (or the tiles overlapping ``bbox``), sharing identical tiles
+
+        Unchanged tiles are found by content hash, so nothing has to be
+        decoded to compare them; changed tiles are stored as deltas against
+        the same tile of the first of ``bases`` that has it. New tiles get
+        ``spill`` as their disk target, which puts them under the shared
+        history memory budget.
+        """
+        global _dedup_lookups, _dedup_hits
+        width, height = image.size
+        bases = [base for base in bases if base is not None and base.size == image.size and base.mode == image.mode]
+
+        # Layer images are views of a NumPy buffer - slice it instead of cropping
+        pixels = pixel_buffer(image)
+
+        tiles = {}
+        for key in tile_keys(image.size, bbox):
+            box = tile_box(key, image.size)
+            if pixels is not None:
+                get_layer_store().touch(pixels, box[1], box[3])
+                data = pixels[box[1]:box[3], box[0]:box[2]].tobytes()
+            else:
+                data = image.crop(box).tobytes()
+            digest = tile_digest(data)
+
+            tile = _by_digest.get(digest)
+            _dedup_lookups += 1
+            if tile is not None:
+                _dedup_hits += 1
+            else:
+                delta_base = None
+                for base in bases:
+                    base_tile = base.tiles.get(key)
+                    if base_tile is not None and not base_tile.released:
+                        delta_base = base_tile
+                        break
+                tile = Tile(data, delta_base, spill, digest)
+
+            tiles[key] = tile.acquire()
+
+        return cls(image.size, image.mode, tiles, bbox)
+
+    def restore_into(self, image: Image.Image, current: Optional['TileSnapshot'] = None):
+        """Paste this snapshot's tiles into ``image`` in place
+
+        Tiles that ``current`` (a snapshot of ``image``) shares by reference
+        are already correct and skipped. Returns the bbox that was written, or
+        None if nothing changed.
+        """
+        pixels = pixel_buffer(image) if self.mode == image.mode else None
+        changed = None
+        for key, tile in self.tiles.items():
+            if current is not None and current.tiles.get(key) is tile:
+                continue
+            box = tile_box(key, self.size)
+            width, height = box[2] - box[0], box[3] - box[1]
+            if pixels is not None:
+                get_layer_store().touch(pixels, box[1], box[3])
+                pixels[box[1]:box[3], box[0]:box[2]] = np.frombuffer(tile.raw, np.uint8).reshape(height, width, 4)
+            else:
+                image.paste(Image.frombytes(self.mode, (width, height), tile.raw), box[:2])
+            changed = box if changed is None else (
+                min(changed[0], box[0]), min(changed[1], box[1]),
+                max(changed[2], box[2]), max(changed[3], box[3])
+            )
+        return changed
+
+    def to_image(self) -> Image.Image:
+        """Materialize a full snapshot as a new image"""
+        if self.mode == PIXEL_MODE:
+            image = image_view(new_pixels(*self.size))
+        else:
+            image = Image.new(self.mode, self.size)
+        self.restore_into(image)
+        return image
+
+    def prefetch(self):
+        """Load any spilled tiles ahead of a restore"""
+        for tile in list(self.tiles.values()):
+            tile.prefetch()
+
+    def release(self):
+        """Drop this snapshot's tile references (safe to call more than once)"""
+        for tile in self.tiles.values():
+            tile.release()
+        self.tiles = {}
+
+    @property
+    def logical_bytes(self) -> int:
+        """Compressed bytes this snapshot would take without sharing"""
+        return sum(tile.nbytes for tile in self.tiles.values())
+
+
+def tile_keys(size: Tuple[int, int], bbox=None):
+    """Grid coordinates of the tiles covering ``bbox`` (or the whole image)"""
+    width, height = size
+    x1, y1, x2, y2 = bbox if bbox else (0, 0, width, height)
+    x1, y1 = max(0, x1), max(0, y1)
+    x2, y2 = min(width, x2), min(height, y2)
+    if x2 <= x1 or y2 <= y1:
+        return []
+    return [
+        (tx, ty)
+        for ty in range(y1 // TILE_SIZE, (y2 - 1) // TILE_SIZE + 1)
+        for tx in range(x1 // TILE_SIZE, (x2 - 1) // TILE_SIZE + 1)
+    ]
+
+
+def tile_box(key: Tuple[int, int], size: Tuple[int, int]):
+    """Pixel box of a tile, clipped to the image size"""
+    tx, ty = key
+    x1, y1 = tx * TILE_SIZE, ty * TILE_SIZE
+    return (x1, y1, min(x1 + TILE_SIZE, size[0]), min(y1 + TILE_SIZE, size[1]))
+
+
+def unique_tiles(snapshots: Iterable[TileSnapshot]) -> Dict[int, Tile]:
+    """Distinct tiles held by ``snapshots`` (including delta bases), keyed by identity"""
+    tiles = {}
+    for snapshot in snapshots:
+        for tile in snapshot.tiles.values():
+            while tile is not None and id(tile) not in tiles:
+                tiles[id(tile)] = tile
+                tile = tile.base
+    return tiles
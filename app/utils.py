@@ -0,0 +1,75 @@
+# app/utils.py - PIXEL BUFFER HELPERS
+
+from typing import Optional, Sequence, Tuple
+from PIL import Image
+import numpy as np
+
+# **NEW: Layer pixels live in contiguous (height, width, 4) uint8 NumPy
+# buffers. PIL images are zero-copy views of those buffers, so PIL drawing,
+# NumPy math and history capture/restore all work on the same memory.**
+PIXEL_MODE = "RGBA"
+
+
+def new_pixels(width: int, height: int, fill=(0, 0, 0, 0)) -> np.ndarray:
+    """Allocate a pixel buffer filled with one RGBA color"""
+    if not any(fill):
+        return np.zeros((height, width, 4), dtype=np.uint8)
+    pixels = np.empty((height, width, 4), dtype=np.uint8)
+    # One 32-bit store per pixel - much faster than broadcasting a 4-tuple
+    pixels.view(np.uint32)[...] = np.frombuffer(bytes(fill), dtype=np.uint32)[0]
+    return pixels
+
+
+def pixels_from_image(image: Image.Image) -> np.ndarray:
+    """Contiguous RGBA copy of an image's pixels"""
+    buffer = pixel_buffer(image)
+    if buffer is not None:
+        return buffer.copy()
+    if image.mode != PIXEL_MODE:
+        image = image.convert(PIXEL_MODE)
+    return np.asarray(image).copy()
+
+
+def image_view(pixels: np.ndarray) -> Image.Image:
+    """Writable PIL image sharing memory with ``pixels`` (no copy)"""
+    height, width = pixels.shape[:2]
+    image = Image.frombuffer(PIXEL_MODE, (width, height), pixels, "raw", PIXEL_MODE, 0, 1)
+    # frombuffer images are read-only and would silently copy themselves on
+    # the first paste or draw - the buffer is ours, so allow writing through
+    image.readonly = 0
+    image._pixel_buffer = pixels
+    return image
+
+
+def pixel_buffer(image: Image.Image) -> Optional[np.ndarray]:
+    """The NumPy buffer behind an image made by ``image_view``, or None"""
+    return getattr(image, '_pixel_buffer', None)
+
+
+def as_pixels(image: Image.Image) -> np.ndarray:
+    """Pixels of ``image`` as an array - zero-copy for buffer views, read-only otherwise"""
+    buffer = pixel_buffer(image)
+    if buffer is not None:
+        return buffer
+    if image.mode != PIXEL_MODE:
+        image = image.convert(PIXEL_MODE)
+    return np.asarray(image)
+
+
+def opacity_table(opacity: float) -> np.ndarray:
+    """Lookup table scaling an alpha channel by ``opacity`` (index it with the alpha array)"""
+    return (np.arange(256) * opacity).astype(np.uint8)
+
+
+def points_bbox(points: Sequence[Tuple[float, float]], margin: float,
+                size: Tuple[int, int]) -> Optional[Tuple[int, int, int, int]]:
+    """Bounding box of ``points`` grown by ``margin`` and clipped to ``size``"""
+    if not points:
+        return None
+    xs, ys = zip(*points)
+    return (
+        max(0, int(min(xs) - margin)),
+        max(0, int(min(ys) - margin)),
+        min(size[0], int(max(xs) + margin)),
+        min(size[1], int(max(ys) + margin))
+    )
@@ -0,0 +1,209 @@
+# app/web_export.py - EXPORT FOR WEB
+
+import io
+import os
+from typing import Any, Dict, List, Optional
+from PIL import Image
+
+from app.export import BackgroundJob, flatten, flatten_rgb
+from app.workers import get_thread_pool
+
+# Pillow format -> file extension of a web variant
+WEB_FORMATS = {
+    "JPEG": ".jpg",
+    "WEBP": ".webp",
+    "PNG": ".png",
+}
+
+DEFAULT_QUALITY = 82
+
+# Qualities searched in target-filesize mode - below 30 JPEG and WebP fall
+# apart, above 95 files grow fast for no visible gain
+QUALITY_RANGE = (30, 95)
+
+# Candidate qualities encoded concurrently in each round of the search
+SEARCH_WIDTH = max(2, min(8, os.cpu_count() or 4))
+
+
+def web_variants(widths, formats, quality: int = DEFAULT_QUALITY, max_bytes: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Every ``(width, format)`` combination, largest first, without duplicates"""
+    variants = []
+    for width in sorted(set(int(w) for w in widths), reverse=True):
+        for format in dict.fromkeys(formats):
+            if format not in WEB_FORMATS:
+                raise ValueError(f"Unsupported web format: {format}")
+            variants.append({'width': width, 'format': format, 'quality': quality, 'max_bytes': max_bytes})
+    return variants
+
+
+def _fit_variants(variants: List[Dict[str, Any]], max_width: int) -> List[Dict[str, Any]]:
+    """``variants`` with widths clamped to ``max_width``, the first of any duplicates kept"""
+    fitted = {}
+    for variant in variants:
+        variant = dict(variant, width=min(variant['width'], max_width))
+        fitted.setdefault((variant['width'], variant['format']), variant)
+    return list(fitted.values())
+
+
+def resize_cascade(image: Image.Image, widths) -> Dict[int, Image.Image]:
+    """The image at each width, every size resampled from the next larger one
+
+    Each step only reduces by the ratio between neighbouring sizes, so the
+    small variants cost a fraction of resampling from full resolution. The
+    work is done premultiplied so transparent pixels don't bleed their color
+    into the edges. Widths at or above the image's own are not upscaled.
+    """
+    full_width, full_height = image.size
+    current = image.convert("RGBa")
+    sizes = {}
+    for width in sorted(set(widths), reverse=True):
+        if width < current.width:
+            height = max(1, round(full_height * width / full_width))
+            current = current.resize((width, height), Image.Resampling.LANCZOS)
+        sizes[width] = current
+    return {width: sized.convert("RGBA") for width, sized in sizes.items()}
+
+
+def encode_web(image: Image.Image, format: str, quality: Optional[int]) -> bytes:
+    """One web variant in memory; ``image`` is RGBA (flattened for JPEG here)"""
+    out = io.BytesIO()
+    if format == "JPEG":
+        flatten_rgb(image).save(out, "JPEG", quality=quality, optimize=True, progressive=True)
+    elif format == "WEBP":
+        image.save(out, "WEBP", quality=quality, method=4)
+    else:
+        image.save(out, "PNG", optimize=True)
+    return out.getvalue()
+
+
+class _QualitySearch:
+    """Highest quality whose encoded size fits ``max_bytes``
+
+    Each round probes up to ``SEARCH_WIDTH`` qualities spread over the
+    remaining range at once and narrows the range to between the best one
+    that fit and the next one that didn't. Without a budget (or for PNG)
+    it is a single encode.
+    """
+
+    def __init__(self, variant: Dict[str, Any], image: Image.Image):
+        self.variant = variant
+        self.image = image
+        self.best = None      # (quality, data) - highest quality known to fit
+        self.fallback = None  # (quality, data) - smallest result so far
+        if variant['format'] == "PNG":
+            self.lo = self.hi = None
+        elif variant['max_bytes'] is None:
+            self.lo = self.hi = variant['quality']
+        else:
+            self.lo, self.hi = QUALITY_RANGE
+        self.done = False
+
+    def candidates(self) -> List[Optional[int]]:
+        if self.lo is None or self.lo == self.hi:
+            return [self.lo]
+        count = min(SEARCH_WIDTH, self.hi - self.lo + 1)
+        step = (self.hi - self.lo) / (count - 1)
+        return sorted({round(self.hi - i * step) for i in range(count)})
+
+    def update(self, results):
+        budget = self.variant['max_bytes']
+        if self.lo is None or budget is None:
+            # One encode: no budget, or PNG - which has no quality to trade
+            self.fallback = results[0]
+            self.best = results[0] if budget is None or len(results[0][1]) <= budget else None
+            self.done = True
+            return
+
+        smallest = min(results, key=lambda result: len(result[1]))
+        if self.fallback is None or len(smallest[1]) < len(self.fallback[1]):
+            self.fallback = smallest
+        fits = [result for result in results if len(result[1]) <= budget]
+        if fits:
+            self.best = max(fits)
+            failed_above = [q for q, _ in results if q > self.best[0]]
+            self.lo = self.best[0] + 1
+            if failed_above:
+                self.hi = min(failed_above) - 1
+        else:
+            self.hi = min(q for q, _ in results) - 1
+        self.done = self.lo > self.hi
+
+    def outcome(self):
+        """(quality, data, over_budget) - the smallest result if nothing fit"""
+        if self.best is not None:
+            return self.best[0], self.best[1], False
+        return self.fallback[0], self.fallback[1], True
+
+
+class WebExportJob(BackgroundJob):
+    """Several sizes and formats of one flattened image, written to a folder
+
+    Sizes come from ``resize_cascade``; every encode - including all the
+    candidate qualities of the target-filesize searches, which run in
+    lockstep - goes to the shared worker pool at once. ``result()`` is a
+    list of one dict per written file.
+
+    Widths above the image's own are never upscaled: they are clamped to it,
+    so each file is named after the width it really has, and variants that
+    end up identical are written once.
+    """
+
+    label = "Export for Web"
+
+    def __init__(self, image: Image.Image, directory: str, basename: str, variants: List[Dict[str, Any]]):
+        super().__init__()
+        self.directory = directory
+        self.basename = basename
+        self.variants = _fit_variants(variants, image.width)
+        self.progress = (0, len(self.variants))
+        self._image = image
+        self.start()
+
+    def run(self) -> List[Dict[str, Any]]:
+        try:
+            sizes = resize_cascade(self._image, [v['width'] for v in self.variants])
+        finally:
+            self._image = None
+        self.check_cancelled()
+
+        pool = get_thread_pool()
+        searches = [_QualitySearch(v, sizes[v['width']]) for v in self.variants]
+        while True:
+            active = [search for search in searches if not search.done]
+            if not active:
+                break
+            rounds = [
+                (search, [(q, pool.submit(encode_web, search.image, search.variant['format'], q))
+                          for q in search.candidates()])
+                for search in active
+            ]
+            for search, probes in rounds:
+                search.update([(q, future.result()) for q, future in probes])
+            self.check_cancelled()
+            self.progress = (sum(search.done for search in searches), len(searches))
+
+        return [self._write(search) for search in searches]
+
+    def _write(self, search: _QualitySearch) -> Dict[str, Any]:
+        variant = search.variant
+        quality, data, over_budget = search.outcome()
+        name = f"{self.basename}-{variant['width']}w{WEB_FORMATS[variant['format']]}"
+        path = os.path.join(self.directory, name)
+        with open(path + ".part", 'wb') as f:
+            f.write(data)
+        os.replace(path + ".part", path)
+        return {
+            'path': path,
+            'width': variant['width'],
+            'format': variant['format'],
+            'size': search.image.size,
+            'quality': quality,
+            'bytes': len(data),
+            'over_budget': over_budget,
+        }
+
+
+def export_for_web(doc, directory: str, variants: List[Dict[str, Any]], basename: Optional[str] = None) -> WebExportJob:
+    """Flatten ``doc`` on the calling thread and write its web variants in the background"""
+    basename = basename or os.path.splitext(os.path.basename(doc.filename))[0]
+    return WebExportJob(flatten(doc.layers), directory, basename, variants)
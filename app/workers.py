@@ -0,0 +1,30 @@
+# app/workers.py - SHARED BACKGROUND WORKER POOLS
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+_thread_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_thread_pool() -> ThreadPoolExecutor:
+    """Process-wide thread pool for CPU work that releases the GIL (Pillow, NumPy, zlib)"""
+    global _thread_pool
+    if _thread_pool is None:
+        with _pool_lock:
+            if _thread_pool is None:
+                _thread_pool = ThreadPoolExecutor(
+                    max_workers=os.cpu_count() or 4,
+                    thread_name_prefix="imageforge-worker"
+                )
+    return _thread_pool
+
+
+def shutdown_thread_pool(wait: bool = True):
+    """Stop the shared pool (a new one is created on next use)"""
+    global _thread_pool
+    with _pool_lock:
+        if _thread_pool is not None:
+            _thread_pool.shutdown(wait=wait)
+            _thread_pool = None
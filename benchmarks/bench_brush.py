@@ -0,0 +1,357 @@
+# benchmarks/bench_brush.py - HEADLESS BRUSH ENGINE BENCHMARK
+"""Replay recorded and synthetic strokes through the brush and eraser tools.
+
+Runs without a Tk window: tools are driven through their mouse handlers
+against a headless renderer that mimics the real one (fit-to-canvas zoom,
+cached display image, full re-render after commit).
+
+Usage (from the repository root):
+
+    python -m benchmarks.bench_brush --quick
+    python -m benchmarks.bench_brush --output bench.json
+    python -m benchmarks.bench_brush --strokes recorded.json --compare old.json
+
+Recorded stroke files are JSON lists of strokes, each a list of [x, y]
+points in document coordinates. Results are written as JSON so runs from
+different revisions can be compared with --compare; progress goes to stderr.
+Each case runs in a fresh process, so its peak RSS is its own.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import math
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+try:
+    import resource
+except ImportError:  # Windows - memory figures are reported as null
+    resource = None
+
+import numpy as np
+import PIL
+from PIL import Image
+
+from app.core import Document
+from tools.brush import MasterBrushTool, LINE_BRUSH_TYPES
+from tools.eraser import EraserTool
+
+TOOLS = {
+    'brush': MasterBrushTool,
+    'eraser': EraserTool,
+}
+
+DEFAULT_SIZES = [5, 50, 200]
+DEFAULT_CANVASES = [(800, 600), (2000, 1500), (4000, 3000)]
+QUICK_SIZES = [20]
+QUICK_CANVASES = [(800, 600)]
+
+# Viewport the headless renderer fits documents into, like the real canvas
+VIEWPORT = (1200, 800)
+MARGIN = 40
+
+
+def max_rss_kb():
+    """Peak resident memory of this process in KiB, or None where it can't be read"""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == "darwin" else rss  # macOS reports bytes
+
+
+class HeadlessRenderer:
+    """Minimal stand-in for ``Renderer`` with the same layout math"""
+
+    def __init__(self, app):
+        self.app = app
+        self.current_image = None
+        self.zoom_level = 1.0
+        self.last_image_x = 0
+        self.last_image_y = 0
+        self.preview_frames = 0
+
+    def render(self, force=False):
+        doc = self.app.active_document
+        composite = doc.layers[0].image
+        for layer in doc.layers[1:]:
+            if layer.visible:
+                composite = Image.alpha_composite(composite, layer.image)
+
+        available_width = VIEWPORT[0] - 2 * MARGIN
+        available_height = VIEWPORT[1] - 2 * MARGIN
+        self.zoom_level = min(available_width / composite.width, available_height / composite.height, 1.0)
+        display_size = (int(composite.width * self.zoom_level), int(composite.height * self.zoom_level))
+        self.current_image = composite.resize(display_size, Image.Resampling.LANCZOS)
+        self.last_image_x = (VIEWPORT[0] - display_size[0]) // 2
+        self.last_image_y = (VIEWPORT[1] - display_size[1]) // 2
+
+    def mark_cache_dirty(self):
+        pass
+
+    def display_preview(self, image):
+        self.preview_frames += 1
+
+    def temporary_display(self, image):
+        self.preview_frames += 1
+        image.resize(self.current_image.size, Image.Resampling.LANCZOS)
+
+
+class HeadlessApp:
+    """Just enough of ``AppState`` for the painting tools"""
+
+    def __init__(self, width, height):
+        self.foreground_color = "#3366cc"
+        self.background_color = "white"
+        self.documents = [Document(width=width, height=height)]
+        self.active_document_index = 0
+        self.renderer = HeadlessRenderer(self)
+        self.renderer.render(force=True)
+
+    @property
+    def active_document(self):
+        return self.documents[self.active_document_index]
+
+
+def synthetic_strokes(width, height, seed=0):
+    """Deterministic strokes covering common hand motions"""
+    rng = random.Random(seed)
+    cx, cy = width / 2, height / 2
+    span = min(width, height) * 0.4
+    strokes = {}
+
+    # Long straight drag across the canvas
+    strokes['line'] = [
+        (width * 0.1 + width * 0.8 * t / 59, height * 0.2 + height * 0.6 * t / 59)
+        for t in range(60)
+    ]
+
+    # Back-and-forth hatching
+    strokes['zigzag'] = [
+        (width * 0.1 + width * 0.8 * t / 59, cy + (span * 0.5 if t % 2 else -span * 0.5))
+        for t in range(60)
+    ]
+
+    # Spiral with steadily shrinking radius
+    strokes['spiral'] = [
+        (cx + math.cos(t * 0.3) * span * (1 - t / 80), cy + math.sin(t * 0.3) * span * (1 - t / 80))
+        for t in range(60)
+    ]
+
+    # Random-walk scribble with short jittery segments
+    x, y = cx, cy
+    scribble = []
+    for _ in range(60):
+        x = min(width - 1, max(0, x + rng.uniform(-span, span) * 0.1))
+        y = min(height - 1, max(0, y + rng.uniform(-span, span) * 0.1))
+        scribble.append((x, y))
+    strokes['scribble'] = scribble
+
+    return strokes
+
+
+def load_recorded_strokes(path):
+    with open(path) as f:
+        data = json.load(f)
+    return {f"recorded_{i}": [tuple(p) for p in stroke] for i, stroke in enumerate(data)}
+
+
+def clamp_stroke(points, width, height):
+    return [(min(width - 1, max(0, x)), min(height - 1, max(0, y))) for x, y in points]
+
+
+def replay_stroke(tool, app, points):
+    """Drive one stroke through the tool's mouse handlers, timing each event"""
+    renderer = app.renderer
+
+    def to_canvas(point):
+        return (renderer.last_image_x + point[0] * renderer.zoom_level,
+                renderer.last_image_y + point[1] * renderer.zoom_level)
+
+    event_times = []
+    tool.on_mouse_down(*to_canvas(points[0]), {})
+    for point in points[1:]:
+        start = time.perf_counter()
+        tool.on_mouse_move(*to_canvas(point), {})
+        event_times.append(time.perf_counter() - start)
+
+    stamps = 0 if tool.brush_type in LINE_BRUSH_TYPES else len(tool.get_stamp_positions())
+    start = time.perf_counter()
+    tool.on_mouse_up(*to_canvas(points[-1]), {})
+    commit_time = time.perf_counter() - start
+
+    return event_times, commit_time, stamps
+
+
+def run_case(tool_name, brush_type, size, canvas, strokes):
+    width, height = canvas
+    app = HeadlessApp(width, height)
+    tool = TOOLS[tool_name](app)
+    tool.brush_type = brush_type
+    tool.brush_size = size
+
+    event_times = []
+    commit_times = []
+    stamps = 0
+
+    # Pixel buffers live in Pillow and NumPy, out of tracemalloc's sight - the
+    # case runs in a fresh process, so its peak RSS is its own
+    rss_before = max_rss_kb()
+    for points in strokes.values():
+        points = clamp_stroke(points, width, height)
+        events, commit_time, stroke_stamps = replay_stroke(tool, app, points)
+        event_times.extend(events)
+        commit_times.append(commit_time)
+        stamps += stroke_stamps
+    rss_after = max_rss_kb()
+
+    total_commit = sum(commit_times)
+    return {
+        'tool': tool_name,
+        'brush_type': brush_type,
+        'brush_size': size,
+        'canvas': [width, height],
+        'strokes': len(strokes),
+        'preview_events': len(event_times),
+        'preview_latency_ms': {
+            'mean': statistics.mean(event_times) * 1000 if event_times else 0.0,
+            'p50': percentile(event_times, 50) * 1000,
+            'p95': percentile(event_times, 95) * 1000,
+            'max': max(event_times, default=0.0) * 1000,
+        },
+        'commit_latency_ms': {
+            'mean': statistics.mean(commit_times) * 1000,
+            'max': max(commit_times) * 1000,
+        },
+        'stamps': stamps,
+        'stamps_per_second': stamps / total_commit if stamps and total_commit > 0 else None,
+        'peak_rss_kb': rss_after,
+        'rss_growth_kb': rss_after - rss_before if rss_after is not None else None,
+    }
+
+
+def run_case_isolated(*args):
+    """``run_case`` in a fresh process, so memory figures don't carry over between cases"""
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn"),
+                             initializer=_quiet_worker) as pool:
+        return pool.submit(run_case, *args).result()
+
+
+def _quiet_worker():
+    # Tools are chatty, and history prints as it is collected at exit - the
+    # worker shares the parent's stdout, which carries the JSON report
+    sys.stdout = open(os.devnull, 'w')
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True).strip()
+    except Exception:
+        return None
+
+
+def compare(results, baseline_path):
+    """Print mean preview/commit latency ratios against a previous run"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+
+    def key(case):
+        return (case['tool'], case['brush_type'], case['brush_size'], tuple(case['canvas']))
+
+    previous = {key(case): case for case in baseline['results']}
+    print(f"{'case':<48} {'preview x':>10} {'commit x':>10}")
+    for case in results:
+        old = previous.get(key(case))
+        if not old:
+            continue
+        preview_ratio = case['preview_latency_ms']['mean'] / max(old['preview_latency_ms']['mean'], 1e-9)
+        commit_ratio = case['commit_latency_ms']['mean'] / max(old['commit_latency_ms']['mean'], 1e-9)
+        name = f"{case['tool']}/{case['brush_type']}/{case['brush_size']}px/{case['canvas'][0]}x{case['canvas'][1]}"
+        print(f"{name:<48} {preview_ratio:>10.2f} {commit_ratio:>10.2f}")
+
+
+def parse_canvas(value):
+    width, height = value.lower().split('x')
+    return int(width), int(height)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Headless brush engine benchmark")
+    parser.add_argument('--tools', nargs='+', choices=sorted(TOOLS), default=sorted(TOOLS))
+    parser.add_argument('--brush-types', nargs='+', default=None)
+    parser.add_argument('--sizes', nargs='+', type=int, default=None)
+    parser.add_argument('--canvas', nargs='+', type=parse_canvas, default=None, help="e.g. 2000x1500")
+    parser.add_argument('--strokes', help="JSON file with recorded strokes")
+    parser.add_argument('--no-synthetic', action='store_true', help="Only replay recorded strokes")
+    parser.add_argument('--quick', action='store_true', help="Small matrix for a fast smoke run")
+    parser.add_argument('--output', help="Write JSON results to this file (default: stdout)")
+    parser.add_argument('--compare', help="Previous JSON results to compare against")
+    args = parser.parse_args(argv)
+
+    # Everything but the report goes to stderr, up to and including interpreter
+    # exit - history managers print as they are collected
+    report_stream = sys.stdout
+    sys.stdout = sys.stderr
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        brush_types = args.brush_types or MasterBrushTool(None).available_brush_types
+    sizes = args.sizes or (QUICK_SIZES if args.quick else DEFAULT_SIZES)
+    canvases = args.canvas or (QUICK_CANVASES if args.quick else DEFAULT_CANVASES)
+    recorded = load_recorded_strokes(args.strokes) if args.strokes else {}
+
+    results = []
+    for canvas in canvases:
+        strokes = {} if args.no_synthetic else synthetic_strokes(*canvas)
+        strokes.update(recorded)
+        if not strokes:
+            parser.error("no strokes to replay")
+        for tool_name in args.tools:
+            for brush_type in brush_types:
+                for size in sizes:
+                    case = run_case_isolated(tool_name, brush_type, size, canvas, strokes)
+                    results.append(case)
+                    print(f"{tool_name:>6} {brush_type:<10} {size:>4}px {canvas[0]}x{canvas[1]}: "
+                          f"preview {case['preview_latency_ms']['mean']:.2f} ms, "
+                          f"commit {case['commit_latency_ms']['mean']:.1f} ms", file=sys.stderr)
+
+    report = {
+        'benchmark': 'brush',
+        'revision': git_revision(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'pillow': PIL.__version__,
+        'numpy': np.__version__,
+        'max_rss_kb': max_rss_kb(),
+        'results': results,
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, report_stream, indent=2)
+        report_stream.write("\n")
+        report_stream.flush()
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
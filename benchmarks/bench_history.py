@@ -0,0 +1,225 @@
+# benchmarks/bench_history.py - HISTORY STATE ENCODING BENCHMARK
+"""Compare the cost of storing history states.
+
+Replays a series of local edits on a synthetic layer and, for every edit,
+stores the state both ways:
+
+* ``png``   - the previous storage path: the full image (or the edited
+  region) written as PNG with ``optimize=True``
+* ``delta`` - tile snapshots holding zlib-compressed XOR deltas against
+  the previous snapshot
+
+Reports encode and decode (restore) time per state and the bytes kept.
+
+Usage (from the repository root):
+
+    python -m benchmarks.bench_history --quick
+    python -m benchmarks.bench_history --output history.json --compare old.json
+"""
+
+import argparse
+import io
+import json
+import platform
+import random
+import statistics
+import sys
+import time
+
+import numpy as np
+import PIL
+from PIL import Image, ImageDraw, ImageFilter
+
+from app.tiles import TileSnapshot, unique_tiles
+from benchmarks.bench_brush import git_revision, parse_canvas, percentile
+
+DEFAULT_CANVASES = [(800, 600), (2000, 1500), (4000, 3000)]
+QUICK_CANVASES = [(800, 600)]
+DEFAULT_EDITS = 30
+QUICK_EDITS = 8
+
+# Same settings the history manager used for its PNG files
+PNG_COMPRESS_LEVEL = 4
+
+
+def make_layer(width, height, seed=0):
+    """Photo-like layer: smooth gradients plus noise, so neither path gets a free ride"""
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    pixels = np.empty((height, width, 4), dtype=np.uint8)
+    pixels[..., 0] = (x + y) / 2
+    pixels[..., 1] = x
+    pixels[..., 2] = y
+    pixels[..., 3] = 255
+    pixels[..., :3] = np.clip(pixels[..., :3] + rng.integers(-12, 12, (height, width, 3)), 0, 255)
+    return Image.fromarray(pixels).filter(ImageFilter.SMOOTH)
+
+
+def edit_boxes(width, height, count, seed=0):
+    """Brush-sized edits scattered over the canvas"""
+    rng = random.Random(seed)
+    boxes = []
+    for _ in range(count):
+        w = rng.randint(20, max(21, width // 6))
+        h = rng.randint(20, max(21, height // 6))
+        x1 = rng.randint(0, width - w)
+        y1 = rng.randint(0, height - h)
+        boxes.append((x1, y1, x1 + w, y1 + h))
+    return boxes
+
+
+def apply_edit(image, box, rng):
+    draw = ImageDraw.Draw(image)
+    draw.ellipse((box[0], box[1], box[2] - 1, box[3] - 1), fill=tuple(rng.randint(0, 255) for _ in range(3)) + (255,))
+
+
+def encode_png(image):
+    buffer = io.BytesIO()
+    image.save(buffer, "PNG", optimize=True, compress_level=PNG_COMPRESS_LEVEL)
+    return buffer.getvalue()
+
+
+def run_png(base, boxes, region):
+    image = base.copy()
+    rng = random.Random(1)
+    encode_times, decode_times, stored = [], [], []
+    for box in boxes:
+        start = time.perf_counter()
+        data = encode_png(image.crop(box) if region else image)
+        encode_times.append(time.perf_counter() - start)
+        stored.append(data)
+        apply_edit(image, box, rng)
+
+    # Undo everything back to the start
+    for box, data in zip(reversed(boxes), reversed(stored)):
+        start = time.perf_counter()
+        state = Image.open(io.BytesIO(data))
+        state.load()
+        if region:
+            image.paste(state, box[:2])
+        else:
+            image = state
+        decode_times.append(time.perf_counter() - start)
+
+    assert np.array_equal(np.asarray(image), np.asarray(base))
+    return encode_times, decode_times, sum(len(data) for data in stored)
+
+
+def run_delta(base, boxes):
+    image = base.copy()
+    rng = random.Random(1)
+    encode_times, decode_times, snapshots = [], [], []
+    previous = None
+    for box in boxes:
+        start = time.perf_counter()
+        previous = TileSnapshot.capture(image, [previous])
+        encode_times.append(time.perf_counter() - start)
+        snapshots.append(previous)
+        apply_edit(image, box, rng)
+
+    memory_bytes = sum(tile.nbytes for tile in unique_tiles(snapshots).values())
+
+    current = TileSnapshot.capture(image, [previous])
+    for snapshot in reversed(snapshots):
+        start = time.perf_counter()
+        snapshot.restore_into(image, current=current)
+        decode_times.append(time.perf_counter() - start)
+        current = snapshot
+
+    assert np.array_equal(np.asarray(image), np.asarray(base))
+    for snapshot in snapshots:
+        snapshot.release()
+    return encode_times, decode_times, memory_bytes
+
+
+def summarize(name, canvas, encode_times, decode_times, stored_bytes):
+    return {
+        'path': name,
+        'canvas': list(canvas),
+        'states': len(encode_times),
+        'encode_ms': {
+            'mean': statistics.mean(encode_times) * 1000,
+            'p95': percentile(encode_times, 95) * 1000,
+        },
+        'decode_ms': {
+            'mean': statistics.mean(decode_times) * 1000,
+            'p95': percentile(decode_times, 95) * 1000,
+        },
+        'stored_bytes': stored_bytes,
+        'bytes_per_state': stored_bytes // max(1, len(encode_times)),
+    }
+
+
+def compare(results, baseline_path):
+    """Print mean encode/decode ratios against a previous run"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+
+    def key(case):
+        return (case['path'], tuple(case['canvas']))
+
+    previous = {key(case): case for case in baseline['results']}
+    print(f"{'case':<28} {'encode x':>10} {'decode x':>10} {'bytes x':>10}")
+    for case in results:
+        old = previous.get(key(case))
+        if not old:
+            continue
+        encode_ratio = case['encode_ms']['mean'] / max(old['encode_ms']['mean'], 1e-9)
+        decode_ratio = case['decode_ms']['mean'] / max(old['decode_ms']['mean'], 1e-9)
+        bytes_ratio = case['stored_bytes'] / max(old['stored_bytes'], 1)
+        name = f"{case['path']}/{case['canvas'][0]}x{case['canvas'][1]}"
+        print(f"{name:<28} {encode_ratio:>10.2f} {decode_ratio:>10.2f} {bytes_ratio:>10.2f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="History state encoding benchmark")
+    parser.add_argument('--canvas', nargs='+', type=parse_canvas, default=None, help="e.g. 2000x1500")
+    parser.add_argument('--edits', type=int, default=None, help="History states per canvas")
+    parser.add_argument('--quick', action='store_true', help="Small matrix for a fast smoke run")
+    parser.add_argument('--output', help="Write JSON results to this file (default: stdout)")
+    parser.add_argument('--compare', help="Previous JSON results to compare against")
+    args = parser.parse_args(argv)
+
+    canvases = args.canvas or (QUICK_CANVASES if args.quick else DEFAULT_CANVASES)
+    edits = args.edits or (QUICK_EDITS if args.quick else DEFAULT_EDITS)
+
+    results = []
+    for canvas in canvases:
+        base = make_layer(*canvas)
+        boxes = edit_boxes(*canvas, edits)
+        cases = [
+            summarize('png_full', canvas, *run_png(base, boxes, region=False)),
+            summarize('png_region', canvas, *run_png(base, boxes, region=True)),
+            summarize('delta', canvas, *run_delta(base, boxes)),
+        ]
+        for case in cases:
+            print(f"{case['path']:>10} {canvas[0]}x{canvas[1]}: "
+                  f"encode {case['encode_ms']['mean']:.2f} ms, "
+                  f"decode {case['decode_ms']['mean']:.2f} ms, "
+                  f"{case['bytes_per_state'] / 1024:.1f} KB/state", file=sys.stderr)
+        results.extend(cases)
+
+    report = {
+        'benchmark': 'history',
+        'revision': git_revision(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'pillow': PIL.__version__,
+        'numpy': np.__version__,
+        'results': results,
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -63,6 +63,14 @@ class BrushContextDialog(tk.Toplevel):
         type_combo.pack(fill=tk.X, pady=5)
         type_combo.bind("<<ComboboxSelected>>", self.on_brush_type_change)
         
+        # Low-latency vector preview (Round brushes only)
+        self.vector_preview_var = tk.BooleanVar(value=getattr(self.brush_tool, 'vector_preview', False))
+        tk.Checkbutton(type_frame, text="Low-latency preview (round brushes)",
+                      variable=self.vector_preview_var,
+                      bg="#404040", fg="white", selectcolor="#2d2d30",
+                      activebackground="#404040", activeforeground="white",
+                      font=("Arial", 8)).pack(anchor="w")
+        
         # ✅ FIX: Buttons at the bottom with proper spacing
         btn_frame = tk.Frame(self.main_frame, bg="#404040")
         btn_frame.grid(row=5, column=0, sticky="ew", pady=(20, 0))
@@ -224,6 +232,7 @@ class BrushContextDialog(tk.Toplevel):
         self.brush_tool.brush_hardness = self.hardness_var.get() 
         self.brush_tool.brush_opacity = self.opacity_var.get()
         self.brush_tool.brush_type = self.brush_type_var.get()
+        self.brush_tool.vector_preview = self.vector_preview_var.get()
         
         # ✅ FIX 1: Call parent's update method
         if hasattr(self.parent, 'update_brush_display'):
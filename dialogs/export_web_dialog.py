@@ -0,0 +1,106 @@
+import tkinter as tk
+from tkinter import messagebox
+
+from app.web_export import DEFAULT_QUALITY, WEB_FORMATS
+
+
+class ExportWebDialog(tk.Toplevel):
+    """**NEW: Export for Web settings** - sizes, formats and quality or a file size budget"""
+
+    def __init__(self, parent, image_width):
+        super().__init__(parent)
+        self.result = None
+        self.image_width = image_width
+        self.transient(parent)
+        self.grab_set()
+
+        self.build_ui()
+        self.center_window()
+
+    def center_window(self):
+        self.update_idletasks()
+        width, height = 420, 360
+        x = max(0, (self.winfo_screenwidth() - width) // 2)
+        y = max(0, (self.winfo_screenheight() - height) // 2)
+        self.geometry(f'{width}x{height}+{x}+{y}')
+
+    def build_ui(self):
+        self.title("ImageForge - Export for Web")
+        self.configure(bg="#2d2d30")
+        self.resizable(False, False)
+
+        main_frame = tk.Frame(self, bg="#2d2d30", padx=20, pady=20)
+        main_frame.pack(fill=tk.BOTH, expand=True)
+
+        # Sizes
+        size_frame = tk.LabelFrame(main_frame, text="Widths (pixels)", font=("Arial", 10, "bold"),
+                                   fg="white", bg="#2d2d30", labelanchor="nw", padx=10, pady=10)
+        size_frame.pack(fill=tk.X, pady=(0, 15))
+        defaults = [w for w in (1920, 1280, 640) if w < self.image_width] or [self.image_width]
+        self.widths_var = tk.StringVar(value=", ".join(str(w) for w in defaults))
+        tk.Entry(size_frame, textvariable=self.widths_var, bg="#3c3c3c", fg="white").pack(fill=tk.X)
+
+        # Formats
+        format_frame = tk.LabelFrame(main_frame, text="Formats", font=("Arial", 10, "bold"),
+                                     fg="white", bg="#2d2d30", labelanchor="nw", padx=10, pady=10)
+        format_frame.pack(fill=tk.X, pady=(0, 15))
+        self.format_vars = {}
+        for format in WEB_FORMATS:
+            var = tk.BooleanVar(value=format != "PNG")
+            tk.Checkbutton(format_frame, text=format, variable=var, fg="white", bg="#2d2d30",
+                           selectcolor="#2d2d30").pack(side=tk.LEFT, padx=(0, 10))
+            self.format_vars[format] = var
+
+        # Quality or target file size
+        quality_frame = tk.LabelFrame(main_frame, text="Quality", font=("Arial", 10, "bold"),
+                                      fg="white", bg="#2d2d30", labelanchor="nw", padx=10, pady=10)
+        quality_frame.pack(fill=tk.X, pady=(0, 15))
+        self.quality_var = tk.IntVar(value=DEFAULT_QUALITY)
+        tk.Scale(quality_frame, from_=1, to=100, orient=tk.HORIZONTAL, variable=self.quality_var,
+                 fg="white", bg="#2d2d30", highlightthickness=0).pack(fill=tk.X)
+
+        limit_row = tk.Frame(quality_frame, bg="#2d2d30")
+        limit_row.pack(fill=tk.X, pady=(5, 0))
+        self.limit_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(limit_row, text="Best quality under", variable=self.limit_var, fg="white",
+                       bg="#2d2d30", selectcolor="#2d2d30").pack(side=tk.LEFT)
+        self.max_kb_var = tk.StringVar(value="200")
+        tk.Entry(limit_row, textvariable=self.max_kb_var, width=8, bg="#3c3c3c", fg="white").pack(side=tk.LEFT)
+        tk.Label(limit_row, text="KB", fg="white", bg="#2d2d30").pack(side=tk.LEFT, padx=5)
+
+        # Buttons
+        btn_frame = tk.Frame(main_frame, bg="#2d2d30")
+        btn_frame.pack(fill=tk.X)
+        tk.Button(btn_frame, text="Cancel", width=10, bg="#5a5a5a", fg="white", relief="flat",
+                  command=self.cancel).pack(side=tk.RIGHT, padx=(10, 0))
+        ok_btn = tk.Button(btn_frame, text="Export...", width=10, bg="#007acc", fg="white", relief="flat",
+                           command=self.ok)
+        ok_btn.pack(side=tk.RIGHT)
+        ok_btn.focus_set()
+
+        self.bind('<Return>', lambda e: self.ok())
+        self.bind('<Escape>', lambda e: self.cancel())
+
+    def ok(self):
+        try:
+            widths = [int(w) for w in self.widths_var.get().replace(",", " ").split()]
+            max_bytes = int(float(self.max_kb_var.get()) * 1024) if self.limit_var.get() else None
+        except ValueError:
+            messagebox.showerror("Error", "Please enter whole numbers for the widths and file size", parent=self)
+            return
+        formats = [format for format, var in self.format_vars.items() if var.get()]
+        if not widths or min(widths) <= 0 or not formats:
+            messagebox.showerror("Error", "Choose at least one width and one format", parent=self)
+            return
+
+        self.result = {
+            'widths': widths,
+            'formats': formats,
+            'quality': self.quality_var.get(),
+            'max_bytes': max_bytes,
+        }
+        self.destroy()
+
+    def cancel(self):
+        self.result = None
+        self.destroy()
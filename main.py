@@ -1,7 +1,7 @@
 # main.py - Corrected imports section
 import tkinter as tk
 from tkinter import ttk, colorchooser, filedialog, messagebox
-from PIL import Image, ImageTk, ImageDraw, ImageFont
+from PIL import ImageTk, ImageDraw, ImageFont
 import numpy as np
 import os
 import cv2
@@ -10,7 +10,12 @@ import json
 # Tool imports - CORRECTED
 from tools.base_tool import BaseTool
 from tools.move_tool import make_tool as make_move_tool
-from app.core import AppState, ToolManager, Layer
+from app.core import AppState, ToolManager, Document
+from app.image_io import OpenBatch
+from app.project_io import PROJECT_EXTENSION, is_project
+from app.export import ExportCancelled, export_document
+from app.web_export import export_for_web, web_variants
+from app.autosave import AUTOSAVE_INTERVAL, Autosaver, discard_recovered, find_recovered, restore
 
 
 # Main Application Class
@@ -23,6 +28,7 @@ class ImageForge:
         
         # Initialize app state
         self.app_state = AppState(root)
+        self.export_job = None  # **NEW: Background export in progress, if any**
         
         # Create main container
         self.main_container = tk.Frame(root, bg="#404040")
@@ -60,6 +66,52 @@ class ImageForge:
         self.root.bind('<Control-n>', lambda e: self.new_file())
         self.root.bind('<Control-o>', lambda e: self.open_file())
         self.root.bind('<Control-s>', lambda e: self.save_file())
+        
+        # **NEW: Crash recovery - edited documents are snapshotted in the
+        # background, and snapshots left by a crashed session are offered back**
+        self.autosaver = Autosaver()
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.root.after_idle(self.offer_recovery)
+        self.root.after(AUTOSAVE_INTERVAL * 1000, self._autosave_tick)
+    
+    def _autosave_tick(self):
+        try:
+            self.autosaver.tick(self.app_state.documents)
+        except Exception as e:
+            print(f"❌ Autosave error: {e}")
+        # Come back sooner while other changed documents are waiting their turn
+        delay = 1000 if self.autosaver.busy else AUTOSAVE_INTERVAL * 1000
+        self.root.after(delay, self._autosave_tick)
+    
+    def offer_recovery(self):
+        recovered = find_recovered()
+        if not recovered:
+            return
+        names = "\n".join(f"• {os.path.basename(item['filename'])}" for item in recovered)
+        if not messagebox.askyesno("Recover Documents",
+                                   f"ImageForge did not close properly last time.\n"
+                                   f"Restore these documents?\n\n{names}"):
+            discard_recovered(recovered)
+            return
+        
+        for item in recovered:
+            try:
+                doc = self.app_state.add_document(restore(item))
+                self.autosaver.adopt(doc, item['path'])
+                print(f"♻️ Recovered: {doc.filename}")
+            except Exception as e:
+                print(f"❌ Could not recover {item['path']}: {e}")
+        self.update_tab_bar()
+        if self.app_state.renderer:
+            self.app_state.renderer.render(force=True)
+    
+    def on_close(self):
+        """Clean exit - recovery snapshots are only kept after a crash"""
+        try:
+            self.autosaver.shutdown()
+        except Exception as e:
+            print(f"❌ Autosave shutdown error: {e}")
+        self.root.destroy()
     
     def _on_window_resize(self, event):
         """Handle main window resize"""
@@ -102,7 +154,7 @@ class ImageForge:
         file_menu.add_command(label="File Info...", command=self.file_info)
         file_menu.add_command(label="Print...", command=self.print_file)
         file_menu.add_separator()
-        file_menu.add_command(label="Exit", command=self.root.quit)
+        file_menu.add_command(label="Exit", command=self.on_close)
         menubar.add_cascade(label="File", menu=file_menu)
         
         # Edit menu
@@ -175,13 +227,7 @@ class ImageForge:
         # Layer menu
         layer_menu = tk.Menu(menubar, tearoff=0, bg="#2d2d30", fg="#cccccc")
         layer_menu.add_command(label="New", command=self.new_layer_menu)
-        def duplicate_layer(self):
-            if hasattr(self, 'layers') and self.layers and self.current_layer_index < len(self.layers):
-                current_layer = self.layers[self.current_layer_index]
-                new_layer = current_layer.copy()
-                self.layers.append(new_layer)
-                self.current_layer_index = len(self.layers) - 1
-                self.update_layer_listbox()
+        layer_menu.add_command(label="Duplicate Layer", command=self.duplicate_layer)
         layer_menu.add_command(label="Delete", command=self.delete_layer_menu)
         layer_menu.add_separator()
         layer_menu.add_command(label="Layer Properties...", command=self.layer_properties)
@@ -355,9 +401,42 @@ class ImageForge:
         self.options_frame = tk.Frame(self.option_bar, bg="#4d4d4d")
         self.options_frame.pack(side=tk.LEFT, fill=tk.X, expand=True)
         
+        # **NEW: Progress of background work (opening files, ...), hidden while idle**
+        self.progress_frame = tk.Frame(self.option_bar, bg="#4d4d4d")
+        self.progress_label = tk.Label(self.progress_frame, text="", bg="#4d4d4d", fg="white", font=("Arial", 9))
+        self.progress_label.pack(side=tk.LEFT, padx=5)
+        self.progress_bar = ttk.Progressbar(self.progress_frame, length=160, mode="determinate")
+        self.progress_bar.pack(side=tk.LEFT, padx=5)
+        self.progress_cancel = tk.Button(self.progress_frame, text="✕", bg="#4d4d4d", fg="white",
+                                         relief="flat", command=self._cancel_progress)
+        self._progress_on_cancel = None
+        
         # Show default options for move tool
         self.show_tool_options("move")
 
+    def show_progress(self, text, done, total, on_cancel=None):
+        """Show (or update) the progress bar in the option bar
+
+        With ``on_cancel`` a cancel button is shown next to the bar.
+        """
+        self.progress_label.config(text=text)
+        self.progress_bar.config(maximum=max(1, total), value=done)
+        self._progress_on_cancel = on_cancel
+        if on_cancel and not self.progress_cancel.winfo_ismapped():
+            self.progress_cancel.pack(side=tk.LEFT)
+        elif not on_cancel and self.progress_cancel.winfo_ismapped():
+            self.progress_cancel.pack_forget()
+        if not self.progress_frame.winfo_ismapped():
+            self.progress_frame.pack(side=tk.RIGHT, padx=10, before=self.options_frame)
+
+    def hide_progress(self):
+        self._progress_on_cancel = None
+        self.progress_frame.pack_forget()
+
+    def _cancel_progress(self):
+        if self._progress_on_cancel:
+            self._progress_on_cancel()
+
     def create_tab_bar(self):
         """Create tab bar for multiple document support - IMPROVED"""
         self.tab_bar = tk.Frame(self.main_container, bg="#2d2d30", height=35)  # Darker background
@@ -420,6 +499,9 @@ class ImageForge:
         else:
             self.tab_bar.pack(side=tk.TOP, fill=tk.X, after=self.option_bar)
 
+        # **NEW: Keep the layers panel in sync with the active document**
+        self.refresh_layers_panel()
+
     def switch_tab(self, index):
         """Switch to different tab/document - FIXED VERSION"""
         if 0 <= index < len(self.app_state.documents):
@@ -455,7 +537,8 @@ class ImageForge:
             # Store the current active index before closing
             was_active = (index == self.app_state.active_document_index)
             
-            # Close the document
+            # Close the document (a deliberate close drops its recovery snapshot)
+            self.autosaver.discard(self.app_state.documents[index])
             self.app_state.close_document(index)
             
             # Update tab bar FIRST
@@ -804,19 +887,33 @@ class ImageForge:
             btn.pack(side=tk.LEFT, padx=2)
     
     def add_sample_layers(self):
-        # Add some sample layers
-        self.layers_listbox.insert(0, "Background")
-        self.layers_listbox.insert(1, "Layer 1")
-        self.layers_listbox.insert(2, "Layer 2")
-        self.layers_listbox.selection_set(0)  # Select the first layer
-        
-        # Create layer objects
-        self.app_state.layers = [
-            Layer("Background", 800, 600),
-            Layer("Layer 1", 800, 600),
-            Layer("Layer 2", 800, 600)
-        ]
-        self.app_state.active_layer_index = 0
+        # **UPDATED: The panel shows the active document's layers**
+        self.refresh_layers_panel()
+
+    def refresh_layers_panel(self):
+        """Rebuild the layers list from the active document"""
+        if not hasattr(self, 'layers_listbox'):
+            return
+        
+        self.layers_listbox.delete(0, tk.END)
+        active_doc = self.app_state.active_document
+        if not active_doc or not active_doc.layers:
+            return
+        
+        for layer in active_doc.layers:
+            self.layers_listbox.insert(tk.END, layer.name if layer.visible else f"{layer.name} (hidden)")
+        
+        self.layers_listbox.selection_set(active_doc.active_layer_index)
+        layer = active_doc.active_layer
+        self.blend_var.set(layer.blend_mode)
+        self.opacity_var.set(int(layer.opacity * 100))
+
+    def _after_layer_change(self):
+        """Re-render and refresh the panel after a layer operation or undo/redo"""
+        self.refresh_layers_panel()
+        if self.app_state.renderer:
+            self.app_state.renderer.mark_cache_dirty()
+            self.app_state.renderer.render(force=True)
     
     def add_centered_placeholder(self):
         # Remove existing placeholder if any
@@ -1166,54 +1263,77 @@ class ImageForge:
         self.add_centered_placeholder()
     
     def on_layer_select(self, event):
+        active_doc = self.app_state.active_document
         selection = self.layers_listbox.curselection()
-        if selection:
-            self.app_state.active_layer_index = selection[0]
+        if active_doc and selection and selection[0] < len(active_doc.layers):
+            active_doc.active_layer_index = selection[0]
             # Update layer properties in the UI
-            if self.app_state.active_layer_index < len(self.app_state.layers):
-                layer = self.app_state.layers[self.app_state.active_layer_index]
-                self.blend_var.set(layer.blend_mode)
-                self.opacity_var.set(int(layer.opacity * 100))
+            layer = active_doc.active_layer
+            self.blend_var.set(layer.blend_mode)
+            self.opacity_var.set(int(layer.opacity * 100))
+    
+    # **UPDATED: Layer panel operations go through the active document so
+    # they are recorded as (pixel-free) history transactions**
     
     def on_blend_mode_change(self, event):
-        if self.app_state.active_layer_index >= 0 and self.app_state.active_layer_index < len(self.app_state.layers):
-            layer = self.app_state.layers[self.app_state.active_layer_index]
-            layer.blend_mode = self.blend_var.get()
+        active_doc = self.app_state.active_document
+        if active_doc and active_doc.layers:
+            if active_doc.set_layer_property(active_doc.active_layer_index, 'blend_mode', self.blend_var.get(),
+                                             "Blend Mode"):
+                self._after_layer_change()
     
     def on_opacity_change(self, event):
-        if self.app_state.active_layer_index >= 0 and self.app_state.active_layer_index < len(self.app_state.layers):
-            layer = self.app_state.layers[self.app_state.active_layer_index]
-            layer.opacity = self.opacity_var.get() / 100.0
+        active_doc = self.app_state.active_document
+        if active_doc and active_doc.layers:
+            # Consecutive slider steps merge into one history entry
+            if active_doc.set_layer_property(active_doc.active_layer_index, 'opacity', self.opacity_var.get() / 100.0,
+                                             "Layer Opacity"):
+                if self.app_state.renderer:
+                    self.app_state.renderer.mark_cache_dirty()
+                    self.app_state.renderer.render(force=True)
     
     def toggle_layer_visibility(self):
+        active_doc = self.app_state.active_document
         selection = self.layers_listbox.curselection()
-        if selection and selection[0] < len(self.app_state.layers):
-            layer = self.app_state.layers[selection[0]]
-            layer.visible = not layer.visible
-            # Update the layer display (you would update the canvas here)
+        if active_doc and selection and selection[0] < len(active_doc.layers):
+            layer = active_doc.layers[selection[0]]
+            active_doc.set_layer_property(selection[0], 'visible', not layer.visible,
+                                          "Hide Layer" if layer.visible else "Show Layer")
+            self._after_layer_change()
     
     def new_layer(self):
-        layer_name = f"Layer {len(self.app_state.layers)}"
-        new_layer = Layer(layer_name, 800, 600)
-        self.app_state.layers.append(new_layer)
-        self.layers_listbox.insert(tk.END, layer_name)
-        self.layers_listbox.selection_clear(0, tk.END)
-        self.layers_listbox.selection_set(tk.END)
-        self.app_state.active_layer_index = len(self.app_state.layers) - 1
+        active_doc = self.app_state.active_document
+        if active_doc:
+            active_doc.add_layer()
+            self._after_layer_change()
     
     def delete_layer(self):
+        active_doc = self.app_state.active_document
         selection = self.layers_listbox.curselection()
-        if selection and selection[0] < len(self.app_state.layers):
-            if len(self.app_state.layers) > 1:  # Don't delete the last layer
-                self.app_state.layers.pop(selection[0])
-                self.layers_listbox.delete(selection[0])
-                if self.app_state.active_layer_index >= len(self.app_state.layers):
-                    self.app_state.active_layer_index = len(self.app_state.layers) - 1
-                if self.app_state.active_layer_index >= 0:
-                    self.layers_listbox.selection_set(self.app_state.active_layer_index)
+        if active_doc and selection and selection[0] < len(active_doc.layers):
+            # The document refuses to delete its last layer
+            if active_doc.delete_layer(selection[0]):
+                self._after_layer_change()
+    
+    def duplicate_layer(self):
+        active_doc = self.app_state.active_document
+        if active_doc and active_doc.layers:
+            active_doc.duplicate_layer(active_doc.active_layer_index)
+            self._after_layer_change()
+    
+    def merge_layer_down(self):
+        active_doc = self.app_state.active_document
+        if active_doc and active_doc.merge_down(active_doc.active_layer_index):
+            self._after_layer_change()
+    
+    def move_layer(self, offset):
+        active_doc = self.app_state.active_document
+        if active_doc and active_doc.move_layer(active_doc.active_layer_index, active_doc.active_layer_index + offset):
+            self._after_layer_change()
     
     def new_group(self):
-        group_name = f"Group {len(self.app_state.layers)}"
+        active_doc = self.app_state.active_document
+        group_name = f"Group {len(active_doc.layers) if active_doc else 0}"
         self.layers_listbox.insert(tk.END, group_name)
         # In a full implementation, you would create a layer group object
     
@@ -1405,19 +1525,24 @@ class ImageForge:
     # In main.py, update the open_file method:
 
     def open_file(self): 
-        filename = filedialog.askopenfilename(
+        # **UPDATED: Several files can be opened at once**
+        filenames = filedialog.askopenfilenames(
             title="Open Image", 
-            filetypes=[("Image files", "*.jpg *.jpeg *.png *.gif *.bmp *.tiff")]
+            filetypes=[("Image files", f"*.jpg *.jpeg *.png *.gif *.bmp *.tiff *{PROJECT_EXTENSION}"),
+                       ("ImageForge project", f"*{PROJECT_EXTENSION}")]
         )
+        if len(filenames) > 1:
+            self.open_files(filenames)
+            return
+        
+        filename = filenames[0] if filenames else None
         if filename:
             print(f"📁 Opening: {filename}")
             
             try:
-                # Load image
-                new_image = Image.open(filename).convert("RGBA")
-                
-                # Create new document using app state
-                doc = self.app_state.open_document(filename, new_image)
+                # **UPDATED: Lazy open - a quick preview shows right away and
+                # the full image is decoded in the background**
+                doc = self.app_state.open_document_lazy(filename)
                 
                 # Update UI
                 self.update_tab_bar()
@@ -1425,6 +1550,7 @@ class ImageForge:
                 # Render the document
                 if self.app_state.renderer:
                     self.app_state.renderer.render(force=True)
+                    self.app_state.renderer.watch_loading(doc, on_error=self._on_open_error)
                 
                 self.root.title(f"ImageForge - {filename}")
                 print("✅ Document opened successfully")
@@ -1433,11 +1559,97 @@ class ImageForge:
                 print(f"❌ Error opening file: {e}")
                 messagebox.showerror("Error", f"Could not open file: {e}")
     
-    def save_file(self): 
-        print("Save file command")
+    def open_files(self, filenames):
+        """**NEW: Decode several files concurrently; each gets its tab as soon as it is ready**"""
+        print(f"📁 Opening {len(filenames)} files")
+        batch = OpenBatch(list(filenames), Document.load)
+        self.show_progress(f"Opening 0/{batch.total}", 0, batch.total, on_cancel=batch.cancel)
+        self.root.after(50, self._poll_open_batch, batch, [])
+    
+    def _poll_open_batch(self, batch, errors):
+        opened = None
+        for filename, doc, error in batch.poll():
+            if error is not None:
+                print(f"❌ Error opening {filename}: {error}")
+                errors.append(f"{os.path.basename(filename)}: {error}")
+                continue
+            opened = self.app_state.add_document(doc)
+            print(f"✅ Opened: {filename}")
+        
+        if opened is not None:
+            # One tab bar update and render per poll, however many files finished
+            self.update_tab_bar()
+            if self.app_state.renderer:
+                self.app_state.renderer.render(force=True)
+            self.root.title(f"ImageForge - {opened.filename}")
+        
+        if not batch.done:
+            self.show_progress(f"Opening {batch.completed}/{batch.total}", batch.completed, batch.total,
+                               on_cancel=batch.cancel)
+            self.root.after(50, self._poll_open_batch, batch, errors)
+            return
+        
+        self.hide_progress()
+        if batch.cancelled:
+            print(f"🚫 Open cancelled: {batch.cancelled} files skipped")
+        print(f"✅ Opened {batch.completed - len(errors)}/{batch.total} files")
+        if errors:
+            messagebox.showerror("Error", "Could not open:\n" + "\n".join(errors))
+    
+    def _on_open_error(self, doc, error):
+        """A lazily opened file failed to decode - its tab is already closed"""
+        self.update_tab_bar()
+        messagebox.showerror("Error", f"Could not open file: {error}")
+    
+    def save_file(self):
+        """**NEW: Save to the document's project file** - only tiles changed since
+        the last save are written. Documents opened from an image get Save As."""
+        doc = self.app_state.active_document
+        if not doc:
+            return
+        if doc.project is None:
+            self.save_as_file()
+            return
+        self._save_document(doc, doc.project.path)
     
-    def save_as_file(self): 
-        print("Save as file command")
+    def save_as_file(self):
+        doc = self.app_state.active_document
+        if not doc:
+            return
+        name = os.path.splitext(os.path.basename(doc.filename))[0]
+        filename = filedialog.asksaveasfilename(
+            title="Save As",
+            initialfile=name + PROJECT_EXTENSION,
+            defaultextension=PROJECT_EXTENSION,
+            filetypes=[("ImageForge project", f"*{PROJECT_EXTENSION}")]
+        )
+        if filename:
+            if not is_project(filename):
+                filename += PROJECT_EXTENSION
+            self._save_document(doc, filename)
+    
+    def _save_document(self, doc, filename):
+        if doc.loading:
+            messagebox.showinfo("Save", "The image is still loading - try again in a moment.")
+            return
+        
+        def progress(done, total):
+            self.show_progress(f"Saving {done}/{total}", done, total)
+            self.root.update_idletasks()
+        
+        print(f"💾 Saving: {filename}")
+        try:
+            self.root.config(cursor="watch")
+            doc.save(filename, progress)
+            self.update_tab_bar()
+            self.root.title(f"ImageForge - {doc.filename}")
+            print(f"✅ Saved: {filename}")
+        except Exception as e:
+            print(f"❌ Error saving file: {e}")
+            messagebox.showerror("Error", f"Could not save file: {e}")
+        finally:
+            self.root.config(cursor="")
+            self.hide_progress()
     
 
     # main.py - undo/redo methods আপডেট করুন
@@ -1450,13 +1662,11 @@ class ImageForge:
             print("❌ No document or history manager")
             return
             
-        active_layer = active_doc.layers[0]
-        
-        # **UPDATED: Get image, success, AND bbox**
-        new_image, success, bbox = active_doc.history_manager.undo(active_layer.image)
+        # **UPDATED: The document routes the entry to its layer (or restores the layer stack)**
+        success, bbox = active_doc.undo()
         
         if success:
-            active_layer.image = new_image
+            self.refresh_layers_panel()
             
             # **OPTIMIZED: Use partial rendering if bbox available**
             if hasattr(self.app_state, 'renderer'):
@@ -1480,13 +1690,11 @@ class ImageForge:
             print("❌ No document or history manager")
             return
             
-        active_layer = active_doc.layers[0]
-        
-        # **UPDATED: Get image, success, AND bbox**
-        new_image, success, bbox = active_doc.history_manager.redo(active_layer.image)
+        # **UPDATED: The document routes the entry to its layer (or restores the layer stack)**
+        success, bbox = active_doc.redo()
         
         if success:
-            active_layer.image = new_image
+            self.refresh_layers_panel()
             
             # **OPTIMIZED: Use partial rendering if bbox available**
             if hasattr(self.app_state, 'renderer'):
@@ -1510,9 +1718,128 @@ class ImageForge:
     # Placeholder methods for all menu commands
     def browse_in_bridge(self): print("Browse in Bridge")
     def check_in(self): print("Check In")
-    def export_file(self): print("Export")
-    def export_as(self): print("Export As")
-    def export_for_web(self): print("Export for Web")
+    def export_file(self):
+        """**NEW: Quick export - re-export to the last export target, or ask for one**"""
+        doc = self.app_state.active_document
+        if not doc:
+            return
+        if doc.export_path:
+            self._start_export(doc, doc.export_path)
+        else:
+            self.export_as()
+    
+    def export_as(self):
+        doc = self.app_state.active_document
+        if not doc:
+            return
+        name = os.path.splitext(os.path.basename(doc.filename))[0]
+        filename = filedialog.asksaveasfilename(
+            title="Export As",
+            initialfile=name + ".png",
+            defaultextension=".png",
+            filetypes=[("PNG", "*.png"), ("JPEG", "*.jpg *.jpeg"), ("WebP", "*.webp")]
+        )
+        if filename:
+            self._start_export(doc, filename)
+    
+    def _start_export(self, doc, filename):
+        """Flatten now, encode in the background with progress and a cancel button"""
+        if doc.loading:
+            messagebox.showinfo("Export", "The image is still loading - try again in a moment.")
+            return
+        if self.export_job is not None and not self.export_job.done:
+            messagebox.showinfo("Export", "An export is already running.")
+            return
+        
+        print(f"📤 Exporting: {filename}")
+        try:
+            self.export_job = export_document(doc, filename)
+        except Exception as e:
+            print(f"❌ Export error: {e}")
+            messagebox.showerror("Error", f"Could not export: {e}")
+            return
+        doc.export_path = filename
+        self.show_progress(f"Exporting {os.path.basename(filename)}", 0, 1, on_cancel=self.export_job.cancel)
+        self.root.after(50, self._poll_export, self.export_job)
+    
+    def _poll_export(self, job):
+        if not job.done:
+            done, total = job.progress
+            self.show_progress(f"Exporting {os.path.basename(job.path)}", done, total, on_cancel=job.cancel)
+            self.root.after(50, self._poll_export, job)
+            return
+        
+        self.hide_progress()
+        try:
+            job.result()
+            print(f"✅ Exported: {job.path}")
+        except ExportCancelled:
+            print(f"🚫 Export cancelled: {job.path}")
+        except Exception as e:
+            print(f"❌ Export error: {e}")
+            messagebox.showerror("Error", f"Could not export: {e}")
+    
+    def export_for_web(self):
+        """**NEW: Several sizes and formats of the flattened document in one go**"""
+        from dialogs.export_web_dialog import ExportWebDialog
+        
+        doc = self.app_state.active_document
+        if not doc:
+            return
+        if doc.loading:
+            messagebox.showinfo("Export for Web", "The image is still loading - try again in a moment.")
+            return
+        if self.export_job is not None and not self.export_job.done:
+            messagebox.showinfo("Export for Web", "An export is already running.")
+            return
+        
+        dialog = ExportWebDialog(self.root, doc.size[0])
+        self.root.wait_window(dialog)
+        if not dialog.result:
+            return
+        directory = filedialog.askdirectory(title="Export for Web - choose a folder")
+        if not directory:
+            return
+        
+        settings = dialog.result
+        try:
+            variants = web_variants(settings['widths'], settings['formats'],
+                                    settings['quality'], settings['max_bytes'])
+            self.export_job = export_for_web(doc, directory, variants)
+        except Exception as e:
+            print(f"❌ Export error: {e}")
+            messagebox.showerror("Error", f"Could not export: {e}")
+            return
+        count = len(self.export_job.variants)  # Widths past the image's own collapse into one
+        print(f"🌐 Exporting {count} web variants to {directory}")
+        self.show_progress("Export for Web", 0, count, on_cancel=self.export_job.cancel)
+        self.root.after(50, self._poll_web_export, self.export_job)
+    
+    def _poll_web_export(self, job):
+        if not job.done:
+            done, total = job.progress
+            self.show_progress(f"Export for Web {done}/{total}", done, total, on_cancel=job.cancel)
+            self.root.after(50, self._poll_web_export, job)
+            return
+        
+        self.hide_progress()
+        try:
+            results = job.result()
+        except ExportCancelled:
+            print("🚫 Export for Web cancelled")
+            return
+        except Exception as e:
+            print(f"❌ Export error: {e}")
+            messagebox.showerror("Error", f"Could not export: {e}")
+            return
+        
+        lines = []
+        for result in results:
+            quality = f" q{result['quality']}" if result['quality'] is not None else ""
+            warning = " ⚠️ over budget" if result['over_budget'] else ""
+            lines.append(f"{os.path.basename(result['path'])}: {result['bytes'] // 1024} KB{quality}{warning}")
+        print("✅ Exported for web:\n  " + "\n  ".join(lines))
+        messagebox.showinfo("Export for Web", "\n".join(lines))
     def automate(self): print("Automate")
     def scripts(self): print("Scripts")
     def file_info(self): print("File Info")
@@ -1552,8 +1879,8 @@ class ImageForge:
     def variables(self): print("Variables")
     def apply_data_set(self): print("Apply Data Set")
     def trap(self): print("Trap")
-    def new_layer_menu(self): print("New Layer")
-    def delete_layer_menu(self): print("Delete Layer")
+    def new_layer_menu(self): self.new_layer()
+    def delete_layer_menu(self): self.delete_layer()
     def layer_properties(self): print("Layer Properties")
     def layer_style(self): print("Layer Style")
     def new_fill_layer(self): print("New Fill Layer")
@@ -1570,8 +1897,8 @@ class ImageForge:
     def group_layers(self): print("Group Layers")
     def ungroup_layers(self): print("Ungroup Layers")
     def hide_layers(self): print("Hide Layers")
-    def arrange_layers(self): print("Arrange Layers")
-    def merge_layers(self): print("Merge Layers")
+    def arrange_layers(self): self.move_layer(1)
+    def merge_layers(self): self.merge_layer_down()
     def merge_visible(self): print("Merge Visible")
     def flatten_image(self): print("Flatten Image")
     def matting(self): print("Matting")
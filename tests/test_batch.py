@@ -0,0 +1,63 @@
+# tests/test_batch.py - HEADLESS BATCH CLI
+"""Batch pipeline over a folder of images, through the real process pool.
+
+Run from the repository root:
+
+    python -m pytest -q tests/test_batch.py
+"""
+
+import os
+import subprocess
+import sys
+
+from PIL import Image
+
+from app.batch import collect_inputs, main, output_paths
+
+
+def test_pipeline_runs_in_order_and_reports_failures(tmp_path, capsys):
+    source = tmp_path / "in"
+    source.mkdir()
+    Image.new("RGB", (1200, 600), (200, 40, 40)).save(source / "wide.png")
+    Image.new("RGB", (300, 900), (40, 200, 40)).save(source / "tall.jpg")
+    (source / "broken.png").write_bytes(b"not an image")
+    output = tmp_path / "out"
+
+    status = main([str(source), "-o", str(output), "--max-side", "600", "--resize", "50%",
+                   "--adjust", "brightness=0.5", "--format", "webp", "-j", "2"])
+
+    assert status == 1  # broken.png failed, the rest still ran
+    with Image.open(output / "wide.webp") as wide, Image.open(output / "tall.webp") as tall:
+        assert wide.size == (300, 150) and tall.size == (100, 300)
+        assert wide.convert("RGB").getpixel((10, 10))[0] < 120
+    report = capsys.readouterr().out
+    assert "broken.png" in report and "2 done, 1 failed" in report
+    assert len(collect_inputs([str(source)])) == 3
+
+
+def test_clashing_output_names_get_a_suffix(tmp_path, capsys):
+    source = tmp_path / "in"
+    (source / "sub").mkdir(parents=True)
+    colors = {"photo.jpg": (255, 0, 0), "photo.png": (0, 255, 0), "sub/photo.png": (0, 0, 255)}
+    for name, color in colors.items():
+        Image.new("RGB", (40, 30), color).save(source / name)
+    output = tmp_path / "out"
+
+    status = main([str(source), "-r", "-o", str(output), "--format", "png", "-j", "2"])
+
+    assert status == 0
+    files = collect_inputs([str(source)], recursive=True)
+    outputs = output_paths(files, str(output), ".png")
+    assert sorted(os.listdir(output)) == ["photo-2.png", "photo-3.png", "photo.png"]
+    for path, result in zip(files, outputs):
+        expected = colors[os.path.relpath(path, source).replace(os.sep, "/")]
+        with Image.open(result) as written:  # Every input kept its own result (JPEG is near enough)
+            assert all(abs(a - b) < 8 for a, b in zip(written.convert("RGB").getpixel((0, 0)), expected))
+    report = capsys.readouterr().out
+    assert "3 done, 0 failed" in report and report.count("already taken") == 2
+
+
+def test_batch_does_not_import_tkinter():
+    code = "import sys, app.batch; sys.exit('tkinter' in sys.modules)"
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    assert subprocess.run([sys.executable, "-c", code], cwd=root).returncode == 0
@@ -0,0 +1,195 @@
+# tests/test_brush.py - BRUSH RASTERIZATION
+"""Tiled stamp rasterization against serial stamping, and command history
+replaying recorded strokes against stored reference images, pixel-for-pixel;
+the display-resolution preview against a downscaled full-resolution stroke.
+
+Tools are driven headless - with at most a stand-in app and renderer - so
+the suite runs without Tk.
+
+Run from the repository root:
+
+    python -m pytest -q tests/test_brush.py
+"""
+
+import random
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw
+
+from app.history import HistoryManager
+from tools.brush import MasterBrushTool, StrokeCommand
+from tools.eraser import EraserTool
+
+# Crosses many 64px tile edges, doubles back over itself and runs off the canvas
+STROKE = [(20, 30), (310, 90), (140, 250), (470, 330), (590, 395), (400, 60), (-30, 200)]
+COLOR = (200, 40, 40, 160)
+
+
+def make_tool(brush_type, size, tiled):
+    tool = MasterBrushTool(None)
+    tool.brush_type = brush_type
+    tool.brush_size = size
+    tool.brush_hardness = 60
+    tool.brush_seed = 1234
+    tool.stamp_tile_size = 64
+    tool.tiled_stamp_min_size = 1 if tiled else 1 << 30
+    tool.stroke_points = list(STROKE)
+    return tool
+
+
+@pytest.mark.parametrize("brush_type", ["Square", "Texture", "Charcoal", "Spatter"])
+@pytest.mark.parametrize("size", [37, 90])
+def test_tiled_stamps_match_serial_stamping(brush_type, size):
+    base = Image.new("RGBA", (600, 400), (20, 90, 160, 120))
+
+    serial = make_tool(brush_type, size, tiled=False).rasterize_stroke(base, COLOR)
+    tiled = make_tool(brush_type, size, tiled=True).rasterize_stroke(base, COLOR)
+
+    assert not np.array_equal(np.asarray(serial), np.asarray(base))  # The stroke did paint
+    assert serial.tobytes() == tiled.tobytes()
+
+
+def random_stroke(rng, size):
+    """Replayable command for a random stroke, as a tool would record it on commit"""
+    tool_class = EraserTool if rng.random() < 0.25 else MasterBrushTool
+    color = "#%02x%02x%02x" % tuple(rng.randint(0, 255) for _ in range(3))
+    tool = tool_class(SimpleNamespace(foreground_color=color))
+    tool.brush_type = rng.choice(["Round", "Soft Round", "Square", "Texture", "Spatter"])
+    tool.brush_size = rng.randint(4, 40)
+    tool.brush_opacity = rng.randint(40, 100)
+    tool.brush_seed = rng.randrange(1 << 30)
+    points = [(rng.randint(0, size[0]), rng.randint(0, size[1])) for _ in range(rng.randint(2, 6))]
+    return StrokeCommand(tool_class, points, tool.capture_settings(), action_name=f"{tool.name} Stroke")
+
+
+@pytest.mark.parametrize("seed", [1, 2])
+def test_command_history_replays_strokes_exactly(seed):
+    rng = random.Random(seed)
+    size = (400, 300)
+    history = HistoryManager(max_history=8)
+    layer = object()
+    image = Image.new("RGBA", size, (240, 235, 220, 255))
+    states = [image.copy()]  # The layer after each step
+
+    for step in range(14):
+        if step == 7:
+            # A pixel entry breaks the replay chain - the next stroke needs a checkpoint
+            assert history.push(image, "Fill", layer=layer)
+            ImageDraw.Draw(image).rectangle((50, 40, 250, 200), fill=(30, 160, 90, 200))
+        else:
+            command = random_stroke(rng, size)
+            command.replay_cost = history.max_replay_cost / 3  # A checkpoint every few strokes
+            assert history.push_command(command, image, layer=layer)
+            image = command.apply(image)
+        states.append(image.copy())
+
+    kept = list(history.history_stack)
+    assert len(kept) == 8  # The oldest six were evicted...
+    assert kept[0]['checkpoint'] is not None  # ...and the replay chain kept a starting point
+    commands = [entry for entry in kept if entry['type'] == 'command']
+    assert 1 < sum(entry['checkpoint'] is not None for entry in commands) < len(commands)
+
+    for expected in reversed(states[-9:-1]):
+        image, ok, _ = history.undo(image)
+        assert ok and image.tobytes() == expected.tobytes()
+    assert not history.undo(image)[1]
+
+    for expected in states[-8:]:
+        image, ok, _ = history.redo(image)
+        assert ok and image.tobytes() == expected.tobytes()
+    assert not history.redo(image)[1]
+
+    # Undo partway, then a new stroke replaces what could have been redone
+    for _ in range(3):
+        image, ok, _ = history.undo(image)
+    assert image.tobytes() == states[-4].tobytes()
+    command = random_stroke(rng, size)
+    history.push_command(command, image, layer=layer)
+    expected = command.apply(image)
+    image = expected.copy()
+    assert not history.redo(image)[1]
+    image, ok, _ = history.undo(image)
+    assert ok and image.tobytes() == states[-4].tobytes()
+    image, ok, _ = history.redo(image)
+    assert ok and image.tobytes() == expected.tobytes()
+    history.clear()
+
+
+class PreviewRenderer:
+    """Just what the brush preview reads from ``Renderer`` and records what it is shown"""
+
+    def __init__(self, doc, zoom):
+        self.zoom_level = zoom
+        size = (round(doc.size[0] * zoom), round(doc.size[1] * zoom))
+        self.current_image = doc.layers[0].image.resize(size, Image.Resampling.LANCZOS)
+        self.previews = []
+        self.temporary = []
+
+    def display_preview(self, image):
+        self.previews.append(image)
+
+    def temporary_display(self, image):
+        self.temporary.append(image)
+
+
+@pytest.mark.parametrize("brush_type", ["Round", "Square", "Texture"])
+def test_display_preview_matches_downscaled_stroke(brush_type):
+    from app.core import Document
+
+    doc = Document(width=800, height=600)
+    ImageDraw.Draw(doc.layers[0].image).rectangle((100, 100, 500, 400), fill=(60, 120, 200, 255))
+    renderer = PreviewRenderer(doc, 0.25)
+    app = SimpleNamespace(active_document=doc, renderer=renderer, foreground_color="#c83232")
+    tool = MasterBrushTool(app)
+    tool.brush_type = brush_type
+    tool.brush_size = 40
+    tool.brush_seed = 7
+    tool.stroke_points = [(50, 60), (300, 200), (700, 500), (400, 550)]
+
+    tool.draw_real_time_preview()
+    assert len(renderer.previews) == 1 and not renderer.temporary
+    preview = renderer.previews[0]
+    assert preview.size == renderer.current_image.size
+
+    full = tool.rasterize_stroke(doc.layers[0].image.copy())
+    expected = full.resize(preview.size, Image.Resampling.LANCZOS)
+    difference = np.abs(np.asarray(preview, np.int16) - np.asarray(expected, np.int16))
+    assert difference.mean() < 3  # Same stroke, resampled differently along its edges
+    assert np.percentile(difference, 99) < 96
+
+
+def test_display_preview_falls_back_without_a_display_image():
+    from app.core import Document
+
+    doc = Document(width=300, height=200)
+    renderer = PreviewRenderer(doc, 0.5)
+    renderer.current_image = None
+    app = SimpleNamespace(active_document=doc, renderer=renderer, foreground_color="#000000")
+    tool = MasterBrushTool(app)
+    tool.stroke_points = [(10, 10), (250, 150)]
+
+    assert not tool.draw_display_preview()
+    tool.draw_real_time_preview()
+    assert not renderer.previews and len(renderer.temporary) == 1
+    assert renderer.temporary[0].size == doc.size  # Full-resolution fallback
+    assert renderer.temporary[0].getpixel((130, 80))[:3] == (0, 0, 0)
+
+
+def test_full_resolution_preview_paints_the_active_layer():
+    from app.core import Document
+
+    doc = Document(width=300, height=200)
+    doc.add_layer("Top")
+    doc.layers[1].opacity = 0.5
+    renderer = PreviewRenderer(doc, 0.5)
+    renderer.current_image = None
+    app = SimpleNamespace(active_document=doc, renderer=renderer, foreground_color="#000000")
+    tool = MasterBrushTool(app)
+    tool.stroke_points = [(10, 10), (250, 150)]
+
+    tool.draw_real_time_preview()
+    r, g, b, _ = renderer.temporary[0].getpixel((130, 80))
+    assert 120 <= r <= 135 and r == g == b  # Through the active layer's 50% opacity
+    assert not doc.layers[1].pixels[..., 3].any()  # Only previewed, not painted
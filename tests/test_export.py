@@ -0,0 +1,93 @@
+# tests/test_export.py - EXPORT PIPELINE
+"""Strip-encoded PNG output, background export jobs and Export for Web.
+
+Run from the repository root:
+
+    python -m pytest -q tests/test_export.py
+"""
+
+import io
+import os
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from app.export import STRIP_ROWS, ExportCancelled, ExportJob, write_png
+from app.utils import image_view
+from app.web_export import QUALITY_RANGE, WebExportJob, encode_web, resize_cascade, web_variants
+
+
+@pytest.mark.parametrize("size", [(1, 1), (300, STRIP_ROWS - 1), (517, 3 * STRIP_ROWS + 5)])
+def test_strip_png_decodes_exactly(size):
+    width, height = size
+    rng = np.random.default_rng(width * height)
+    pixels = rng.integers(0, 256, (height, width, 4), dtype=np.uint8)
+    pixels[: height // 2] = (10, 20, 30, 255)  # Some compressible rows too
+
+    out = io.BytesIO()
+    write_png(image_view(pixels), out)
+    out.seek(0)
+    with Image.open(out) as decoded:
+        assert decoded.mode == "RGBA"
+        assert np.array_equal(np.asarray(decoded), pixels)
+
+
+def test_jobs_write_every_format_and_cancel_cleanly(tmp_path):
+    image = Image.radial_gradient("L").resize((600, 400)).convert("RGBA")
+    for ext in ("png", "jpg", "webp"):
+        path = str(tmp_path / f"out.{ext}")
+        job = ExportJob(image, path)
+        assert job.wait(30)
+        assert job.result() == path
+        with Image.open(path) as exported:
+            assert exported.size == image.size
+
+    # Large enough that encoding is still running when cancel() lands
+    path = str(tmp_path / "cancelled.png")
+    job = ExportJob(image.resize((6000, 4000)), path)
+    job.cancel()
+    assert job.wait(30)
+    with pytest.raises(ExportCancelled):
+        job.result()
+    assert not os.path.exists(path) and not os.path.exists(path + ".part")
+
+
+def test_web_export_picks_highest_quality_under_budget(tmp_path):
+    rng = np.random.default_rng(7)
+    pixels = rng.integers(0, 256, (600, 900, 4), dtype=np.uint8)
+    pixels[..., 3] = 255
+    image = image_view(pixels)
+    budget = 60 * 1024
+
+    variants = web_variants([640, 320, 5000], ["JPEG", "WEBP"], max_bytes=budget)
+    job = WebExportJob(image, str(tmp_path), "noise", variants)
+    assert job.wait(120)
+    results = job.result()
+
+    sizes = resize_cascade(image, [640, 320, 5000])
+    assert sizes[5000].size == image.size  # Never upscaled
+    assert sizes[320].size == (320, 213)
+    sizes[image.width] = sizes.pop(5000)
+    for result in results:
+        assert os.path.getsize(result['path']) == result['bytes']
+        if result['over_budget']:
+            continue
+        assert result['bytes'] <= budget
+        if result['quality'] < QUALITY_RANGE[1]:
+            assert len(encode_web(sizes[result['width']], result['format'], result['quality'] + 1)) > budget
+
+
+def test_web_export_names_variants_by_their_real_width(tmp_path):
+    image = Image.new("RGBA", (1000, 500), (30, 120, 200, 255))
+    variants = web_variants([640, 1280, 2560], ["PNG"])
+    job = WebExportJob(image, str(tmp_path), "small", variants)
+    assert job.wait(60)
+    results = job.result()
+
+    # 1280 and 2560 both clamp to the image's own width and are written once
+    assert [result['width'] for result in results] == [1000, 640]
+    assert sorted(os.listdir(tmp_path)) == ["small-1000w.png", "small-640w.png"]
+    for result in results:
+        with Image.open(result['path']) as written:
+            assert written.width == result['width'] == result['size'][0]
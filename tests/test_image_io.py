@@ -0,0 +1,204 @@
+# tests/test_image_io.py - IMAGE FILE LOADING
+"""Quick previews from the file header (JPEG's reduced-scale decode), lazily
+opened documents swapping in their full decode, a file that fails to
+decode closing its document, and batches of files decoding concurrently.
+
+The renderer's loading watch is driven through a stand-in canvas, so the
+suite runs without a display.
+
+Run from the repository root:
+
+    python -m pytest -q tests/test_image_io.py
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from app import workers
+
+from app.core import AppState, Document
+from app.image_io import OpenBatch, read_preview
+from app.renderer import Renderer
+
+SIZE = (2400, 1800)
+
+
+def gradient(size=SIZE):
+    width, height = size
+    pixels = np.empty((height, width, 3), dtype=np.uint8)
+    pixels[..., 0] = np.linspace(0, 255, width, dtype=np.float32)
+    pixels[..., 1] = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    pixels[..., 2] = 90
+    return Image.fromarray(pixels)
+
+
+def wait_loaded(doc, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not doc.finish_loading():
+        assert time.monotonic() < deadline, "full decode never finished"
+        time.sleep(0.01)
+
+
+def test_jpeg_preview_is_a_reduced_decode(tmp_path):
+    path = tmp_path / "photo.jpg"
+    gradient().save(path, quality=90)
+
+    preview, size = read_preview(str(path), side=300)
+    assert size == SIZE
+    assert preview.mode == "RGBA"
+    assert preview.size == (SIZE[0] // 8, SIZE[1] // 8)  # libjpeg's 1/8 scale
+
+    expected = gradient().resize(preview.size, Image.Resampling.BOX)
+    difference = np.abs(np.asarray(preview.convert("RGB"), np.int16) - np.asarray(expected, np.int16))
+    assert difference.mean() < 4
+
+
+def test_other_formats_only_read_the_header(tmp_path):
+    path = tmp_path / "photo.png"
+    gradient((640, 480)).save(path)
+
+    assert read_preview(str(path)) == (None, (640, 480))
+
+
+def test_lazy_open_swaps_in_the_full_decode(tmp_path):
+    path = tmp_path / "photo.jpg"
+    source = gradient()
+    source.save(path, quality=90)
+
+    doc = Document.open_lazy(str(path))
+    assert doc.loading and doc.size == SIZE
+    assert doc.preview is not None and doc.preview.size == (SIZE[0] // 2, SIZE[1] // 2)
+
+    wait_loaded(doc)
+    assert not doc.loading and doc.preview is None
+    assert doc.finish_loading()  # Idempotent once loaded
+    with Image.open(path) as decoded:
+        assert doc.layers[0].image.tobytes() == decoded.convert("RGBA").tobytes()
+
+
+def test_lazy_open_of_a_png_has_no_preview(tmp_path):
+    path = tmp_path / "photo.png"
+    source = gradient((640, 480)).convert("RGBA")
+    source.save(path)
+
+    doc = Document.open_lazy(str(path))
+    assert doc.preview is None and doc.size == (640, 480)
+    wait_loaded(doc)
+    assert doc.layers[0].image.tobytes() == source.tobytes()
+
+
+def test_failed_decode_closes_the_document(tmp_path):
+    path = tmp_path / "broken.png"
+    gradient((640, 480)).save(path)
+    data = path.read_bytes()
+    path.write_bytes(data[: len(data) // 2])  # Header intact, pixel data cut short
+
+    app = AppState(None)
+    app.create_new_document()
+    doc = app.open_document_lazy(str(path))
+    assert doc.size == (640, 480) and app.active_document is doc
+
+    scheduled = []
+    errors = []
+    renderer = SimpleNamespace(
+        app=app,
+        canvas=SimpleNamespace(after=lambda ms, callback, *args: scheduled.append((callback, args))),
+        render=lambda force=False: None,
+        mark_cache_dirty=lambda: None,
+    )
+    renderer.watch_loading = lambda *args: Renderer.watch_loading(renderer, *args)
+
+    renderer.watch_loading(doc, lambda failed, error: errors.append((failed, error)))
+    deadline = time.monotonic() + 10
+    while scheduled:
+        assert time.monotonic() < deadline, "full decode never finished"
+        time.sleep(0.01)
+        callback, args = scheduled.pop()
+        callback(*args)
+
+    assert len(errors) == 1 and errors[0][0] is doc
+    assert isinstance(errors[0][1], OSError)
+    assert doc not in app.documents
+    assert len(app.documents) == 1 and app.active_document is app.documents[0]
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    """A three-thread shared pool, whatever the machine's core count"""
+    executor = ThreadPoolExecutor(max_workers=3, thread_name_prefix="test-worker")
+    monkeypatch.setattr(workers, '_thread_pool', executor)
+    yield executor
+    executor.shutdown(wait=True)
+
+
+def poll_all(batch, timeout=10):
+    """Everything a batch reports, polled the way the UI does"""
+    deadline = time.monotonic() + timeout
+    finished = []
+    while not batch.done:
+        assert time.monotonic() < deadline, "batch never finished"
+        finished += batch.poll()
+        time.sleep(0.01)
+    return finished
+
+
+def test_open_batch_decodes_concurrently_and_reports_failures(pool, tmp_path):
+    paths = []
+    for index in range(6):
+        path = tmp_path / f"photo{index}.png"
+        gradient((320 + index, 240)).save(path)
+        paths.append(str(path))
+    broken = tmp_path / "broken.png"
+    broken.write_bytes(b"not an image")
+    paths.insert(3, str(broken))
+
+    # Two loads wait for each other - a batch decoding one file at a time would stall
+    running = threading.Barrier(2, timeout=5)
+    def loader(path):
+        if path.endswith("photo0.png") or path.endswith("photo1.png"):
+            running.wait()
+        return Document.load(path)
+
+    batch = OpenBatch(paths, loader)
+    assert batch.total == 7 and not batch.done
+    finished = poll_all(batch)
+
+    assert sorted(path for path, _, _ in finished) == sorted(paths)
+    assert batch.completed == 7 and batch.cancelled == 0
+    results = {path: (doc, error) for path, doc, error in finished}
+    doc, error = results[str(broken)]
+    assert doc is None and error is not None
+    for index, path in enumerate(p for p in paths if p != str(broken)):
+        doc, error = results[path]
+        assert error is None and doc.size == (320 + index, 240)
+
+
+def test_open_batch_cancels_loads_not_started(pool, tmp_path):
+    path = tmp_path / "photo.png"
+    gradient((64, 48)).save(path)
+    busy = pool._max_workers
+    started = threading.Semaphore(0)
+    release = threading.Event()
+
+    def loader(path):
+        started.release()
+        release.wait(timeout=10)
+        return Document.load(path)
+
+    batch = OpenBatch([str(path)] * (busy + 3), loader)
+    for _ in range(busy):  # Every worker busy - the last three are queued
+        assert started.acquire(timeout=5)
+    assert batch.cancel() == 3
+    assert batch.cancelled == 3 and not batch.done
+    release.set()
+
+    finished = poll_all(batch)
+    assert len(finished) == busy and all(error is None for _, _, error in finished)
+    assert batch.completed == busy and batch.cancelled == 3
+    assert batch.cancel() == 0  # Nothing left to cancel
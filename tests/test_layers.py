@@ -0,0 +1,157 @@
+# tests/test_layers.py - LAYER BUFFERS AND COMPOSITING
+"""Allocate-on-write layers, band compositing with empty tiles skipped, and
+file-backed out-of-core layer buffers: strokes painted in place through the
+mapped bands, the resident-set budget and scratch files released with
+their layer.
+
+Run from the repository root:
+
+    python -m pytest -q tests/test_layers.py
+"""
+
+import gc
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw
+
+from app import layer_store
+from app.compositor import composite_layers
+from app.core import Document
+from app.layer_store import BAND_ROWS, LayerStore
+from app.tiles import TILE_SIZE
+from tools.brush import MasterBrushTool
+from tools.eraser import EraserTool
+
+
+def plain_composite(layers):
+    """Reference: every visible layer alpha-composited over the whole canvas"""
+    visible = [layer for layer in layers if layer.visible]
+    result = visible[0].get_composited_image().copy()
+    for layer in visible[1:]:
+        result = Image.alpha_composite(result, layer.get_composited_image())
+    return result
+
+
+def test_untouched_layers_stay_unallocated():
+    doc = Document(width=640, height=480)
+    doc.add_layer("Empty")
+    doc.add_layer("Tint")
+    doc.layers[2].fill = (255, 0, 0, 64)
+
+    composite_layers(doc.layers)
+    doc.layers[1].get_thumbnail()
+    assert all(layer.flat and not layer.materialized for layer in doc.layers)
+    assert doc.layers[1].is_empty and not doc.layers[2].is_empty
+
+    # The first write materializes the buffer, filled with the layer's color
+    ImageDraw.Draw(doc.layers[2].image).point((5, 5), fill=(0, 0, 255, 255))
+    assert doc.layers[2].materialized and not doc.layers[2].flat
+    assert doc.layers[2].image.getpixel((6, 6)) == (255, 0, 0, 64)
+    assert doc.layers[1].flat
+
+
+def test_band_compositing_matches_plain_alpha_composite():
+    # Not a whole number of tiles or bands in either direction
+    width, height = TILE_SIZE * 3 + 37, BAND_ROWS * 2 + 91
+    rng = np.random.default_rng(4)
+    doc = Document(width=width, height=height)
+
+    sparse = doc.add_layer("Sparse")  # Paint in two tiles only - the rest is skipped
+    ImageDraw.Draw(sparse.image).ellipse((10, 10, 120, 90), fill=(200, 30, 30, 200))
+    ImageDraw.Draw(sparse.image).rectangle((width - 40, height - 30, width - 1, height - 1),
+                                           fill=(30, 200, 30, 120))
+    faded = doc.add_layer("Faded")
+    faded.pixels[:] = rng.integers(0, 256, (height, width, 4), dtype=np.uint8)
+    faded.pixels[: height // 3, :, 3] = 0  # Whole transparent bands
+    faded.opacity = 0.6
+    tint = doc.add_layer("Tint")
+    tint.fill = (20, 40, 220, 90)
+    tint.opacity = 0.5
+    hidden = doc.add_layer("Hidden")
+    hidden.pixels[:] = 255
+    hidden.visible = False
+
+    result = composite_layers(doc.layers)
+    assert result.tobytes() == plain_composite(doc.layers).tobytes()
+    assert tint.flat  # Composited without ever being allocated
+
+    # A transparent bottom layer composites the same way
+    doc.layers[0].fill = (0, 0, 0, 0)
+    assert composite_layers(doc.layers).tobytes() == plain_composite(doc.layers).tobytes()
+
+
+@pytest.fixture
+def small_store(monkeypatch):
+    """A fresh layer store that maps anything over 64 KB, with a 512 KB resident budget"""
+    store = LayerStore(budget_bytes=512 * 1024)
+    monkeypatch.setattr(layer_store, 'OUT_OF_CORE_BYTES', 64 * 1024)
+    monkeypatch.setattr(layer_store, '_layer_store', store)
+    return store
+
+
+def stroke_tool(tool_class, brush_type, points):
+    tool = tool_class(SimpleNamespace(foreground_color="#2080c0"))
+    tool.brush_type = brush_type
+    tool.brush_size = 33
+    tool.brush_seed = 99
+    tool.stroke_points = list(points)
+    return tool
+
+
+@pytest.mark.parametrize("tool_class", [MasterBrushTool, EraserTool])
+@pytest.mark.parametrize("brush_type", ["Round", "Square", "Texture", "Spatter"])
+def test_painting_in_place_matches_full_canvas_rasterizing(small_store, tool_class, brush_type):
+    # Crosses band boundaries and runs off the left and bottom edges
+    points = [(40, 30), (200, 300), (-10, 420), (150, BAND_ROWS * 2 + 60)]
+    doc = Document(width=320, height=BAND_ROWS * 2 + 70)
+    layer = doc.layers[0]
+    ImageDraw.Draw(layer.image).rectangle((60, 60, 250, 500), fill=(200, 60, 30, 180))
+    assert small_store.is_mapped(layer.pixels)
+
+    tool = stroke_tool(tool_class, brush_type, points)
+    expected = tool.rasterize_stroke(layer.image.copy())
+    bbox = stroke_tool(tool_class, brush_type, points).paint_stroke(layer)
+
+    assert bbox[0] == 0 and bbox[3] == doc.size[1]
+    assert layer.image.tobytes() == expected.tobytes()
+
+
+def test_large_layers_are_file_backed_within_the_resident_budget(small_store):
+    width, height = 200, BAND_ROWS * 4  # 800 KB layers, 200 KB bands
+    doc = Document(width=width, height=height)
+    doc.add_layer("Paint")
+    layer = doc.layers[1]
+    assert layer.flat and small_store.stats()['mapped_layers'] == 0  # Nothing allocated yet
+
+    tool = stroke_tool(MasterBrushTool, "Round", [(20, 20), (180, height - 20)])
+    tool.paint_stroke(layer)
+    assert small_store.is_mapped(layer.pixels)
+    assert 0 < small_store.resident_bytes <= small_store.budget_bytes
+    assert small_store.page_outs > 0  # Painting top to bottom paged out the first bands
+
+    composite_layers(doc.layers)
+    assert small_store.resident_bytes <= small_store.budget_bytes
+    assert doc.layers[0].flat  # The white background is composited without a buffer
+
+    # Once nothing - not even undo - can reach the layer, its scratch file goes
+    mapped = small_store._mapped[id(layer.pixels)]
+    doc.layers.remove(layer)
+    doc.history_manager.clear()
+    del layer
+    gc.collect()
+    assert mapped._file.closed and mapped._map.closed  # Scratch file closed, so deleted
+    assert small_store.stats()['mapped_layers'] == 0
+    assert small_store.mapped_bytes == small_store.resident_bytes == 0
+
+
+def test_opened_image_decodes_into_a_file_backed_layer(small_store, tmp_path):
+    path = tmp_path / "large.png"
+    source = Image.new("RGB", (300, BAND_ROWS + 40), (10, 200, 90))
+    ImageDraw.Draw(source).line((0, 0, 299, BAND_ROWS + 39), fill=(255, 255, 255), width=5)
+    source.save(path)
+
+    doc = Document.load(str(path))
+    assert small_store.is_mapped(doc.layers[0].pixels)
+    assert doc.layers[0].image.tobytes() == source.convert("RGBA").tobytes()
@@ -0,0 +1,211 @@
+# tests/test_project_io.py - PROJECT FILE ROUND TRIPS
+"""Save / load / incremental re-save of .ifp projects and autosave recovery,
+compared pixel-for-pixel; re-saves that only read the rows edited since.
+
+Run from the repository root:
+
+    python -m pytest -q tests/test_project_io.py
+"""
+
+import glob
+import os
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from app import project_io
+from app.autosave import Autosaver, _DocumentSnapshot, find_recovered, restore
+from app.compositor import composite_layers
+from app.core import Document
+from app.project_io import ProjectFile
+
+
+def make_document():
+    doc = Document(width=1000, height=700)
+    doc.add_layer("Paint")
+    ImageDraw.Draw(doc.layers[1].image).ellipse((50, 40, 600, 500), fill=(200, 30, 30, 180))
+    doc.add_layer("Hidden")
+    doc.layers[2].visible = False
+    doc.layers[1].opacity = 0.5
+    return doc
+
+
+def test_round_trip_is_lazy_and_exact(tmp_path):
+    doc = make_document()
+    path = str(tmp_path / "art.ifp")
+    doc.save(path)
+
+    loaded = Document.load(path)
+    assert [layer.name for layer in loaded.layers] == ["Background", "Paint", "Hidden"]
+    assert loaded.layers[1].opacity == 0.5 and not loaded.layers[2].visible
+    # Flat layers stay flat, painted ones are not decoded until used
+    assert loaded.layers[0].flat and loaded.layers[2].is_empty
+    assert loaded.layers[1].source is not None and not loaded.layers[1].materialized
+
+    assert np.array_equal(loaded.layers[1].pixels, doc.layers[1].pixels)
+    assert np.array_equal(np.asarray(composite_layers(loaded.layers)),
+                          np.asarray(composite_layers(doc.layers)))
+
+
+def test_incremental_save_appends_only_changed_tiles(tmp_path):
+    doc = make_document()
+    path = str(tmp_path / "art.ifp")
+    doc.save(path)
+    chunks_before = dict(ProjectFile(path).chunks)
+    size_before = os.path.getsize(path)
+
+    loaded = Document.load(path)
+    ImageDraw.Draw(loaded.layers[1].image).rectangle((10, 10, 40, 40), fill=(0, 255, 0, 255))
+    loaded.save(path)
+
+    project = ProjectFile(path)
+    new_chunks = set(project.chunks) - set(chunks_before)
+    assert len(new_chunks) == 1  # Only the one tile that was painted on
+    for digest, entry in chunks_before.items():
+        if digest in project.chunks:
+            assert project.chunks[digest] == entry  # Unchanged tiles were not rewritten
+    assert os.path.getsize(path) - size_before < 64 * 1024
+
+    reloaded = Document.load(path)
+    assert np.array_equal(reloaded.layers[1].pixels, loaded.layers[1].pixels)
+
+
+def test_compaction_reopens_the_replaced_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(project_io, "COMPACT_MIN_DEAD_BYTES", 0)
+    rng = np.random.default_rng(3)
+    doc = Document(width=600, height=600)
+    doc.add_layer("Noise")
+    doc.layers[1].pixels[:] = rng.integers(0, 256, (600, 600, 4), dtype=np.uint8)
+    doc.add_layer("Kept")
+    doc.layers[2].pixels[:100, :100] = rng.integers(0, 256, (100, 100, 4), dtype=np.uint8)
+    path = str(tmp_path / "art.ifp")
+    doc.save(path)
+
+    loaded = Document.load(path)
+    project = loaded.project
+    # Clearing the noise leaves its chunks dead - more dead than live bytes
+    loaded.layers[1].pixels[:] = 0
+    loaded.layers[1].pixels[:10, :10] = 255
+    loaded.save(path)
+    assert project.dead_bytes > project.live_bytes
+
+    old_file = project._file
+    loaded.layers[1].pixels[20:30, :10] = 255
+    loaded.layers[1].mark_dirty((0, 20, 10, 30))  # Written past history and the tools
+    loaded.save(path)
+    assert old_file.closed  # Nothing still holds the file that was replaced
+    assert loaded.project is project and project.dead_bytes == 0
+    assert not loaded.layers[2].materialized  # Still lazy, now reading the compacted file
+    assert np.array_equal(loaded.layers[2].pixels, doc.layers[2].pixels)
+
+    reloaded = Document.load(path)
+    assert np.array_equal(reloaded.layers[1].pixels, loaded.layers[1].pixels)
+    assert np.array_equal(reloaded.layers[2].pixels, doc.layers[2].pixels)
+    reloaded.project.close()
+
+
+def test_autosave_skips_overlapping_edits_and_recovers(tmp_path):
+    directory = str(tmp_path / "recovery")
+    autosaver = Autosaver(directory)
+    doc = make_document()
+    pristine = Document(width=200, height=200)
+    documents = [doc, pristine]
+
+    assert autosaver.tick(documents)
+    autosaver._pending.result()
+    assert autosaver.saves == 1  # Unedited documents are skipped
+    assert len(glob.glob(os.path.join(directory, "*.ifp"))) == 1
+
+    # An edit landing while the snapshot is written abandons it
+    layer = doc.layers[1]
+    doc.history_manager.push(layer.image, "Fill", layer=layer)
+    layer.image.paste((0, 0, 255, 255), (0, 0, 300, 300))
+    entry = autosaver._entries[doc]
+    snapshot = _DocumentSnapshot(doc, entry['project'])
+    doc.history_manager.version += 1
+    autosaver._save(doc, entry, snapshot)
+    assert autosaver.stale == 1
+    assert autosaver.tick(documents)
+    autosaver._pending.result()
+    assert autosaver.saves == 2
+
+    # A running session's snapshots are neither offered nor cleaned up
+    assert find_recovered(directory) == []
+    assert len(os.listdir(directory)) == 2  # Its snapshot and its lock
+
+    # The lock goes with the process - as if it had crashed
+    for lock in autosaver._locks.values():
+        lock.close()
+    recovered = find_recovered(directory)
+    assert [item['filename'] for item in recovered] == [doc.filename]
+    restored = restore(recovered[0])
+    assert restored.project is None
+    assert np.array_equal(np.asarray(composite_layers(restored.layers)),
+                          np.asarray(composite_layers(doc.layers)))
+
+    autosaver.shutdown()
+    assert os.listdir(directory) == []
+
+
+class CountingRows:
+    """Wraps ``_hash_rows`` and records which rows of tiles were read from the layer"""
+
+    def __init__(self, monkeypatch):
+        self.read = []
+        hash_rows = project_io._hash_rows
+
+        def counting(layer, clean=None):
+            for ty, row in enumerate(hash_rows(layer, clean)):
+                if not clean or ty not in clean:
+                    self.read.append((layer.name, ty))
+                yield row
+
+        monkeypatch.setattr(project_io, "_hash_rows", counting)
+
+
+def test_resave_reads_only_dirty_rows(tmp_path, monkeypatch):
+    from tools.brush import MasterBrushTool, StrokeCommand
+
+    rows = CountingRows(monkeypatch)
+    doc = make_document()  # 1000x700: three rows of 256px tiles
+    path = str(tmp_path / "art.ifp")
+    doc.save(path)
+    assert len(rows.read) == 3  # The first save reads the painted layer in full
+
+    # A stroke committed the way the brush does it, inside the middle row
+    layer = doc.layers[1]
+    tool = MasterBrushTool(None)
+    tool.brush_size = 20
+    command = StrokeCommand(MasterBrushTool, [(300, 320), (700, 400)], tool.capture_settings(),
+                            bbox=(290, 310, 710, 410))
+    doc.history_manager.push_command(command, layer.image, layer=layer)
+    command.paint(layer)
+    rows.read.clear()
+    doc.save(path)
+    assert rows.read == [("Paint", 1)]
+
+    # Undo rewrites the same rows; an edit through the setter rewrites all of them
+    assert doc.undo()[0]
+    rows.read.clear()
+    doc.save(path)
+    assert rows.read == [("Paint", 1)]
+    layer.image = layer.image.transpose(Image.Transpose.FLIP_LEFT_RIGHT)
+    rows.read.clear()
+    doc.save(path)
+    assert rows.read == [("Paint", 0), ("Paint", 1), ("Paint", 2)]
+
+    # Saving anywhere else starts over
+    rows.read.clear()
+    doc.save(str(tmp_path / "copy.ifp"))
+    assert len(rows.read) == 3
+    rows.read.clear()
+    doc.save(path)
+    assert not rows.read
+
+    for saved in (path, str(tmp_path / "copy.ifp")):
+        loaded = Document.load(saved)
+        for original, layer in zip(doc.layers, loaded.layers):
+            assert layer.flat == original.flat
+            if not layer.flat:
+                assert np.array_equal(layer.pixels, original.pixels)
+        loaded.project.close()
@@ -0,0 +1,426 @@
+# tests/test_undo.py - HISTORY STRESS AND PERFORMANCE TESTS
+"""Randomized push / push_region / undo / redo sequences on large images.
+
+Every result is compared pixel-for-pixel with a naive reference model that
+keeps a full copy of each state, and memory use and per-operation latency
+are held to fixed bounds. Document-level layer operations mixed with pixel
+edits are checked the same way. Only the history and document modules are
+imported, so the suite runs headless without Tk.
+
+Run from the repository root:
+
+    python -m pytest -q tests/test_undo.py
+"""
+
+import gc
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw, ImageFilter
+
+from app.core import Document
+from app.history import HistoryManager
+from app.tile_store import get_tile_memory
+from app.tiles import TILE_SIZE
+from app.utils import image_view, pixel_buffer
+
+LARGE_CANVAS = (2400, 1600)
+STEPS = 150
+
+# Generous bounds - they catch regressions to full-image copies or PNG
+# encoding, not a slow machine
+MAX_PUSH_REGION_P95_MS = 150
+MAX_PUSH_P95_MS = 600
+MAX_UNDO_REDO_P95_MS = 400
+MAX_DEPTH_SLOWDOWN = 3.0
+
+
+def make_layer(size, seed=0):
+    """Photo-like RGBA layer: gradients plus a little smoothed noise"""
+    width, height = size
+    rng = np.random.default_rng(seed)
+    pixels = np.empty((height, width, 4), dtype=np.uint8)
+    pixels[..., 0] = np.linspace(0, 255, width, dtype=np.float32)
+    pixels[..., 1] = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    pixels[..., 2] = 128
+    pixels[..., 3] = 255
+    pixels[..., :3] = np.clip(pixels[..., :3] + rng.integers(-8, 8, (height, width, 3)), 0, 255)
+    return Image.fromarray(pixels).filter(ImageFilter.SMOOTH)
+
+
+def same_pixels(a, b):
+    return a.size == b.size and a.mode == b.mode and np.array_equal(np.asarray(a), np.asarray(b))
+
+
+class ReferenceHistory:
+    """Naive model: a full copy of the image for every undo and redo state"""
+
+    def __init__(self, max_history):
+        self.max_history = max_history
+        self.undo_states = []
+        self.redo_states = []
+
+    def push(self, image):
+        self.undo_states.append(image.copy())
+        if len(self.undo_states) > self.max_history:
+            self.undo_states.pop(0)
+        self.redo_states.clear()
+
+    def undo(self, image):
+        if not self.undo_states:
+            return None
+        self.redo_states.append(image.copy())
+        return self.undo_states.pop()
+
+    def redo(self, image):
+        if not self.redo_states:
+            return None
+        self.undo_states.append(image.copy())
+        return self.redo_states.pop()
+
+
+def random_box(rng, size, max_extent=400):
+    x1 = rng.randint(0, size[0] - 2)
+    y1 = rng.randint(0, size[1] - 2)
+    x2 = min(size[0], x1 + rng.randint(1, max_extent))
+    y2 = min(size[1], y1 + rng.randint(1, max_extent))
+    return (x1, y1, x2, y2)
+
+
+def paint(image, box, rng):
+    """Stand-in for a tool: changes pixels strictly inside ``box``"""
+    color = tuple(rng.randint(0, 255) for _ in range(4))
+    draw = ImageDraw.Draw(image)
+    if rng.random() < 0.5:
+        draw.rectangle((box[0], box[1], box[2] - 1, box[3] - 1), fill=color)
+    else:
+        draw.ellipse((box[0], box[1], box[2] - 1, box[3] - 1), fill=color)
+
+
+def run_sequence(seed, size=LARGE_CANVAS, steps=STEPS, max_history=30, history=None, buffer_view=False):
+    """Drive a HistoryManager and the reference model with the same random operations
+
+    With ``buffer_view`` the image is a NumPy-backed layer view, as in the app.
+    Returns the manager, the final image and per-operation latencies (seconds).
+    """
+    rng = random.Random(seed)
+    history = history or HistoryManager(max_history=max_history)
+    reference = ReferenceHistory(max_history)
+    image = make_layer(size, seed)
+    if buffer_view:
+        image = image_view(np.array(image))
+    timings = {'push': [], 'push_region': [], 'undo': [], 'redo': []}
+
+    for step in range(steps):
+        op = rng.choice(['push', 'push_region', 'push_region', 'undo', 'undo', 'redo'])
+
+        if op in ('push', 'push_region'):
+            box = random_box(rng, size)
+            start = time.perf_counter()
+            ok = history.push(image, "Fill") if op == 'push' else history.push_region(image, box, "Stroke")
+            timings[op].append(time.perf_counter() - start)
+            assert ok, (seed, step, op)
+            reference.push(image)
+            paint(image, box, rng)
+            continue
+
+        expected = getattr(reference, op)(image)
+        start = time.perf_counter()
+        image, ok, bbox = getattr(history, op)(image)
+        timings[op].append(time.perf_counter() - start)
+
+        assert ok == (expected is not None), (seed, step, op)
+        if ok:
+            assert same_pixels(image, expected), (seed, step, op)
+
+    # Unwind everything that is left and replay it forward again
+    while reference.undo_states:
+        expected = reference.undo(image)
+        image, ok, _ = history.undo(image)
+        assert ok and same_pixels(image, expected), (seed, 'unwind')
+    assert not history.undo(image)[1]
+
+    while reference.redo_states:
+        expected = reference.redo(image)
+        image, ok, _ = history.redo(image)
+        assert ok and same_pixels(image, expected), (seed, 'rewind')
+    assert not history.redo(image)[1]
+
+    return history, image, timings
+
+
+def p95(samples):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+
+@pytest.fixture
+def memory_budget():
+    """Temporarily shrink the shared history budget (in bytes) to force spilling"""
+    memory = get_tile_memory()
+    original = memory.budget_bytes
+
+    def set_budget(budget_bytes):
+        memory.set_budget(budget_bytes)
+        return memory
+
+    yield set_budget
+    memory.flush()
+    memory.set_budget(original)
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_random_sequence_matches_reference(seed):
+    run_sequence(seed)
+
+
+def test_layer_buffer_sequence_matches_reference():
+    history, image, _ = run_sequence(5, buffer_view=True)
+    # Restores write into the layer buffer instead of replacing the image
+    assert pixel_buffer(image) is not None
+
+
+@pytest.mark.parametrize("max_history", [1, 4])
+def test_eviction_matches_reference(max_history):
+    history, _, _ = run_sequence(10 + max_history, steps=100, max_history=max_history)
+    assert len(history.history_stack) <= max_history
+
+
+def test_spilled_history_matches_reference(memory_budget):
+    budget = 2 * 1024 * 1024
+    memory = memory_budget(budget)
+
+    history, _, _ = run_sequence(20, steps=120)
+    memory.flush()
+
+    stats = history.get_performance_stats()
+    assert stats['spills'] > 0
+    assert memory.resident_bytes <= budget
+
+
+def test_history_memory_is_bounded():
+    size = LARGE_CANVAS
+    raw_bytes = size[0] * size[1] * 4
+    history, _, _ = run_sequence(30, steps=200, max_history=30)
+
+    stats = history.get_performance_stats()
+    tiles_per_image = -(-size[0] // TILE_SIZE) * -(-size[1] // TILE_SIZE)
+    # Unchanged tiles are shared, so 30 states hold far fewer than 30 images' worth of tiles
+    assert stats['unique_tiles'] < 5 * tiles_per_image
+    # ...and what they do hold is compressed
+    assert stats['memory_bytes'] + stats['disk_bytes'] < 2 * raw_bytes
+
+
+def test_released_history_frees_its_tiles():
+    memory = get_tile_memory()
+    memory.flush()
+    before = memory.resident_bytes
+
+    history, _, _ = run_sequence(40, steps=60)
+    assert memory.resident_bytes > before
+
+    history.clear()
+    memory.flush()
+    assert memory.resident_bytes == before
+
+    del history
+    gc.collect()
+
+
+def test_noop_push_stores_no_new_tiles():
+    history = HistoryManager()
+    image = make_layer(LARGE_CANVAS)
+    history.push(image, "Open")
+    tiles = history.get_performance_stats()['unique_tiles']
+
+    # A stroke that changes nothing, and an undo/redo round trip
+    history.push(image, "No-op")
+    history.push_region(image, (100, 100, 600, 500), "No-op stroke")
+    image, _, _ = history.undo(image)
+    image, _, _ = history.redo(image)
+
+    assert history.get_performance_stats()['unique_tiles'] == tiles
+
+
+def test_version_changes_only_when_undo_or_redo_swaps_state():
+    history = HistoryManager()
+    image = make_layer((300, 200))
+    version = history.version
+
+    # Nothing to undo or redo
+    assert not history.undo(image)[1] and not history.redo(image)[1]
+    assert history.version == version
+
+    history.push(image, "Fill")
+    image = image.transpose(Image.Transpose.FLIP_TOP_BOTTOM)
+    version = history.version
+    image, ok, _ = history.undo(image)
+    assert ok and history.version == version + 1
+    assert not history.undo(image)[1] and history.version == version + 1
+    image, ok, _ = history.redo(image)
+    assert ok and history.version == version + 2
+
+    history.clear()
+
+    # Layer transactions are refused by the image-level calls
+    doc = Document(width=300, height=200)
+    doc.add_layer("Top")
+    history = doc.history_manager
+    version = history.version
+    assert not history.undo(doc.layers[0].image)[1] and history.version == version
+    assert doc.undo()[0] and history.version == version + 1
+    assert not history.redo(doc.layers[0].image)[1] and history.version == version + 1
+    history.clear()
+
+
+def document_state(doc):
+    """Full copy of everything layer history restores: stack, properties, pixels, active layer"""
+    return (
+        doc.active_layer_index,
+        [(layer.get_properties(), np.array(layer.pixels)) for layer in doc.layers],
+    )
+
+
+def same_document(doc, state):
+    active, layers = state
+    return doc.active_layer_index == active and len(doc.layers) == len(layers) and all(
+        layer.get_properties() == props and np.array_equal(layer.pixels, pixels)
+        for layer, (props, pixels) in zip(doc.layers, layers)
+    )
+
+
+def random_layer_step(doc, rng):
+    """One random layer operation or pixel edit; returns (recorded, coalesce key)"""
+    count = len(doc.layers)
+    index = rng.randrange(count)
+    op = rng.choice(['add', 'delete', 'duplicate', 'move', 'merge', 'opacity', 'opacity', 'opacity',
+                     'visible', 'blend', 'paint', 'paint'])
+
+    if op == 'add':
+        doc.add_layer(index=rng.randint(0, count))
+        return True, None
+    if op == 'delete':
+        return doc.delete_layer(index), None
+    if op == 'duplicate':
+        doc.duplicate_layer(index)
+        return True, None
+    if op == 'move':
+        return doc.move_layer(index, rng.randrange(count)), None
+    if op == 'merge':
+        return doc.merge_down(index), None
+    if op == 'paint':
+        layer = doc.layers[index]
+        box = random_box(rng, layer.size, max_extent=80)
+        assert doc.history_manager.push(layer.image, "Paint", layer=layer)
+        paint(layer.image, box, rng)
+        return True, None
+
+    # Property changes - repeats to the same layer and property merge into one entry
+    name, value = {
+        'opacity': ('opacity', rng.choice([0.25, 0.5, 0.75, 1.0])),
+        'visible': ('visible', not doc.layers[index].visible),
+        'blend': ('blend_mode', rng.choice(["Normal", "Multiply", "Screen"])),
+    }[op]
+    return doc.set_layer_property(index, name, value), (doc.layers[index], name)
+
+
+@pytest.mark.parametrize("seed", [1, 2, 3])
+def test_layer_operations_match_reference(seed):
+    rng = random.Random(seed)
+    doc = Document(width=160, height=120)
+    doc.history_manager.max_history = 12
+    max_history = doc.history_manager.max_history
+    undo_states, redo_states = [], []  # (full document state, coalesce key of its entry)
+
+    for step in range(120):
+        choice = rng.random()
+        if choice < 0.2:
+            before = document_state(doc)
+            ok, _ = doc.undo()
+            assert ok == bool(undo_states), (seed, step)
+            if ok:
+                state, key = undo_states.pop()
+                redo_states.append((before, key))
+                assert same_document(doc, state), (seed, step, 'undo')
+            continue
+        if choice < 0.3:
+            before = document_state(doc)
+            ok, _ = doc.redo()
+            assert ok == bool(redo_states), (seed, step)
+            if ok:
+                state, key = redo_states.pop()
+                undo_states.append((before, key))
+                assert same_document(doc, state), (seed, step, 'redo')
+            continue
+
+        before = document_state(doc)
+        recorded, key = random_layer_step(doc, rng)
+        if not recorded:
+            assert same_document(doc, before), (seed, step, 'no-op')
+            continue
+        if key is not None and not redo_states and undo_states and undo_states[-1][1] == key:
+            continue  # Coalesced into the previous entry - undo still goes back past both
+        undo_states.append((before, key))
+        if len(undo_states) > max_history:
+            undo_states.pop(0)
+        redo_states.clear()
+
+    # Unwind everything that is left and replay it forward again
+    while undo_states:
+        before = document_state(doc)
+        assert doc.undo()[0]
+        state, key = undo_states.pop()
+        redo_states.append((before, key))
+        assert same_document(doc, state), (seed, 'unwind')
+    assert not doc.undo()[0]
+    while redo_states:
+        assert doc.redo()[0]
+        state, _ = redo_states.pop()
+        assert same_document(doc, state), (seed, 'rewind')
+    assert not doc.redo()[0]
+    doc.history_manager.clear()
+
+
+def test_operation_latency():
+    _, _, timings = run_sequence(50, steps=200)
+
+    assert p95(timings['push_region']) * 1000 < MAX_PUSH_REGION_P95_MS
+    assert p95(timings['push']) * 1000 < MAX_PUSH_P95_MS
+    assert p95(timings['undo'] + timings['redo']) * 1000 < MAX_UNDO_REDO_P95_MS
+
+
+def test_push_cost_does_not_grow_with_depth():
+    size = (1024, 768)
+    rng = random.Random(60)
+
+    def mean_push_region(history, image, count):
+        samples = []
+        for _ in range(count):
+            box = random_box(rng, size, max_extent=100)
+            start = time.perf_counter()
+            history.push_region(image, box, "Stroke")
+            samples.append(time.perf_counter() - start)
+            paint(image, box, rng)
+        return statistics.median(samples)
+
+    shallow = HistoryManager(max_history=50)
+    shallow_cost = mean_push_region(shallow, make_layer(size), 100)
+
+    deep = HistoryManager(max_history=1000)
+    image = make_layer(size)
+    mean_push_region(deep, image, 900)
+    deep_cost = mean_push_region(deep, image, 100)
+
+    assert deep_cost < shallow_cost * MAX_DEPTH_SLOWDOWN + 0.002
+
+
+def test_history_imports_without_tk():
+    code = "import sys, app.history; assert 'tkinter' not in sys.modules"
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    subprocess.run([sys.executable, "-c", code], cwd=root, check=True)
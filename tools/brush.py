@@ -1,10 +1,69 @@
 # tools/brush.py - COMPLETE FIXED VERSION
 
-import numpy as np
 from PIL import Image, ImageDraw, ImageFilter
 import math
 import random
+import time
 from tools.base_tool import BaseTool
+from app.compositor import composite_layers
+from app.core import Layer
+from app.workers import get_thread_pool
+from app.utils import points_bbox
+
+
+# Brush types rendered as a single polyline instead of stamped tips
+LINE_BRUSH_TYPES = ("Round", "Soft Round", "Hard Round")
+
+# Headless tool instances used to replay recorded strokes, one per tool class
+_replay_tools = {}
+
+
+class StrokeCommand:
+    """**NEW: Replayable record of one committed stroke for command history**
+
+    Stores only the stroke points and the brush settings in effect when the
+    stroke was committed, so undo/redo can re-rasterize it instead of keeping
+    pixel copies around.
+    """
+
+    def __init__(self, tool_class, points, settings, bbox=None, action_name="Brush Stroke"):
+        self.tool_class = tool_class
+        self.points = list(points)
+        self.settings = dict(settings)
+        self.bbox = bbox
+        self.action_name = action_name
+        self.replay_cost = 0.0  # Seconds spent rasterizing, measured at commit
+
+    @property
+    def seed(self):
+        return self.settings.get('seed', 0)
+
+    def apply(self, image):
+        """Rasterize the recorded stroke on top of ``image`` and return the result"""
+        tool = self._tool()
+        try:
+            return tool.rasterize_stroke(image, self.settings['color'])
+        finally:
+            tool.stroke_points = []
+
+    def paint(self, layer):
+        """Rasterize the recorded stroke into ``layer`` in place; returns the bbox written"""
+        tool = self._tool()
+        try:
+            return tool.paint_stroke(layer, self.settings['color'])
+        finally:
+            tool.stroke_points = []
+
+    def _tool(self):
+        tool = _replay_tools.get(self.tool_class)
+        if tool is None:
+            tool = self.tool_class(None)
+            _replay_tools[self.tool_class] = tool
+
+        tool.load_settings(self.settings)
+        tool.stroke_points = list(self.points)
+        return tool
+
 
 class MasterBrushTool(BaseTool):
     def __init__(self, app):
@@ -28,6 +87,9 @@ class MasterBrushTool(BaseTool):
         self.texture_intensity = 50
         self.grain = 25
         
+        # Seed for randomized tips (Texture, Charcoal, Spatter) so strokes replay identically
+        self.brush_seed = random.randrange(1 << 30)
+        
         # Drawing state
         self.drawing = False
         self.last_point = None
@@ -39,6 +101,18 @@ class MasterBrushTool(BaseTool):
         self.temp_stroke_image = None
         self.stroke_started = False
         
+        # **NEW: Rasterize the live preview at display scale over the renderer's
+        # cached display image; full resolution is only rendered on commit**
+        self.display_resolution_preview = True
+        
+        # **NEW: Opt-in low-latency preview - round brushes are previewed as Tk
+        # canvas line items (no raster work per event), rasterized once on commit**
+        self.vector_preview = False
+        
+        # **NEW: Large brushes rasterize stamps in parallel tiles**
+        self.tiled_stamp_min_size = 128
+        self.stamp_tile_size = 256
+        
         print("✅ Fixed Master Brush initialized")
 
     def on_activate(self):
@@ -51,6 +125,9 @@ class MasterBrushTool(BaseTool):
     def on_mouse_down(self, x, y, modifiers):
         if not self.app.active_document:
             return
+        if self.app.active_document.loading:
+            print("⏳ Still loading full resolution - try again in a moment")
+            return
             
         img_x, img_y = self.canvas_to_image(x, y)
         if img_x is None:
@@ -60,6 +137,7 @@ class MasterBrushTool(BaseTool):
         self.stroke_started = False
         self.last_point = (img_x, img_y)
         self.stroke_points = [(img_x, img_y)]
+        self.clear_vector_preview()
         
         print(f"🖱️ Mouse DOWN at image: ({img_x}, {img_y})")
         
@@ -89,6 +167,7 @@ class MasterBrushTool(BaseTool):
             
         print(f"🖱️ Mouse UP - Committing {len(self.stroke_points)} points")
         self.drawing = False
+        self.clear_vector_preview()
         
         if len(self.stroke_points) > 1:
             self.commit_quality_stroke()
@@ -137,17 +216,19 @@ class MasterBrushTool(BaseTool):
             active_doc = self.app.active_document
             if not active_doc or not active_doc.layers:
                 return
-                
-            base_image = active_doc.layers[0].image.copy()
-            temp_image = Image.new("RGBA", base_image.size, (0, 0, 0, 0))
             
-            if self.brush_type in ["Round", "Soft Round", "Hard Round"]:
-                self.draw_line_stroke(temp_image)
-            else:
-                self.draw_stamped_stroke(temp_image)
+            if self.vector_preview and self.brush_type in LINE_BRUSH_TYPES and self.draw_vector_preview():
+                return
             
-            composite = Image.alpha_composite(base_image, temp_image)
-            self.temp_stroke_image = temp_image
+            if self.display_resolution_preview and self.draw_display_preview():
+                return
+                
+            # The stroke goes onto the active layer, as on commit, seen through the rest of the stack
+            active_layer = active_doc.active_layer
+            stroked = Layer.from_image(active_layer.name, self.rasterize_stroke(active_layer.image))
+            stroked.set_properties(active_layer.get_properties())
+            layers = [stroked if layer is active_layer else layer for layer in active_doc.layers]
+            composite = composite_layers(layers) or stroked.image
             
             if hasattr(self.app.renderer, 'temporary_display'):
                 self.app.renderer.temporary_display(composite)
@@ -155,10 +236,79 @@ class MasterBrushTool(BaseTool):
         except Exception as e:
             print(f"❌ Preview error: {e}")
 
-    def draw_line_stroke(self, image):
+    def draw_vector_preview(self):
+        """**NEW: Preview the newest stroke segment as a canvas line item**
+
+        Only the last segment is added per mouse event, so there is no raster
+        work and no PhotoImage rebuild while dragging. Returns False when no
+        canvas is available.
+        """
+        renderer = self.app.renderer
+        canvas = getattr(renderer, 'canvas', None)
+        if canvas is None:
+            return False
+        
+        zoom = renderer.zoom_level
+        (x1, y1), (x2, y2) = self.stroke_points[-2], self.stroke_points[-1]
+        
+        # Tk has no per-item alpha, so opacity is approximated with a stipple
+        opacity = self.brush_opacity
+        stipple = "" if opacity > 75 else "gray75" if opacity > 50 else "gray50" if opacity > 25 else "gray25"
+        
+        canvas.create_line(
+            renderer.last_image_x + x1 * zoom, renderer.last_image_y + y1 * zoom,
+            renderer.last_image_x + x2 * zoom, renderer.last_image_y + y2 * zoom,
+            fill=self.get_preview_fill(),
+            width=max(1, self.brush_size * zoom),
+            capstyle="round",
+            joinstyle="round",
+            stipple=stipple,
+            tags=("stroke_preview",)
+        )
+        return True
+
+    def get_preview_fill(self):
+        """Tk color used for vector previews"""
+        r, g, b, _ = self.get_brush_color()
+        return f"#{r:02x}{g:02x}{b:02x}"
+
+    def clear_vector_preview(self):
+        """Remove vector preview items from the canvas"""
+        renderer = getattr(self.app, 'renderer', None) if self.app else None
+        canvas = getattr(renderer, 'canvas', None)
+        if canvas is not None:
+            canvas.delete("stroke_preview")
+
+    def draw_display_preview(self):
+        """**NEW: Rasterize the in-progress stroke at the current display scale**
+
+        Draws over the renderer's cached display image, so the per-event cost
+        scales with the on-screen size instead of the document size.
+        Returns False when no display image is available.
+        """
+        renderer = self.app.renderer
+        display_base = getattr(renderer, 'current_image', None)
+        if display_base is None or not hasattr(renderer, 'display_preview'):
+            return False
+        
+        zoom = renderer.zoom_level
+        points = self.stroke_points
+        size = self.brush_size
+        try:
+            self.stroke_points = [(x * zoom, y * zoom) for x, y in points]
+            self.brush_size = max(1, int(round(size * zoom)))
+            preview = self.rasterize_stroke(display_base.convert("RGBA"))
+        finally:
+            self.stroke_points = points
+            self.brush_size = size
+        
+        renderer.display_preview(preview)
+        return True
+
+    def draw_line_stroke(self, image, color=None):
         """Draw stroke using line method"""
         draw = ImageDraw.Draw(image)
-        color = self.get_brush_color()
+        color = color or self.get_brush_color()
         
         if len(self.stroke_points) >= 2:
             if self.brush_type == "Soft Round":
@@ -168,12 +318,25 @@ class MasterBrushTool(BaseTool):
             else:
                 draw.line(self.stroke_points, fill=color, width=self.brush_size, joint="curve")
 
-    def draw_stamped_stroke(self, image):
+    def draw_stamped_stroke(self, image, color=None):
         """Draw stroke using brush stamping"""
         if len(self.stroke_points) < 2:
             return
             
-        color = self.get_brush_color()
+        color = color or self.get_brush_color()
+        stamps = self.get_stamp_positions()
+        
+        if self.brush_size >= self.tiled_stamp_min_size:
+            self.draw_stamps_tiled(image, stamps, color)
+            return
+        
+        for x, y in stamps:
+            self.draw_brush_stamp(image, x, y, color)
+
+    def get_stamp_positions(self):
+        """Stamp centers along the stroke, in drawing order"""
+        stamps = []
+        spacing = max(2, self.brush_size // 3)
         
         for i in range(len(self.stroke_points) - 1):
             start = self.stroke_points[i]
@@ -183,15 +346,79 @@ class MasterBrushTool(BaseTool):
             dy = end[1] - start[1]
             distance = max(1, math.sqrt(dx*dx + dy*dy))
             
-            spacing = max(2, self.brush_size // 3)
             num_stamps = max(2, int(distance / spacing))
             
             for j in range(num_stamps):
                 t = j / (num_stamps - 1) if num_stamps > 1 else 0
-                x = int(start[0] + dx * t)
-                y = int(start[1] + dy * t)
-                
-                self.draw_brush_stamp(image, x, y, color)
+                stamps.append((int(start[0] + dx * t), int(start[1] + dy * t)))
+        
+        return stamps
+
+    def draw_stamps_tiled(self, image, stamps, color):
+        """**NEW: Rasterize stamps tile by tile on the shared thread pool**
+
+        The stroke's bounding box is split into tiles and every stamp is
+        assigned to the tiles it overlaps. Each tile composites its stamps in
+        stroke order, so the result is identical to stamping serially.
+        """
+        brush_tip = self.get_brush_tip()
+        if not brush_tip:
+            return
+        
+        # Same clipping and tip resizing as draw_brush_stamp
+        radius = self.brush_size // 2
+        colored_tips = {}
+        rects = []
+        for x, y in stamps:
+            x1 = max(0, x - radius)
+            y1 = max(0, y - radius)
+            x2 = min(image.width, x + radius + 1)
+            y2 = min(image.height, y + radius + 1)
+            tip_size = (x2 - x1, y2 - y1)
+            if tip_size[0] <= 0 or tip_size[1] <= 0:
+                continue
+            if tip_size not in colored_tips:
+                resized_tip = brush_tip.resize(tip_size, Image.Resampling.LANCZOS)
+                colored_tips[tip_size] = self.colorize_brush_tip(resized_tip, color)
+            rects.append((x1, y1, x2, y2))
+        
+        if not rects:
+            return
+        
+        tile = self.stamp_tile_size
+        min_x = min(r[0] for r in rects)
+        min_y = min(r[1] for r in rects)
+        max_x = max(r[2] for r in rects)
+        max_y = max(r[3] for r in rects)
+        
+        # Assign stamps to overlapping tiles, preserving stroke order
+        tiles = {}
+        for rect in rects:
+            for ty in range((rect[1] - min_y) // tile, (rect[3] - 1 - min_y) // tile + 1):
+                for tx in range((rect[0] - min_x) // tile, (rect[2] - 1 - min_x) // tile + 1):
+                    tiles.setdefault((tx, ty), []).append(rect)
+        
+        def render_tile(key, tile_rects):
+            tx1 = min_x + key[0] * tile
+            ty1 = min_y + key[1] * tile
+            tile_box = (tx1, ty1, min(tx1 + tile, max_x), min(ty1 + tile, max_y))
+            tile_image = image.crop(tile_box)
+            
+            for x1, y1, x2, y2 in tile_rects:
+                ix1, iy1 = max(x1, tile_box[0]), max(y1, tile_box[1])
+                ix2, iy2 = min(x2, tile_box[2]), min(y2, tile_box[3])
+                tile_image.alpha_composite(
+                    colored_tips[(x2 - x1, y2 - y1)],
+                    dest=(ix1 - tile_box[0], iy1 - tile_box[1]),
+                    source=(ix1 - x1, iy1 - y1, ix2 - x1, iy2 - y1)
+                )
+            return tile_box, tile_image
+        
+        pool = get_thread_pool()
+        futures = [pool.submit(render_tile, key, tile_rects) for key, tile_rects in tiles.items()]
+        for future in futures:
+            tile_box, tile_image = future.result()
+            image.paste(tile_image, tile_box[:2])
 
     def draw_brush_stamp(self, image, x, y, color):
         """Draw a single brush stamp"""
@@ -220,11 +447,14 @@ class MasterBrushTool(BaseTool):
 
     def get_brush_tip(self):
         """Generate brush tip"""
-        cache_key = f"{self.brush_type}_{self.brush_size}_{self.brush_hardness}"
+        cache_key = f"{self.brush_type}_{self.brush_size}_{self.brush_hardness}_{self.brush_seed}"
         
         if cache_key in self.brush_cache:
             return self.brush_cache[cache_key].copy()
         
+        # Randomized tips draw from a seeded generator so replays match the original stroke
+        self.rng = random.Random(cache_key)
+        
         try:
             if self.brush_type == "Round":
                 brush_tip = self.create_round_brush()
@@ -299,8 +529,8 @@ class MasterBrushTool(BaseTool):
         
         for x in range(0, texture.width, 3):
             for y in range(0, texture.height, 3):
-                if random.random() < self.texture_intensity/100:
-                    texture.putpixel((x, y), random.randint(150, 200))
+                if self.rng.random() < self.texture_intensity/100:
+                    texture.putpixel((x, y), self.rng.randint(150, 200))
         
         textured = Image.blend(base, texture, 0.3)
         return textured
@@ -312,8 +542,8 @@ class MasterBrushTool(BaseTool):
         
         for x in range(0, charcoal.width, 2):
             for y in range(0, charcoal.height, 2):
-                if random.random() < 0.7:
-                    charcoal.putpixel((x, y), random.randint(150, 200))
+                if self.rng.random() < 0.7:
+                    charcoal.putpixel((x, y), self.rng.randint(150, 200))
         
         return Image.blend(base, charcoal, 0.4)
 
@@ -329,14 +559,14 @@ class MasterBrushTool(BaseTool):
         brush = Image.new("L", (size, size), 0)
         
         for i in range(size // 3):
-            center_x = random.randint(0, size-1)
-            center_y = random.randint(0, size-1)
-            splatter_size = random.randint(size//4, size//2)
+            center_x = self.rng.randint(0, size-1)
+            center_y = self.rng.randint(0, size-1)
+            splatter_size = self.rng.randint(size//4, size//2)
             
             draw = ImageDraw.Draw(brush)
             for r in range(splatter_size, 0, -1):
-                if random.random() < 0.7:
-                    alpha = random.randint(100, 200)
+                if self.rng.random() < 0.7:
+                    alpha = self.rng.randint(100, 200)
                     bbox = [center_x-r, center_y-r, center_x+r, center_y+r]
                     draw.ellipse(bbox, fill=alpha)
         
@@ -369,6 +599,96 @@ class MasterBrushTool(BaseTool):
         print("🔄 Starting new stroke")
         self.stroke_started = True
 
+    def capture_settings(self):
+        """**NEW: Snapshot of everything needed to replay a stroke**"""
+        return {
+            'brush_type': self.brush_type,
+            'brush_size': self.brush_size,
+            'brush_hardness': self.brush_hardness,
+            'brush_opacity': self.brush_opacity,
+            'texture_intensity': self.texture_intensity,
+            'grain': self.grain,
+            'seed': self.brush_seed,
+            'color': self.get_brush_color(),
+        }
+
+    def load_settings(self, settings):
+        """Apply settings captured by ``capture_settings``"""
+        self.brush_type = settings['brush_type']
+        self.brush_size = settings['brush_size']
+        self.brush_hardness = settings['brush_hardness']
+        self.brush_opacity = settings['brush_opacity']
+        self.texture_intensity = settings['texture_intensity']
+        self.grain = settings['grain']
+        self.brush_seed = settings['seed']
+
+    def render_stroke(self, size, color=None):
+        """The current stroke alone, on a transparent image of ``size``"""
+        temp_image = Image.new("RGBA", size, (0, 0, 0, 0))
+        
+        if self.brush_type in LINE_BRUSH_TYPES:
+            self.draw_line_stroke(temp_image, color)
+        else:
+            self.draw_stamped_stroke(temp_image, color)
+        
+        return temp_image
+
+    def stroke_composite(self, base_image, stroke_image):
+        """Apply a rendered stroke to the pixels under it"""
+        return Image.alpha_composite(base_image, stroke_image)
+
+    def rasterize_stroke(self, base_image, color=None):
+        """Render the current stroke points onto ``base_image`` and return the result"""
+        return self.stroke_composite(base_image, self.render_stroke(base_image.size, color))
+
+    def stroke_region(self, size):
+        """Box holding every pixel the current stroke can touch, clipped to ``size``
+
+        The margin covers a whole stamp around every point, so no stamp is
+        clipped by the box unless the canvas clips it too.
+        """
+        bbox = points_bbox(self.stroke_points, self.brush_size // 2 + 2, size)
+        if bbox is None or bbox[0] >= bbox[2] or bbox[1] >= bbox[3]:
+            return None
+        return bbox
+
+    def paint_stroke(self, layer, color=None):
+        """**NEW: Rasterize the current stroke straight into ``layer``**
+
+        The stroke is rendered into a buffer the size of its bounding box and
+        composited into the layer band by band, so committing costs the
+        stroke's area rather than the canvas's, and out-of-core layers only
+        page in the rows it covers. Pixel-identical to ``rasterize_stroke``.
+        Returns the box written, or None.
+        """
+        bbox = self.stroke_region(layer.size)
+        if bbox is None:
+            return None
+        
+        x1, y1, x2, y2 = bbox
+        points = self.stroke_points
+        try:
+            self.stroke_points = [(x - x1, y - y1) for x, y in points]
+            stroke = self.render_stroke((x2 - x1, y2 - y1), color)
+        finally:
+            self.stroke_points = points
+        
+        def update(region, box):
+            return self.stroke_composite(region, stroke.crop((0, box[1] - y1, x2 - x1, box[3] - y1)))
+        
+        layer.update_region(bbox, update)
+        return bbox
+
+    def create_stroke_command(self, action_name="Brush Stroke"):
+        """Build a replayable history command for the current stroke"""
+        return StrokeCommand(
+            type(self),
+            self.stroke_points,
+            self.capture_settings(),
+            bbox=self.get_affected_bbox(),
+            action_name=action_name
+        )
+
     def commit_quality_stroke(self):
         """FINAL FIX: Permanently save stroke to layer"""
         if not self.app.active_document:
@@ -377,30 +697,25 @@ class MasterBrushTool(BaseTool):
             
         try:
             active_doc = self.app.active_document
-            active_layer = active_doc.layers[0]
+            layer_index = max(0, min(active_doc.active_layer_index, len(active_doc.layers) - 1))
+            active_layer = active_doc.layers[layer_index]
 
             print(f"💾 Committing stroke to layer: {active_layer.name}")
 
+            command = self.create_stroke_command("Brush Stroke")
+
             # **FIXED: Save to history BEFORE modification**
             if hasattr(active_doc, 'history_manager'):
-                # **FIXED: Use simple push without region check**
-                active_doc.history_manager.push(active_layer.image.copy(), "Brush Stroke")
+                active_doc.history_manager.push_command(command, active_layer.image, layer=active_layer)
                 print("✅ History saved")
 
-            # Create the stroke on a temporary image
-            temp_image = Image.new("RGBA", active_layer.image.size, (0, 0, 0, 0))
-            
-            # Draw the actual stroke
-            if self.brush_type in ["Round", "Soft Round", "Hard Round"]:
-                self.draw_line_stroke(temp_image)
-            else:
-                self.draw_stamped_stroke(temp_image)
-
-            # Composite and REPLACE the layer image
-            composite = Image.alpha_composite(active_layer.image, temp_image)
-            active_layer.image = composite  # Complete replacement
+            # **UPDATED: Rasterize into the stroke's bbox and write it into the layer
+            # in place** - timed so history can place the next replay checkpoint
+            start_time = time.perf_counter()
+            command.paint(active_layer)
+            command.replay_cost = time.perf_counter() - start_time
             
-            print(f"✅ Layer image replaced with new composite")
+            print(f"✅ Layer image updated with new composite")
 
             # **FIXED: Force renderer refresh**
             if hasattr(self.app, 'renderer') and self.app.renderer:
@@ -439,9 +754,9 @@ class MasterBrushTool(BaseTool):
         if not active_doc or not active_doc.layers:
             return None, None
             
-        layer = active_doc.layers[0]
+        layer = active_doc.active_layer
         
-        if (img_x < 0 or img_y < 0 or img_x >= layer.image.width or img_y >= layer.image.height):
+        if (img_x < 0 or img_y < 0 or img_x >= layer.size[0] or img_y >= layer.size[1]):
             return None, None
             
         return int(img_x), int(img_y)
@@ -452,21 +767,11 @@ class MasterBrushTool(BaseTool):
             return None
             
         try:
-            points = np.array(self.stroke_points)
-            min_x, min_y = points.min(axis=0)
-            max_x, max_y = points.max(axis=0)
-            
-            margin = self.brush_size
-            
+            # **UPDATED: Plain min/max over the points - no array is built per call**
             active_doc = self.app.active_document
             if active_doc and active_doc.layers:
-                layer = active_doc.layers[0]
-                return (
-                    max(0, int(min_x - margin)),
-                    max(0, int(min_y - margin)),
-                    min(layer.image.width, int(max_x + margin)),
-                    min(layer.image.height, int(max_y + margin))
-                )
+                # At least the margin ``stroke_region`` paints within, so tiny brushes are covered
+                return points_bbox(self.stroke_points, self.brush_size + 2, active_doc.active_layer.size)
         except:
             return None
             
@@ -1,8 +1,10 @@
 # tools/eraser.py - COMPLETE ERASER TOOL
 
+import time
 import numpy as np
-from PIL import Image, ImageDraw, ImageFilter
+from PIL import Image
 from tools.brush import MasterBrushTool
+from app.utils import pixels_from_image, image_view
 
 class EraserTool(MasterBrushTool):
     def __init__(self, app):
@@ -24,6 +26,16 @@ class EraserTool(MasterBrushTool):
         """Eraser uses transparent color to remove pixels"""
         return (0, 0, 0, 0)  # Fully transparent
 
+    def get_preview_fill(self):
+        """Erased pixels show the canvas background through the image"""
+        return self.app.renderer.canvas.cget("bg")
+
+    def stroke_composite(self, base_image, stroke_image):
+        """Apply the eraser stroke with destination-out composition"""
+        # For eraser, we use destination-out composition
+        # This properly removes pixels instead of just adding transparency
+        return self.eraser_composite(base_image, stroke_image)
+
     def commit_quality_stroke(self):
         """Eraser commit with history"""
         if not self.app.active_document:
@@ -31,24 +43,18 @@ class EraserTool(MasterBrushTool):
             
         try:
             active_doc = self.app.active_document
-            active_layer = active_doc.layers[0]
+            layer_index = max(0, min(active_doc.active_layer_index, len(active_doc.layers) - 1))
+            active_layer = active_doc.layers[layer_index]
+            
+            command = self.create_stroke_command("Eraser Stroke")
             
             # ✅ SAVE STATE BEFORE ERASING
             if hasattr(active_doc, 'history_manager'):
-                active_doc.history_manager.push(active_layer.image.copy(), "Eraser Stroke")
+                active_doc.history_manager.push_command(command, active_layer.image, layer=active_layer)
             
-            # Use same method as brush but with transparent color
-            temp_image = Image.new("RGBA", active_layer.image.size, (0, 0, 0, 0))
-            
-            if self.brush_type in ["Round", "Soft Round", "Hard Round"]:
-                self.draw_line_stroke(temp_image)
-            else:
-                self.draw_stamped_stroke(temp_image)
-            
-            # For eraser, we use destination-out composition
-            # This properly removes pixels instead of just adding transparency
-            result = self.eraser_composite(active_layer.image, temp_image)
-            active_layer.image.paste(result)
+            start_time = time.perf_counter()
+            command.paint(active_layer)
+            command.replay_cost = time.perf_counter() - start_time
             
             # Update display
             self.app.renderer.render(force=True)
@@ -61,20 +67,25 @@ class EraserTool(MasterBrushTool):
     def eraser_composite(self, base_image, erase_image):
         """Special composition for eraser - properly removes pixels"""
         try:
-            # Convert to arrays for pixel-level operations
-            base_array = np.array(base_image)
-            erase_array = np.array(erase_image)
+            # **UPDATED: One copy of the base pixels is the only full-size
+            # buffer - the alpha math runs in integers on the stroke's bbox**
+            result = pixels_from_image(base_image)
             
             # Get alpha channel from erase brush
-            erase_alpha = erase_array[:, :, 3]
-            
-            # Reduce alpha in base image where eraser touched
-            result_array = base_array.copy()
-            result_array[:, :, 3] = result_array[:, :, 3] * (1 - erase_alpha / 255.0)
+            erase_alpha = erase_image.getchannel('A')
+            bbox = erase_alpha.getbbox()
+            if bbox:
+                x1, y1, x2, y2 = bbox
+                erase = np.asarray(erase_alpha.crop(bbox), dtype=np.uint16)
+                
+                # Reduce alpha in base image where eraser touched
+                alpha = result[y1:y2, x1:x2, 3].astype(np.uint16)
+                alpha *= 255 - erase
+                alpha //= 255
+                result[y1:y2, x1:x2, 3] = alpha
             
-            # Convert back to PIL Image
-            result_image = Image.fromarray(result_array.astype('uint8'), 'RGBA')
-            return result_image
+            # Zero-copy PIL view of the result
+            return image_view(result)
             
         except Exception as e:
             print(f"❌ Eraser composite error: {e}")